@@ -0,0 +1,20 @@
+"""
+ASGI config for Battleships project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+Served this way, the strike, history, stream, getships and getwinner API calls use the async views in
+server/async_views.py, see Battleships/asgi_urls.py.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/stable/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Battleships.settings")
+os.environ.setdefault("BATTLESHIPS_URLCONF", "Battleships.asgi_urls")
+
+application = get_asgi_application()
@@ -0,0 +1,28 @@
+"""Battleships URL Configuration for ASGI
+
+The same URLs as Battleships/urls.py, but with async views for the busiest API calls, which do not tie up
+a thread while they wait. This is selected by Battleships/asgi.py.
+"""
+from django.urls import URLPattern
+
+from server import async_views
+from server import views
+
+from .urls import urlpatterns as sync_urlpatterns
+
+# The sync views to replace, and their async versions
+ASYNC_VIEWS = {
+    views.api_games_history: async_views.api_games_history,
+    views.api_games_stream: async_views.api_games_stream,
+    views.api_games_getships: async_views.api_games_getships,
+    views.api_games_getwinner: async_views.api_games_getwinner,
+    views.api_strike: async_views.api_strike,
+}
+
+urlpatterns = []
+for url_pattern in sync_urlpatterns:
+    callback = getattr(url_pattern, 'callback', None)
+    if callback in ASYNC_VIEWS:
+        url_pattern = URLPattern(url_pattern.pattern, ASYNC_VIEWS[callback], url_pattern.default_args,
+                                 url_pattern.name)
+    urlpatterns.append(url_pattern)
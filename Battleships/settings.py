@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'server.middleware.QueryStatsMiddleware',
+    'server.middleware.RateLimitMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,7 +52,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'Battleships.urls'
+# The ASGI entry point (asgi.py) selects URLs with async versions of the busiest API views
+ROOT_URLCONF = os.environ.get('BATTLESHIPS_URLCONF', 'Battleships.urls')
 
 TEMPLATES = [
     {
@@ -70,6 +73,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'Battleships.wsgi.application'
+ASGI_APPLICATION = 'Battleships.asgi.application'
 
 
 # Database
@@ -79,6 +83,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Tests use a file too, rather than memory, as SQLite only waits for locks held by other connections
+        # (other threads in the concurrency tests) with a file
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
@@ -123,3 +132,59 @@ STATIC_URL = '/static/'
 
 # New in Django 3.2, we should set an explicit automatic primary key type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Streaming game events (api/1.0/games/stream/)
+# The longest time in seconds a single stream is held open, clients should reconnect after this
+BATTLESHIPS_STREAM_TIMEOUT = 300
+# How often in seconds a stream checks the database, to catch strikes made in other processes
+BATTLESHIPS_STREAM_POLL_INTERVAL = 5
+
+# The number of games listed on each page of the landing page
+BATTLESHIPS_INDEX_PAGE_SIZE = 50
+
+# Rate limits for the API (see server/ratelimit.py). Each client may make "burst" requests at once, and then
+# "rate" requests a second. Requests are limited by IP address, and also by player where the URL names one,
+# set either to None to turn it off
+BATTLESHIPS_RATE_LIMITS = {
+    'ip': {'rate': 100, 'burst': 200},
+    'player': {'rate': 20, 'burst': 40},
+}
+# Where the limits are kept, "server.ratelimit.LocalStore" in each process, or "server.ratelimit.CacheStore" in
+# the cache named below, which is shared between worker processes if the cache is
+BATTLESHIPS_RATE_LIMIT_STORE = 'server.ratelimit.LocalStore'
+BATTLESHIPS_RATE_LIMIT_CACHE = 'default'
+
+# The largest number of operations allowed in a single call to api/1.0/batch/. Batches are also refused if they
+# have more operations than the "burst" of the rate limits above, for the address or for any one player
+BATTLESHIPS_BATCH_LIMIT = 500
+
+# The number of recent requests kept for each view, to work out latency percentiles (api/1.0/stats/)
+BATTLESHIPS_STATS_SAMPLES = 1000
+
+# Finished games can be moved out of the database into compressed files in this directory,
+# with "manage.py archive_games", or automatically when a game is won if the second setting is True
+BATTLESHIPS_ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive')
+BATTLESHIPS_ARCHIVE_ON_GAME_OVER = False
+
+# A snapshot of each game's state is stored after this many events, so replays are never longer than this
+BATTLESHIPS_SNAPSHOT_INTERVAL = 100
+
+# A cache of the state of each game in play (see server/gamecache.py). The "games" cache is kept in the memory
+# of each process, point it at a shared backend such as memcached or redis to share it between worker processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'games': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'battleships-games',
+    },
+}
+BATTLESHIPS_GAME_CACHE = 'games'
+# How long in seconds a game's state is kept in the cache after it was last written there
+BATTLESHIPS_GAME_CACHE_TIMEOUT = 3600
+
+# The game view only draws the grid for boards with at most this many cells, larger ones just list the ships
+BATTLESHIPS_VIEW_GRID_CELLS = 10000
+# How long in seconds a rendered game view is cached, pages are keyed by the game version so are never stale
+BATTLESHIPS_VIEW_CACHE_TIMEOUT = 600
@@ -37,8 +37,14 @@ urlpatterns = [
     re_path(r'^api/1.0/games/addplayer/(?P<game_name>\w+)/(?P<player_name>\w+)/$', views.api_games_add_player),
     re_path(r'^api/1.0/games/start/(?P<game_name>\w+)/$', views.api_games_start_game),
     re_path(r'^api/1.0/games/history/(?P<game_name>\w+)/$', views.api_games_history),
+    re_path(r'^api/1.0/games/stream/(?P<game_name>\w+)/$', views.api_games_stream),
+    re_path(r'^api/1.0/games/archive/(?P<game_name>\w+)/$', views.api_games_archive),
+    re_path(r'^api/1.0/games/replay/(?P<game_name>\w+)/(?P<sequence>[0-9]+)/$', views.api_games_replay),
     re_path(r'^api/1.0/games/getships/(?P<game_name>\w+)/(?P<player_name>\w+)/(?P<secret>\w+)/$', views.api_games_getships),
     re_path(r'^api/1.0/games/getwinner/(?P<game_name>\w+)/$', views.api_games_getwinner),
+    re_path(r'^api/1.0/batch/$', views.api_batch),
+    re_path(r'^api/1.0/stats/$', views.api_stats),
+    re_path(r'^api/1.0/stats/cache/$', views.api_stats_cache),
     re_path(r'^api/1.0/strike/(?P<game_name>\w+)/(?P<player_name>\w+)/\((?P<x>[0-9]+),(?P<y>[0-9]+)\)/(?P<secret>\w+)/$', views.api_strike),
 
 ]
@@ -15,10 +15,13 @@ from django.contrib.auth.models import User
 
 from .models import Action
 from .models import Game
+from .models import GameEvent
+from .models import GamePlayer
 from .models import GameSecret
 from .models import Player
 from .models import PlayerSecret
 from .models import Ship
+from .models import Tournament
 
 
 # Some code to augment the admin views in some cases
@@ -31,8 +34,21 @@ class ActionAdmin(admin.ModelAdmin):
 
 class GameAdmin(admin.ModelAdmin):
     list_display = (
-        'name', 'maximum_x', 'maximum_y', 'ships_per_person', 'created', 'modified'
+        'name', 'maximum_x', 'maximum_y', 'ships_per_person', 'winner', 'tournament', 'created', 'modified'
     )
+    list_filter = ('tournament',)
+
+class GameEventAdmin(admin.ModelAdmin):
+    list_display = (
+        'game', 'sequence', 'kind', 'created'
+    )
+    list_filter = ('game', 'kind')
+
+class GamePlayerAdmin(admin.ModelAdmin):
+    list_display = (
+        'game', 'player', 'moves', 'ships_remaining'
+    )
+    list_filter = ('game',)
 
 class ShipAdmin(admin.ModelAdmin):
     list_display = (
@@ -45,6 +61,11 @@ class PlayerAdmin(admin.ModelAdmin):
         'name', 'created', 'modified'
     )
 
+class TournamentAdmin(admin.ModelAdmin):
+    list_display = (
+        'name', 'format', 'strategy', 'created'
+    )
+
 class GameSecretAdmin(admin.ModelAdmin):
     list_display = ('game', 'secret')
 
@@ -54,8 +75,11 @@ class PlayerSecretAdmin(admin.ModelAdmin):
 
 admin.site.register(Action, ActionAdmin)
 admin.site.register(Game, GameAdmin)
+admin.site.register(GameEvent, GameEventAdmin)
+admin.site.register(GamePlayer, GamePlayerAdmin)
 admin.site.register(GameSecret, GameSecretAdmin)
 admin.site.register(Player, PlayerAdmin)
 admin.site.register(PlayerSecret, PlayerSecretAdmin)
 admin.site.register(Ship, ShipAdmin)
+admin.site.register(Tournament, TournamentAdmin)
 
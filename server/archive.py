@@ -0,0 +1,59 @@
+# Battleships archive.py
+#
+# Finished games can be moved out of the database into compressed files, with one JSON document per
+# line. These functions deal only with the files, see Game.archive() for what goes into them. Files are
+# always read a line at a time, so even very long games are never loaded whole.
+
+import gzip
+import json
+import os
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def get_path(game_id):
+    """Return the path of the archive file for a game, by id, whether or not it exists"""
+
+    return os.path.join(settings.BATTLESHIPS_ARCHIVE_DIR, f"game-{game_id}.jsonl.gz")
+
+
+def write(path, records):
+    """Write an archive file
+
+    path        the path of the file to write
+    records     an iterable of dicts, each written as a line of JSON
+
+    The file is written under a temporary name and then moved into place, so a partly written archive
+    is never seen.
+    """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = path + '.tmp'
+    with gzip.open(temporary_path, 'wt', encoding='utf-8') as archive_file:
+        for record in records:
+            archive_file.write(json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+    os.replace(temporary_path, path)
+
+
+def read(path, record_type=None):
+    """A generator of the dicts stored in an archive file, one at a time
+
+    path            the path of the file to read
+    record_type     if supplied, only records with this "type" are returned
+    """
+
+    with gzip.open(path, 'rt', encoding='utf-8') as archive_file:
+        for line in archive_file:
+            record = json.loads(line)
+            if record_type is None or record["type"] == record_type:
+                yield record
+
+
+def remove(path):
+    """Remove an archive file, if it exists"""
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
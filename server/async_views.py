@@ -0,0 +1,268 @@
+# Battleships async_views.py
+#
+# Async versions of the busiest API views, used in place of those in views.py when the site is served
+# through the ASGI entry point (see Battleships/asgi.py and Battleships/asgi_urls.py). They give the same
+# responses, but a request waiting on the database or a slow client does not hold a worker thread, so one
+# process can serve many more bot connections at once.
+#
+# Django's async ORM still runs each query in a thread behind the scenes, and strike() needs a transaction,
+# which only the sync ORM supports, so that is run in a thread as a whole.
+
+import time
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import JsonResponse, StreamingHttpResponse
+
+from . import events
+from . import views
+from .models import Game
+from .models import GamePlayer
+from .models import Player
+
+
+async def aload_game_player(game_name, player_name):
+    """An async version of views.load_game_player(), with the same arguments and results"""
+
+    game_player = await GamePlayer.objects.all().select_related('game', 'player', 'player__playersecret')\
+        .filter(game__name=game_name, player__name=player_name).afirst()
+    if game_player:
+        return (game_player.game, game_player.player, game_player)
+
+    # The player is not in the game, or one of them does not exist, so find out which
+    game = await Game.objects.aget(name=game_name)
+    player = await Player.objects.select_related('playersecret').aget(name=player_name)
+    return (game, player, None)
+
+
+async def api_games_history(request, game_name):
+    """Fetch the action history for a game, see views.api_games_history()"""
+
+    try:
+        # Fetch the game
+        game = await Game.objects.aget(name=game_name)
+
+        if game.archived:
+            # These are streamed from the archive file, which the sync view already does well
+            return await sync_to_async(views.api_games_history)(request, game_name)
+
+        since = views._get_int_parameter(request, 'since')
+        limit = views._get_int_parameter(request, 'limit')
+        if (since is not None and since < 0) or (limit is not None and limit < 0):
+            raise ValueError("Negative cursor")
+
+        # Nothing to send if the game hasn't changed since the client last asked
+        etag = views._get_game_etag(game, 'history', since, limit)
+        not_modified = views._get_not_modified(request, etag, game.modified)
+        if not_modified:
+            return not_modified
+
+        response = await game.alist_actions_as_dicts(since=since, limit=limit)
+        status_code = 200
+
+        return views._set_validators(JsonResponse(response, safe=False, status=status_code), etag, game.modified)
+
+    except Game.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find game {game_name}", safe=False, status=status_code)
+
+    except ValueError:
+        status_code = 400
+        return JsonResponse("Invalid since or limit", safe=False, status=status_code)
+
+    except:
+        status_code = 500
+        return JsonResponse("Unknown error", safe=False, status=status_code)
+
+
+async def _astream_game_events(game, since):
+    """An async generator of Server-Sent Events for a game, see views._stream_game_events()
+
+    Each event is sent as soon as it is made, and while waiting the stream sleeps in the event loop, so a
+    client watching a long game holds neither a thread nor a database connection.
+    """
+
+    deadline = time.monotonic() + settings.BATTLESHIPS_STREAM_TIMEOUT
+    current_round = None
+    watch = events.Watch(game.id)
+
+    # Ask the client to wait a second before reconnecting
+    yield "retry: 1000\n\n"
+
+    while True:
+        # Reset the watch before reading the database, so we cannot miss a strike made in between
+        watch.reset()
+
+        for action in await game.alist_actions_as_dicts(since=since):
+            since = action["id"]
+            yield views._format_event("strike", action, since)
+
+        # A new round starts when everyone has caught up
+        move_counts = await game.aget_move_counts()
+        if move_counts:
+            new_round = min(move_counts.values()) + 1
+            if new_round != current_round:
+                current_round = new_round
+                yield views._format_event("turn", {"round": current_round})
+
+        winner = await game.aget_winner()
+        if winner:
+            yield views._format_event("gameover", {"winner": winner.name})
+            return
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            # The client can reconnect with Last-Event-ID to carry on
+            return
+
+        if not await watch.await_change(min(settings.BATTLESHIPS_STREAM_POLL_INTERVAL, remaining)):
+            # Nothing happened here, but strikes in other processes will be found on the next loop.
+            # Send a comment so that proxies do not close the connection.
+            yield ": keepalive\n\n"
+
+
+async def api_games_stream(request, game_name):
+    """Stream the events of a game as they happen, see views.api_games_stream()"""
+
+    try:
+        # Fetch the game
+        game = await Game.objects.aget(name=game_name)
+
+        since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+        if since:
+            since = int(since)
+        else:
+            since = None
+
+    except Game.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find game {game_name}", safe=False, status=status_code)
+
+    except ValueError:
+        status_code = 400
+        return JsonResponse("Invalid since or Last-Event-ID", safe=False, status=status_code)
+
+    except:
+        status_code = 500
+        return JsonResponse("Unknown error", safe=False, status=status_code)
+
+    response = StreamingHttpResponse(_astream_game_events(game, since), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Ask nginx and similar not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def api_games_getships(request, game_name, player_name, secret):
+    """Fetch the ships for a specific player in a specific game, see views.api_games_getships()"""
+
+    try:
+        # Fetch the game, player and secret together
+        (game, player, game_player) = await aload_game_player(game_name, player_name)
+
+        # Check the secret
+        if secret == player.get_secret():
+            # Nothing to send if the game hasn't changed since the client last asked
+            etag = views._get_game_etag(game, 'ships', player.id)
+            not_modified = views._get_not_modified(request, etag, game.modified)
+            if not_modified:
+                return not_modified
+
+            status_code = 200
+            response = await game.alist_ships_by_player(player)
+            return views._set_validators(JsonResponse(response, safe=False, status=status_code), etag,
+                                         game.modified)
+        else:
+            status_code = 403
+            response = f"Invalid secret for player {player_name}"
+
+        return JsonResponse(response, safe=False, status=status_code)
+
+    except Game.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find game {game_name}", safe=False, status=status_code)
+
+    except Player.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find player {player_name}", safe=False, status=status_code)
+
+    except:
+        status_code = 500
+        return JsonResponse("Unknown error", safe=False, status=status_code)
+
+
+async def api_games_getwinner(request, game_name):
+    """Fetch a winner if there is one, or None otherwise, see views.api_games_getwinner()"""
+
+    try:
+        # Fetch the game, along with its stored winner in the same query
+        game = await Game.objects.select_related('winner').aget(name=game_name)
+
+        # Nothing to send if the game hasn't changed since the client last asked
+        etag = views._get_game_etag(game, 'winner')
+        not_modified = views._get_not_modified(request, etag, game.modified)
+        if not_modified:
+            return not_modified
+
+        status_code = 200
+        response = game.winner
+        if response:
+            # If it's not NULL, just get the name of the winner
+            response = response.name
+
+        return views._set_validators(JsonResponse(response, safe=False, status=status_code), etag, game.modified)
+
+    except Game.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find game {game_name}", safe=False, status=status_code)
+
+    except:
+        status_code = 500
+        return JsonResponse("Unknown error", safe=False, status=status_code)
+
+
+async def api_strike(request, game_name, player_name, secret, x, y):
+    """Attempt a strike for a specific player in a specific game, see views.api_strike()"""
+
+    try:
+        # Fetch the game, player, secret and membership of the game together
+        (game, player, game_player) = await aload_game_player(game_name, player_name)
+
+        # Check the secret
+        if secret == player.get_secret():
+            if not game_player:
+                # No need to trouble the model, we already know
+                raise PermissionDenied("NotInGame")
+
+            status_code = 200
+            location = (int(x),int(y))
+            # The strike itself is one transaction, which needs the sync ORM
+            action = await sync_to_async(game.strike)(player, location)
+            response = action.result
+        else:
+            status_code = 403
+            response = f"Invalid secret for player {player_name}"
+
+        return JsonResponse(response, safe=False, status=status_code)
+
+    except Game.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find game {game_name}", safe=False, status=status_code)
+
+    except Player.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find player {player_name}", safe=False, status=status_code)
+
+    except PermissionDenied as e:
+        # The model strike code can raise exceptions, for instance, if it isn't the players turn.
+        # Return the exception as a string so the client can deduce the reason
+        status_code = 403
+        return JsonResponse(str(e), safe=False, status=status_code)
+
+    except:
+        # Anything else should be supressed for security reasons
+        status_code = 500
+        return JsonResponse(f"Unknown error: Strike game {game_name}, player {player_name}, location ({x}, {y})"
+                            , safe=False, status=status_code)
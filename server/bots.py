@@ -0,0 +1,96 @@
+# Battleships bots.py
+#
+# Some very simple computer players. These are used to play games automatically, for instance in the
+# benchmark command, and are deliberately naive, students should be able to beat them easily.
+
+from random import randint, shuffle
+
+
+class Bot:
+    """The base class for a computer player in a single game
+
+    maximum_x   the largest possible x value in the game
+    maximum_y   the largest possible y value in the game
+    own_cells   location tuples (x,y) of the bot's own ships, which it will avoid hitting
+    """
+
+    def __init__(self, maximum_x, maximum_y, own_cells=()):
+        self.maximum_x = maximum_x
+        self.maximum_y = maximum_y
+        self.own_cells = set(own_cells)
+
+    def get_targets(self):
+        """A generator of all the location tuples (x,y) the bot is willing to strike, a row at a time
+
+        These are made as they are needed, so even a huge board is never listed whole.
+        """
+
+        for y in range(1, self.maximum_y + 1):
+            for x in range(1, self.maximum_x + 1):
+                if (x, y) not in self.own_cells:
+                    yield (x, y)
+
+    def next_strike(self):
+        """Return the location tuple (x,y) to strike next, or None if the bot has run out of ideas"""
+
+        raise NotImplementedError
+
+    def record(self, location, result):
+        """Tell the bot the result text of a strike, by anyone, at a location"""
+
+        pass
+
+
+class SweepBot(Bot):
+    """Strikes every square in turn, a row at a time, skipping any already struck by others"""
+
+    def __init__(self, maximum_x, maximum_y, own_cells=()):
+        super().__init__(maximum_x, maximum_y, own_cells)
+        self.targets = self.get_targets()
+        self.struck = set()
+
+    def next_strike(self):
+        for location in self.targets:
+            if location not in self.struck:
+                return location
+        return None
+
+    def record(self, location, result):
+        self.struck.add(tuple(location))
+
+
+class RandomBot(SweepBot):
+    """Strikes every square once, in a random order
+
+    Squares are picked at random until half the board has been tried, which keeps memory to the squares
+    tried on big boards, and then the rest are listed and shuffled, so the bot never repeats itself.
+    """
+
+    def __init__(self, maximum_x, maximum_y, own_cells=()):
+        super().__init__(maximum_x, maximum_y, own_cells)
+        self.tried = set()
+        self.remaining = None
+
+    def next_strike(self):
+        while len(self.tried) * 2 < self.maximum_x * self.maximum_y:
+            location = (randint(1, self.maximum_x), randint(1, self.maximum_y))
+            if location not in self.tried:
+                self.tried.add(location)
+                if location not in self.own_cells and location not in self.struck:
+                    return location
+
+        if self.remaining is None:
+            self.remaining = [location for location in self.get_targets() if location not in self.tried]
+            shuffle(self.remaining)
+        while self.remaining:
+            location = self.remaining.pop()
+            if location not in self.struck:
+                return location
+        return None
+
+
+# The available bots, by name
+BOTS = {
+    'random': RandomBot,
+    'sweep': SweepBot,
+}
@@ -0,0 +1,354 @@
+# Battleships engine.py
+#
+# The rules of the game, worked entirely in memory: where ships may go, whether a strike hits, whose turn it
+# is and who has won. Nothing here touches the database, so it can be used in tight loops, and Game loads a
+# GameState from the database and keeps it current as it saves ships and actions (see Game.get_game_state()).
+#
+# Errors are raised as PermissionDenied with the same text as the API has always returned.
+
+import random
+from array import array
+
+from django.core.exceptions import PermissionDenied
+
+
+# The ways a ship can lie, and the step from one of its cells to the next
+ORIENTATIONS = ('horizontal', 'vertical', 'diagonal')
+STEPS = {
+    'horizontal': (1, 0),
+    'vertical': (0, 1),
+    'diagonal': (1, 1),
+}
+
+# How many random starts to try for a ship before listing every free one
+PLACEMENT_ATTEMPTS = 20
+
+
+def get_cells(orientation, start_location, length):
+    """Return the cells a ship would occupy as a list of tuples (x,y)
+
+    orientation     One of "horizontal", "vertical" or "diagonal"
+    start_location  A tuple (x,y) of the start position
+    length          The number of cells the ship occupies
+
+    Horizontal ships head to the right of the start, vertical ones above it (if above is larger y),
+    and diagonal ones to the top right.
+    """
+
+    (startx, starty) = start_location
+    if orientation == 'horizontal':
+        return [(startx+offset, starty) for offset in range(0, length)]
+    if orientation == 'vertical':
+        return [(startx, starty+offset) for offset in range(0, length)]
+    if orientation == 'diagonal':
+        return [(startx+offset, starty+offset) for offset in range(0, length)]
+    return []
+
+
+def get_possible_cells(maximum_x, maximum_y, orientation, start_location, length):
+    """Work out the cells a ship would occupy on a grid, without checking for collisions
+
+    maximum_x       The largest possible x value
+    maximum_y       The largest possible y value
+    orientation     One of "horizontal", "vertical" or "diagonal"
+    start_location  A tuple (x,y) of the start position
+    length          The number of cells the ship occupies
+
+    returns a list of location tuples (x,y), or None if the ship would not fit on the grid
+    """
+
+    # If the orientiation is void, return None
+    if orientation not in ORIENTATIONS:
+        return None
+
+    # Get the start coordinates from the tuple location
+    (startx, starty) = start_location
+
+    # Check there is room on the grid
+    if orientation in ['horizontal', 'diagonal'] and startx + length > maximum_x:
+        # Not enough room to the right
+        return None
+    if orientation in ['vertical', 'diagonal'] and starty + length > maximum_y:
+        # Not enough room above
+        return None
+
+    return get_cells(orientation, start_location, length)
+
+
+def get_start_ranges(maximum_x, maximum_y, orientation, length):
+    """Return a tuple (x_range, y_range) of the starts from which a ship fits on the grid, as get_possible_cells()"""
+
+    (step_x, step_y) = STEPS[orientation]
+    x_range = range(1, maximum_x - length + 1) if step_x else range(1, maximum_x + 1)
+    y_range = range(1, maximum_y - length + 1) if step_y else range(1, maximum_y + 1)
+    return (x_range, y_range)
+
+
+class GameState:
+    """The state of a single game, held compactly in memory
+
+    maximum_x   The largest possible x value
+    maximum_y   The largest possible y value
+
+    The grid is sparse, a dict holding only the occupied cells, keyed by the index x + y * width with the
+    number of the ship there as the value, so memory and the cost of each strike depend on the number of
+    ships rather than the size of the board. Players are numbered in the order they are added, and their
+    moves and ships remaining are kept in arrays by that number. Ships are identified to the caller by a
+    key of its choosing, Game uses the Ship objects themselves.
+
+    As in the models, one hit anywhere on a ship sinks it, a player may not strike while any other player
+    has made fewer strikes, and there is a winner when exactly one player has ships left.
+    """
+
+    __slots__ = ('maximum_x', 'maximum_y', 'width', 'grid', 'ship_keys', 'ship_owners', 'ship_cells',
+                 'ships_afloat', 'player_ids', 'player_numbers', 'moves', 'ships_remaining',
+                 'minimum_moves', 'players_at_minimum', 'winner')
+
+    def __init__(self, maximum_x, maximum_y):
+        self.maximum_x = maximum_x
+        self.maximum_y = maximum_y
+        self.width = maximum_x + 1
+        self.grid = dict()
+
+        # For each ship by number, the caller's key, the owner's player number, and its grid indices
+        self.ship_keys = []
+        self.ship_owners = []
+        self.ship_cells = []
+        self.ships_afloat = 0
+
+        # Players by number, and numbers by player id
+        self.player_ids = []
+        self.player_numbers = dict()
+        self.moves = array('i')
+        self.ships_remaining = array('i')
+
+        # The fewest moves made by any player, and how many players have made that few
+        self.minimum_moves = 0
+        self.players_at_minimum = 0
+        self.winner = None
+
+
+    def _get_index(self, location):
+        """Return the grid index of a location tuple (x,y), or -1 if it is off the grid"""
+
+        (x, y) = location
+        if 0 <= x <= self.maximum_x and 0 <= y <= self.maximum_y:
+            return x + y * self.width
+        return -1
+
+
+    def add_player(self, player_id, moves=0):
+        """Add a player to the game, if they are not already in it, and return their number"""
+
+        number = self.player_numbers.get(player_id)
+        if number is None:
+            number = len(self.player_ids)
+            self.player_ids.append(player_id)
+            self.player_numbers[player_id] = number
+            self.moves.append(moves)
+            self.ships_remaining.append(0)
+            self._update_minimum_moves()
+        return number
+
+
+    def set_moves(self, move_counts):
+        """Set the number of moves made by each player, adding any players not yet known
+
+        move_counts     a dict keyed by player id, with the number of strikes made as the value
+        """
+
+        for (player_id, moves) in move_counts.items():
+            self.moves[self.add_player(player_id)] = moves
+        self._update_minimum_moves()
+
+
+    def _update_minimum_moves(self):
+        self.minimum_moves = min(self.moves) if self.moves else 0
+        self.players_at_minimum = self.moves.count(self.minimum_moves)
+
+
+    def get_move_counts(self):
+        """Return the number of moves made by each player, as a dict keyed by player id"""
+
+        return dict(zip(self.player_ids, self.moves))
+
+
+    def can_place(self, cells):
+        """Return True if every one of a list of cells (x,y) is on the grid and empty"""
+
+        grid = self.grid
+        for cell in cells:
+            index = self._get_index(cell)
+            if index < 0 or index in grid:
+                return False
+        return True
+
+
+    def place_ship(self, key, player_id, cells):
+        """Place a ship, if every cell it needs is on the grid and free
+
+        key         anything the caller wants to identify the ship by
+        player_id   the id of the player who owns the ship
+        cells       a list of the location tuples (x,y) the ship occupies
+
+        returns True if the ship was placed, False otherwise
+        """
+
+        if not cells or not self.can_place(cells):
+            return False
+
+        number = len(self.ship_keys)
+        indices = tuple(self._get_index(cell) for cell in cells)
+        for index in indices:
+            self.grid[index] = number
+
+        owner = self.add_player(player_id)
+        self.ship_keys.append(key)
+        self.ship_owners.append(owner)
+        self.ship_cells.append(indices)
+        self.ships_afloat += 1
+        self.ships_remaining[owner] += 1
+        self._update_winner()
+        return True
+
+
+    def find_free_placement(self, length):
+        """Choose a random placement for a new ship
+
+        length      the number of cells the ship occupies
+
+        returns a tuple (orientation, (x,y)), or None only if there is no space for the ship at all
+
+        An orientation is chosen at random, and the others are tried if there is no space that way. The start
+        is chosen uniformly from all the free starts for that orientation.
+        """
+
+        orientations = list(ORIENTATIONS)
+        random.shuffle(orientations)
+        for orientation in orientations:
+            start_location = self.find_free_start(orientation, length)
+            if start_location:
+                return (orientation, start_location)
+        return None
+
+
+    def find_free_start(self, orientation, length):
+        """Choose a start uniformly from all those where a ship fits without overlapping another, or None"""
+
+        (x_range, y_range) = get_start_ranges(self.maximum_x, self.maximum_y, orientation, length)
+        if not x_range or not y_range:
+            return None
+
+        # Most boards are sparse, so a random start nearly always fits, and is cheap to check
+        for attempt in range(PLACEMENT_ATTEMPTS):
+            start_location = (random.choice(x_range), random.choice(y_range))
+            if self.can_place(get_cells(orientation, start_location, length)):
+                return start_location
+
+        # This is a crowded board, so pick from every free start instead, which is just as fair
+        blocked = sorted(self._get_blocked_starts(orientation, length, x_range, y_range))
+        free = len(x_range) * len(y_range) - len(blocked)
+        if not free:
+            return None
+
+        # Starts are numbered across each row in turn, find the chosen free one by skipping the blocked ones
+        position = random.randrange(free)
+        for blocked_position in blocked:
+            if blocked_position > position:
+                break
+            position += 1
+        return (x_range.start + position % len(x_range), y_range.start + position // len(x_range))
+
+
+    def _get_blocked_starts(self, orientation, length, x_range, y_range):
+        """Return the set of starts from which a ship would overlap another, see find_free_start()
+
+        This works from the occupied cells, rather than the whole board. Starts are numbered across each row
+        of the ranges in turn, from 0.
+        """
+
+        (step_x, step_y) = STEPS[orientation]
+        blocked = set()
+        for index in self.grid:
+            (x, y) = (index % self.width, index // self.width)
+            for offset in range(length):
+                (start_x, start_y) = (x - offset * step_x, y - offset * step_y)
+                if start_x in x_range and start_y in y_range:
+                    blocked.add((start_y - y_range.start) * len(x_range) + start_x - x_range.start)
+        return blocked
+
+
+    def get_ships(self):
+        """Return a list of the keys of all the ships afloat"""
+
+        return [key for (key, cells) in zip(self.ship_keys, self.ship_cells) if cells]
+
+
+    def check_for_hit(self, location):
+        """Return the key of any ship at a location tuple (x,y), or None"""
+
+        number = self.grid.get(self._get_index(location))
+        return None if number is None else self.ship_keys[number]
+
+
+    def check_strike(self, player_id):
+        """Check a player may strike now, raising PermissionDenied if not, and return their number"""
+
+        number = self.player_numbers.get(player_id)
+        if number is None:
+            raise PermissionDenied("NotInGame")
+        if not self.ships_afloat:
+            raise PermissionDenied("NoShipsInGame")
+        if self.moves[number] > self.minimum_moves:
+            raise PermissionDenied("NotYourTurn")
+        return number
+
+
+    def strike(self, player_id, location):
+        """Make a strike for a player, sinking any ship hit
+
+        player_id   the id of the player making the strike
+        location    a location tuple (x,y) to strike
+
+        returns the key of the ship sunk, or None for a miss
+        """
+
+        # This is the hot path, so the checks are made here rather than through check_strike()
+        number = self.player_numbers.get(player_id)
+        if number is None or not self.ships_afloat or self.moves[number] > self.minimum_moves:
+            self.check_strike(player_id)
+
+        # Use up the player's turn, and move on to the next round once everyone has gone
+        self.moves[number] += 1
+        self.players_at_minimum -= 1
+        if not self.players_at_minimum:
+            self._update_minimum_moves()
+
+        (x, y) = location
+        if not (0 <= x <= self.maximum_x and 0 <= y <= self.maximum_y):
+            return None
+        ship = self.grid.get(x + y * self.width)
+        if ship is None:
+            return None
+
+        # Sink the whole ship
+        for index in self.ship_cells[ship]:
+            del self.grid[index]
+        self.ship_cells[ship] = ()
+        self.ships_afloat -= 1
+        owner = self.ship_owners[ship]
+        self.ships_remaining[owner] -= 1
+        if not self.ships_remaining[owner]:
+            self._update_winner()
+        return self.ship_keys[ship]
+
+
+    def _update_winner(self):
+        players_with_ships = [number for (number, ships) in enumerate(self.ships_remaining) if ships]
+        self.winner = self.player_ids[players_with_ships[0]] if len(players_with_ships) == 1 else None
+
+
+    def get_winner(self):
+        """Return the id of the winning player, or None if there is no winner"""
+
+        return self.winner
@@ -0,0 +1,108 @@
+# Battleships events.py
+#
+# A very small in-process notification mechanism, so that streaming views can sleep until something
+# happens in a game rather than polling the database. Strikes made in other processes are not seen
+# here, so anything waiting should still check the database every so often.
+#
+# Only games that someone is watching have anything kept for them here, and that is dropped as soon as
+# the last Watch of the game is, so a long running process does not collect something for every game.
+
+import asyncio
+import threading
+import weakref
+
+
+class _Channel:
+    """The Condition and counter for a game, the counter is bumped each time something happens
+
+    Async waiters cannot sleep on the Condition, so each adds a tuple (loop, asyncio.Event) to waiters.
+    """
+
+    __slots__ = ('condition', 'counter', 'waiters', '__weakref__')
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.counter = 0
+        self.waiters = set()
+
+
+# The channel for each game being watched, keyed by game id, and a lock to protect creating them
+_channels = weakref.WeakValueDictionary()
+_channels_lock = threading.Lock()
+
+
+class Watch:
+    """Watches a single game for something happening, keeping its channel alive while it is held
+
+    game_id     the id of the game to watch
+
+    Anything that happens after the Watch is made, or after the last call to reset(), is noticed by wait().
+    """
+
+    def __init__(self, game_id):
+        with _channels_lock:
+            channel = _channels.get(game_id)
+            if channel is None:
+                channel = _Channel()
+                _channels[game_id] = channel
+        self.channel = channel
+        self.counter = channel.counter
+
+    def reset(self):
+        """Forget anything that has happened so far, call this before reading the game from the database"""
+
+        self.counter = self.channel.counter
+
+    def wait(self, timeout):
+        """Wait for something to happen in the game
+
+        timeout     the maximum time to wait in seconds
+
+        returns True if something has happened since the last reset(), or False if we timed out
+        """
+
+        channel = self.channel
+        with channel.condition:
+            return channel.condition.wait_for(lambda: channel.counter != self.counter, timeout)
+
+    async def await_change(self, timeout):
+        """An async version of wait(), which sleeps without holding a thread"""
+
+        channel = self.channel
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with channel.condition:
+            if channel.counter != self.counter:
+                return True
+            channel.waiters.add(waiter)
+
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with channel.condition:
+                channel.waiters.discard(waiter)
+        return channel.counter != self.counter
+
+
+def notify(game_id):
+    """Signal that something has happened in a game, waking anyone waiting on it"""
+
+    with _channels_lock:
+        channel = _channels.get(game_id)
+    if channel is None:
+        # Nobody is watching
+        return
+
+    with channel.condition:
+        channel.counter += 1
+        channel.condition.notify_all()
+        waiters = list(channel.waiters)
+
+    # Async waiters are woken in their own event loops, which may be in other threads
+    for (loop, event) in waiters:
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # The loop has closed, so nobody is left to wake
+            pass
@@ -0,0 +1,122 @@
+# Battleships gamecache.py
+#
+# A cache of the state of each game in play, so that the busiest calls need not load every ship and player
+# of a game from the database each time. The state is kept as a plain dict (see Game.get_game_state()) in
+# the Django cache named by BATTLESHIPS_GAME_CACHE, which by default is in the memory of each process. Point
+# that cache at a shared backend (for instance memcached or redis) and the workers share their entries.
+#
+# Each entry is stored along with the game version it holds the state for, and is only used by a Game at
+# exactly that version. Every change to a game raises its version in the database, and entries are only
+# written once the change is committed, so an entry is either exactly right or is never used again. Changes
+# made through strike(), start_game() and adding players write the new state through, so the next request
+# finds it, while anything else simply leaves an older entry behind.
+
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+# How often an entry was found for the version asked for, and how often not, see get_counts()
+_counts = {"hits": 0, "misses": 0}
+_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the Django cache named by BATTLESHIPS_GAME_CACHE"""
+
+    return caches[settings.BATTLESHIPS_GAME_CACHE]
+
+
+def get_cache_key(game):
+    """Return the cache key for a game, which includes its creation time, so a reused id is never confused"""
+
+    return f"battleships:game:{game.id}:{int(game.created.timestamp() * 1000000)}"
+
+
+def _count(stored, version):
+    """Return the entry from a stored tuple (version, entry) if it is for the version given, counting the result"""
+
+    hit = stored is not None and stored[0] == version
+    with _lock:
+        _counts["hits" if hit else "misses"] += 1
+    return stored[1] if hit else None
+
+
+def get(game):
+    """Return the cached entry for a game at its current version, or None if there is none"""
+
+    if game.pk is None:
+        return None
+    return _count(get_cache().get(get_cache_key(game)), game.version)
+
+
+async def aget(game):
+    """An async version of get(), as cache backends other than local memory may block"""
+
+    if game.pk is None:
+        return None
+    return _count(await get_cache().aget(get_cache_key(game)), game.version)
+
+
+def put(game, entry):
+    """Store the entry for a game at its current version, once any transaction in progress commits"""
+
+    if game.pk is None:
+        return
+    key = get_cache_key(game)
+    stored = (game.version, entry)
+    transaction.on_commit(lambda: get_cache().set(key, stored, settings.BATTLESHIPS_GAME_CACHE_TIMEOUT))
+
+
+def update(game, version, change):
+    """Write a change through to the entry for a game, once any transaction in progress commits
+
+    game        the Game, already at the version after the change
+    version     the version of the game before the change
+    change      a function that takes an entry for the earlier version and returns the entry for the new one
+
+    Nothing is stored unless there is an entry for the earlier version.
+    """
+
+    if game.pk is None:
+        return
+    key = get_cache_key(game)
+    new_version = game.version
+
+    def write_through():
+        stored = get_cache().get(key)
+        if stored is not None and stored[0] == version:
+            get_cache().set(key, (new_version, change(stored[1])), settings.BATTLESHIPS_GAME_CACHE_TIMEOUT)
+
+    transaction.on_commit(write_through)
+
+
+def delete(game):
+    """Forget any entry for a game, straight away, and again once any transaction in progress commits
+
+    The second time catches any entry put earlier in the same transaction, which is only stored on commit.
+    """
+
+    key = get_cache_key(game)
+    get_cache().delete(key)
+    transaction.on_commit(lambda: get_cache().delete(key))
+
+
+def get_counts():
+    """Return a dict of the hits and misses in this process so far, and the proportion that were hits"""
+
+    with _lock:
+        counts = dict(_counts)
+    total = counts["hits"] + counts["misses"]
+    counts["hit_rate"] = counts["hits"] / total if total else None
+    return counts
+
+
+def reset_counts():
+    """Set the hits and misses back to zero"""
+
+    with _lock:
+        _counts["hits"] = 0
+        _counts["misses"] = 0
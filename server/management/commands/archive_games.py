@@ -0,0 +1,31 @@
+# Battleships archive_games command
+#
+# Moves finished games out of the database and into compressed archive files, see Game.archive().
+
+from django.core.management.base import BaseCommand, CommandError
+
+from server.models import Game
+
+
+class Command(BaseCommand):
+    help = "Archives finished games into compressed files, and removes their ships and actions from the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('games', nargs='*', help="The names of games to archive, all finished games if none")
+
+    def handle(self, *args, **options):
+        games = Game.objects.all().filter(archived=False, winner__isnull=False)
+        if options['games']:
+            games = games.filter(name__in=options['games'])
+            missing = set(options['games']) - set(games.values_list('name', flat=True))
+            if missing:
+                raise CommandError(f"Not found, already archived or not finished: {', '.join(sorted(missing))}")
+
+        count = 0
+        for game in games.select_related('winner'):
+            game.archive()
+            count += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Archived {game.name} to {game.get_archive_path()}")
+
+        self.stdout.write(f"Archived {count} games")
@@ -0,0 +1,208 @@
+# Battleships benchmark command
+#
+# Plays a number of games to completion with simple bots, making every call through the real URL
+# routes, and reports the throughput along with the latency and queries for each API view. This runs
+# against whatever database is configured, normally the local SQLite one, so numbers can be compared
+# before and after a change.
+#
+# With --stack asgi the requests go through Django's ASGI handler and the async views instead, and the
+# games are played at the same time rather than one after another, to compare the two ways of serving.
+
+import asyncio
+import string
+import time
+from collections import defaultdict
+from random import choice
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import resolve
+
+from server.bots import BOTS
+from server.models import Game
+from server.stats import QueryCounter, percentile
+
+
+class Recorder:
+    """Makes API requests through the sync (WSGI) stack, recording the time taken and queries made by each,
+    grouped by view"""
+
+    def __init__(self):
+        self.client = Client()
+        self.timings = defaultdict(list)
+        self.queries = defaultdict(list)
+
+    async def get(self, url):
+        """Make a GET request for a url, recording its cost, and return the response"""
+
+        return await sync_to_async(self._get)(url)
+
+    def _get(self, url):
+        view_name = resolve(url.split('?')[0]).func.__name__
+
+        # Count queries with a wrapper, rather than by recording them, to keep the overhead down
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = time.perf_counter()
+            response = self.client.get(url)
+            elapsed = time.perf_counter() - start
+
+        self.timings[view_name].append(elapsed)
+        self.queries[view_name].append(counter.count)
+        return response
+
+    def number_of_requests(self):
+        return sum(len(timings) for timings in self.timings.values())
+
+
+class AsyncRecorder(Recorder):
+    """Makes API requests through the async (ASGI) stack, recording the time taken by each
+
+    Queries are not counted, as those of requests running at the same time cannot be told apart.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.client = AsyncClient()
+
+    async def get(self, url):
+        view_name = resolve(url.split('?')[0]).func.__name__
+
+        start = time.perf_counter()
+        response = await self.client.get(url)
+        elapsed = time.perf_counter() - start
+
+        self.timings[view_name].append(elapsed)
+        return response
+
+
+class Command(BaseCommand):
+    help = "Plays games with bots through the API, and reports throughput, latency and query counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=5, help="The number of games to play")
+        parser.add_argument('--players', type=int, default=3, help="The number of players in each game")
+        parser.add_argument('--size', type=int, default=None,
+                            help="The width and height of the grid, the game default if not given")
+        parser.add_argument('--strategy', choices=sorted(BOTS), default='random',
+                            help="The bot used for every player")
+        parser.add_argument('--keep', action='store_true', help="Keep the games and players afterwards")
+        parser.add_argument('--stack', choices=['wsgi', 'asgi'], default='wsgi',
+                            help="Serve requests with the sync views one game at a time, or with the async "
+                                 "views and all games at once")
+
+    def handle(self, *args, **options):
+        # Use a random prefix so that runs cannot collide with each other or with real games
+        prefix = 'bench' + ''.join(choice(string.ascii_lowercase) for i in range(6))
+        game_names = [f"{prefix}_{number}" for number in range(options['games'])]
+
+        # The test client identifies itself as testserver, and sends every request from the same address,
+        # which the rate limits would soon stop
+        test_settings = {'ALLOWED_HOSTS': list(settings.ALLOWED_HOSTS) + ['testserver'],
+                         'BATTLESHIPS_RATE_LIMITS': {}}
+        if options['stack'] == 'asgi':
+            recorder = AsyncRecorder()
+            test_settings['ROOT_URLCONF'] = 'Battleships.asgi_urls'
+        else:
+            recorder = Recorder()
+
+        with override_settings(**test_settings):
+            start = time.perf_counter()
+            # Run the games in this thread's event loop, so the sync code they call shares our connection
+            async_to_sync(self.play_games)(recorder, game_names, options)
+            elapsed = time.perf_counter() - start
+
+        self.report(recorder, elapsed, options)
+
+    async def play_games(self, recorder, game_names, options):
+        """Play all the games, one at a time for WSGI, or all at once for ASGI"""
+
+        if options['stack'] == 'asgi':
+            await asyncio.gather(*[self.play_game(recorder, game_name, options) for game_name in game_names])
+        else:
+            for game_name in game_names:
+                await self.play_game(recorder, game_name, options)
+
+    async def play_game(self, recorder, game_name, options):
+        """Create and play a single game to completion, and delete it afterwards unless asked not to"""
+
+        # Register the players and the game
+        secrets = dict()
+        for number in range(options['players']):
+            player_name = f"{game_name}_player{number}"
+            secrets[player_name] = (await recorder.get(f"/api/1.0/players/register/{player_name}/")).json()
+        game_secret = (await recorder.get(f"/api/1.0/games/register/{game_name}/")).json()
+
+        # There is no API to size the grid, so do that directly
+        if options['size']:
+            await Game.objects.all().filter(name=game_name).aupdate(maximum_x=options['size'],
+                                                                    maximum_y=options['size'])
+        game = await Game.objects.aget(name=game_name)
+
+        for player_name in secrets:
+            await recorder.get(f"/api/1.0/games/addplayer/{game_name}/{player_name}/")
+        await recorder.get(f"/api/1.0/games/start/{game_name}/")
+
+        # Give each player a bot, which knows where its own ships are
+        bots = dict()
+        for player_name, secret in secrets.items():
+            ships = (await recorder.get(f"/api/1.0/games/getships/{game_name}/{player_name}/{secret}/")).json()
+            own_cells = [tuple(location) for ship in ships for location in ship["locations"]]
+            bots[player_name] = BOTS[options['strategy']](game.maximum_x, game.maximum_y, own_cells)
+
+        # Play in rounds, everyone strikes and then we check the history and for a winner
+        since = 0
+        winner = None
+        while not winner:
+            struck = False
+            for player_name, bot in bots.items():
+                location = bot.next_strike()
+                if location is None:
+                    continue
+                (x, y) = location
+                await recorder.get(f"/api/1.0/strike/{game_name}/{player_name}/({x},{y})/{secrets[player_name]}/")
+                struck = True
+
+            if not struck:
+                # Every bot has run out of targets, there's nothing more to be done
+                break
+
+            for action in (await recorder.get(f"/api/1.0/games/history/{game_name}/?since={since}")).json():
+                since = action["id"]
+                for bot in bots.values():
+                    bot.record(action["location"], action["result"])
+
+            winner = (await recorder.get(f"/api/1.0/games/getwinner/{game_name}/")).json()
+
+        if not options['keep']:
+            await recorder.get(f"/api/1.0/games/delete/{game_name}/{game_secret}/")
+            for player_name, secret in secrets.items():
+                await recorder.get(f"/api/1.0/players/delete/{player_name}/{secret}/")
+
+    def report(self, recorder, elapsed, options):
+        """Write out the overall throughput and a table of costs for each view"""
+
+        requests = recorder.number_of_requests()
+        self.stdout.write(f"Played {options['games']} games with {options['players']} players in {elapsed:.2f}s "
+                          f"over {options['stack'].upper()}")
+        self.stdout.write(f"{requests} requests, {requests / elapsed:.1f} requests/second")
+        self.stdout.write("")
+        self.stdout.write(f"{'view':<24} {'requests':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                          f"{'queries':>8} {'max q':>6}")
+
+        for view_name in sorted(recorder.timings):
+            timings = sorted(recorder.timings[view_name])
+            queries = recorder.queries.get(view_name)
+            if queries:
+                query_columns = f"{sum(queries) / len(queries):>8.1f} {max(queries):>6}"
+            else:
+                query_columns = f"{'-':>8} {'-':>6}"
+            self.stdout.write(
+                f"{view_name:<24} {len(timings):>8} "
+                f"{percentile(timings, 50) * 1000:>8.2f} {percentile(timings, 95) * 1000:>8.2f} "
+                f"{percentile(timings, 99) * 1000:>8.2f} {query_columns}")
@@ -0,0 +1,109 @@
+# Battleships benchmark_engine command
+#
+# Microbenchmarks for the in-memory game engine (see engine.py), with no database involved, to show how
+# fast the rules themselves are and to compare changes to them.
+
+import time
+from random import Random, seed
+
+from django.core.management.base import BaseCommand
+
+from server import engine
+
+
+class Command(BaseCommand):
+    help = "Times ship placement, hit tests and whole games in the in-memory engine"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=200, help="The number of games to play")
+        parser.add_argument('--players', type=int, default=4, help="The number of players in each game")
+        parser.add_argument('--size', type=int, default=30, help="The width and height of the grid")
+        parser.add_argument('--ships', type=int, default=5, help="The number of ships for each player")
+        parser.add_argument('--seed', type=int, default=1, help="The random seed, so runs can be compared")
+        parser.add_argument('--fleet-size', type=int, default=1000,
+                            help="The width and height of the grid for placing a large fleet")
+        parser.add_argument('--fleet-players', type=int, default=200,
+                            help="The number of players to place ships for on that grid")
+
+    def handle(self, *args, **options):
+        random = Random(options['seed'])
+        # The engine uses the shared generator to place ships
+        seed(options['seed'])
+        size = options['size']
+        players = list(range(1, options['players'] + 1))
+
+        placements = 0
+        placement_time = 0.0
+        strikes = 0
+        strike_time = 0.0
+        for number in range(options['games']):
+            state = engine.GameState(size, size)
+            for player_id in players:
+                state.add_player(player_id)
+
+            # Place ships where find_free_placement() chooses, as start_game() does
+            start = time.perf_counter()
+            for player_id in players:
+                for number in range(options['ships']):
+                    placement = state.find_free_placement(3)
+                    if placement:
+                        (orientation, start_location) = placement
+                        state.place_ship((player_id, number), player_id,
+                                         engine.get_cells(orientation, start_location, 3))
+                        placements += 1
+            placement_time += time.perf_counter() - start
+
+            # Then every player strikes every cell in a random order, in turn, until someone wins
+            targets = [(x, y) for x in range(1, size + 1) for y in range(1, size + 1)]
+            orders = [random.sample(targets, len(targets)) for player_id in players]
+            start = time.perf_counter()
+            strikes += self.play(state, players, orders)
+            strike_time += time.perf_counter() - start
+
+        # Finally, hit tests alone on the last board
+        locations = [(random.randint(1, size), random.randint(1, size)) for number in range(100000)]
+        start = time.perf_counter()
+        for location in locations:
+            state.check_for_hit(location)
+        hit_time = time.perf_counter() - start
+
+        # And placing a large fleet the way start_game() does, on a big board
+        fleet_size = options['fleet_size']
+        state = engine.GameState(fleet_size, fleet_size)
+        fleet = 0
+        start = time.perf_counter()
+        for player_id in range(1, options['fleet_players'] + 1):
+            for number in range(options['ships']):
+                placement = state.find_free_placement(3)
+                if placement:
+                    (orientation, start_location) = placement
+                    state.place_ship((player_id, number), player_id,
+                                     engine.get_cells(orientation, start_location, 3))
+                    fleet += 1
+        fleet_time = time.perf_counter() - start
+
+        self.stdout.write(f"{options['games']} games, {options['players']} players, {size}x{size} grid")
+        self.stdout.write(f"{'operation':<16} {'count':>10} {'per second':>14}")
+        for (operation, count, elapsed) in [("place_ship", placements, placement_time),
+                                            ("strike", strikes, strike_time),
+                                            ("check_for_hit", len(locations), hit_time),
+                                            ("find_placement", fleet, fleet_time)]:
+            self.stdout.write(f"{operation:<16} {count:>10} {count / elapsed:>14,.0f}")
+        self.stdout.write(f"find_placement placed {fleet} ships for {options['fleet_players']} players on a "
+                          f"{fleet_size}x{fleet_size} grid in {fleet_time:.2f}s")
+
+    def play(self, state, players, orders):
+        """Strike in turn until someone wins, and return the number of strikes made
+
+        orders  for each player, the list of locations to strike in order
+        """
+
+        strike = state.strike
+        strikes = 0
+        for turn in zip(*orders):
+            for (player_id, location) in zip(players, turn):
+                strike(player_id, location)
+                strikes += 1
+                if state.winner is not None:
+                    return strikes
+        return strikes
@@ -0,0 +1,99 @@
+# Battleships tournament command
+#
+# Creates a tournament between the named players, and plays every game out with bots, optionally in a pool
+# of worker processes, before reporting the standings and how quickly the games were played.
+
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from server.bots import BOTS
+from server.models import Player, Tournament
+from server.workers import init_worker, play_tournament_game
+
+
+class Command(BaseCommand):
+    help = "Runs a tournament between players, with bots playing every game"
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help="The name of the tournament, which must be new")
+        parser.add_argument('players', nargs='+', help="The names of the players, created if need be")
+        parser.add_argument('--format', choices=[code for (code, name) in Tournament.FORMAT_CHOICES],
+                            default=Tournament.ROUND_ROBIN, help="How players are paired")
+        parser.add_argument('--strategy', choices=sorted(BOTS), default='random',
+                            help="The bot used for every player")
+        parser.add_argument('--size', type=int, default=None,
+                            help="The width and height of the grid, the game default if not given")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="The number of processes to play games in, 1 to play them here")
+
+    def handle(self, *args, **options):
+        # Games are named after the tournament, and those names must work in URLs
+        if not re.fullmatch(r'\w+', options['name']):
+            raise CommandError("Tournament names may only contain letters, digits and underscores")
+        if len(set(options['players'])) < 2:
+            raise CommandError("A tournament needs at least two players")
+        if Tournament.objects.all().filter(name=options['name']).exists():
+            raise CommandError(f"Tournament {options['name']} already exists")
+
+        # Create any players we do not know yet
+        existing = set(Player.objects.all().filter(name__in=options['players']).values_list('name', flat=True))
+        Player.objects.bulk_create([Player(name=name) for name in set(options['players']) - existing])
+
+        tournament = Tournament(name=options['name'], format=options['format'], strategy=options['strategy'])
+        if options['size']:
+            tournament.maximum_x = tournament.maximum_y = options['size']
+        tournament.save()
+        tournament.players.add(*Player.objects.all().filter(name__in=options['players']))
+
+        start = time.perf_counter()
+        (games, strikes) = self.play(tournament, options['workers'])
+        elapsed = time.perf_counter() - start
+
+        self.report(tournament, games, strikes, elapsed, options)
+
+    def play(self, tournament, workers):
+        """Schedule and play games until the tournament is over
+
+        returns a tuple of the total number of games and strikes
+        """
+
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker) if workers > 1 else None
+        games = 0
+        strikes = 0
+        try:
+            while True:
+                new_games = tournament.schedule()
+                if not new_games:
+                    break
+                games += len(new_games)
+
+                if executor:
+                    # New workers are forked as games are submitted, and must not share our connections
+                    connections.close_all()
+                    results = executor.map(play_tournament_game, [game.id for game in new_games])
+                    strikes += sum(game_strikes for (game_id, game_strikes) in results)
+                else:
+                    for game in new_games:
+                        strikes += tournament.play_game(game)
+        finally:
+            if executor:
+                executor.shutdown()
+
+        return (games, strikes)
+
+    def report(self, tournament, games, strikes, elapsed, options):
+        """Write out the standings and the rate at which games were played"""
+
+        self.stdout.write(f"Played {games} {tournament.get_format_display()} games with "
+                          f"{options['workers']} workers in {elapsed:.2f}s")
+        self.stdout.write(f"{games / elapsed:.1f} games/second, {strikes / elapsed:.1f} strikes/second")
+        self.stdout.write("")
+        self.stdout.write(f"{'player':<24} {'played':>6} {'won':>6}")
+        for standing in tournament.get_standings():
+            self.stdout.write(f"{standing['player']:<24} {standing['played']:>6} {standing['won']:>6}")
+        self.stdout.write("")
+        self.stdout.write(f"Champion: {tournament.get_champion()}")
@@ -0,0 +1,107 @@
+# Battleships middleware.py
+
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.db import connection
+from django.urls import Resolver404, resolve
+
+from . import ratelimit
+from . import stats
+
+
+class QueryStatsMiddleware:
+    """Records the wall time, number of queries and database time of every request, by view
+
+    The figures can be seen by superusers at api/1.0/stats/. Queries made while a streaming response
+    is being sent happen after this returns, and so are not counted.
+
+    Under ASGI only the time is recorded, as the queries of an async request run in other threads and
+    cannot be told apart from those of other requests.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        counter = stats.QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        # Requests that did not match a URL are not interesting
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match:
+            stats.record(resolver_match.func.__name__, elapsed, counter.count, counter.time)
+
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match:
+            stats.record(resolver_match.func.__name__, elapsed, None, None)
+
+        return response
+
+
+class RateLimitMiddleware:
+    """Turns away API requests from clients making too many, with 429 Too Many Requests
+
+    Each request to the API takes a token from a bucket for the client's IP address, and one for the player
+    if the URL names one, see ratelimit.py and BATTLESHIPS_RATE_LIMITS. This is checked before the session,
+    the user or anything in the models is looked at, so a client over the limit costs very little. The
+    response has a Retry-After header, with the whole seconds to wait.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        wait = ratelimit.take(self.get_client_keys(request))
+        if wait:
+            return ratelimit.get_too_many_requests(wait)
+
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        wait = await ratelimit.atake(self.get_client_keys(request))
+        if wait:
+            return ratelimit.get_too_many_requests(wait)
+
+        return await self.get_response(request)
+
+    @staticmethod
+    def get_client_keys(request):
+        """Return the buckets for a request, or none if it is not to the API"""
+
+        if not request.path_info.startswith('/api/'):
+            return []
+
+        # Find the player named in the URL, if any, the URL will be resolved again for the view
+        try:
+            view_kwargs = resolve(request.path_info).kwargs
+        except Resolver404:
+            view_kwargs = {}
+        return ratelimit.get_client_keys(request, view_kwargs)
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_game_players(apps, schema_editor):
+    """Create GamePlayer rows for existing games, counting the moves made so far"""
+
+    Game = apps.get_model('server', 'Game')
+    GamePlayer = apps.get_model('server', 'GamePlayer')
+    Action = apps.get_model('server', 'Action')
+
+    for game in Game.objects.all():
+        for player in game.players.all():
+            moves = Action.objects.filter(game=game, player=player).count()
+            GamePlayer.objects.create(game=game, player=player, moves=moves)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GamePlayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('moves', models.IntegerField(default=0)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='server.game')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='server.player')),
+            ],
+            options={
+                'unique_together': {('game', 'player')},
+            },
+        ),
+        migrations.RunPython(populate_game_players, migrations.RunPython.noop),
+    ]
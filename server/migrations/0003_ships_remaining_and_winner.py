@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_ships_remaining(apps, schema_editor):
+    """Count the surviving ships for each player in existing games, and record any winner"""
+
+    Game = apps.get_model('server', 'Game')
+    GamePlayer = apps.get_model('server', 'GamePlayer')
+    Ship = apps.get_model('server', 'Ship')
+
+    for game in Game.objects.all():
+        players_with_ships = []
+        for game_player in GamePlayer.objects.filter(game=game):
+            game_player.ships_remaining = Ship.objects.filter(game=game, player_id=game_player.player_id).count()
+            game_player.save()
+            if game_player.ships_remaining:
+                players_with_ships.append(game_player.player_id)
+
+        if len(players_with_ships) == 1:
+            Game.objects.filter(pk=game.pk).update(winner_id=players_with_ships[0])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0002_gameplayer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='winner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='games_won', to='server.player'),
+        ),
+        migrations.AddField(
+            model_name='gameplayer',
+            name='ships_remaining',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_ships_remaining, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,88 @@
+# Moves ship cells and strike locations out of the Location table and inline into Ship and Action
+
+from django.db import migrations, models
+
+
+def copy_locations(apps, schema_editor):
+    """Work out the start, orientation and length of each ship from its cells, and copy strike locations"""
+
+    Ship = apps.get_model('server', 'Ship')
+    Action = apps.get_model('server', 'Action')
+
+    for ship in Ship.objects.all():
+        cells = sorted((location.x, location.y) for location in ship.locations.all())
+        if not cells:
+            ship.delete()
+            continue
+
+        (ship.x, ship.y) = cells[0]
+        ship.length = len(cells)
+        if len(cells) == 1 or cells[1][1] == cells[0][1]:
+            ship.orientation = 'horizontal'
+        elif cells[1][0] == cells[0][0]:
+            ship.orientation = 'vertical'
+        else:
+            ship.orientation = 'diagonal'
+        ship.save()
+
+    for action in Action.objects.all().select_related('location'):
+        action.x = action.location.x
+        action.y = action.location.y
+        action.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0003_ships_remaining_and_winner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='x',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='action',
+            name='y',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='ship',
+            name='length',
+            field=models.IntegerField(default=3),
+        ),
+        migrations.AddField(
+            model_name='ship',
+            name='orientation',
+            field=models.CharField(choices=[('horizontal', 'Horizontal'), ('vertical', 'Vertical'), ('diagonal', 'Diagonal')], default='horizontal', max_length=10),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='ship',
+            name='x',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='ship',
+            name='y',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_locations, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='action',
+            name='location',
+        ),
+        migrations.RemoveField(
+            model_name='ship',
+            name='locations',
+        ),
+        migrations.DeleteModel(
+            name='Location',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0004_inline_locations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0006_event_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='tournament_round',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='Tournament',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30, unique=True)),
+                ('format', models.CharField(choices=[('round_robin', 'Round Robin'), ('knockout', 'Knockout')], default='round_robin', max_length=20)),
+                ('strategy', models.CharField(default='random', max_length=20)),
+                ('maximum_x', models.IntegerField(default=15)),
+                ('maximum_y', models.IntegerField(default=15)),
+                ('ships_per_person', models.IntegerField(default=3)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('players', models.ManyToManyField(to='server.player')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='tournament',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='server.tournament'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0008_game_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='action',
+            index=models.Index(fields=['game', 'id'], name='action_game_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ship',
+            index=models.Index(fields=['game', 'player', 'name'], name='ship_game_player_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ship',
+            index=models.Index(fields=['game', 'name'], name='ship_game_name_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Drops the list of strikes from game snapshots, counting the hits by each player in its place
+
+from django.db import migrations
+
+
+def compact_snapshots(apps, schema_editor):
+    """Replace the strikes kept in each snapshot with the number of hits by each player"""
+
+    GameSnapshot = apps.get_model('server', 'GameSnapshot')
+
+    for snapshot in GameSnapshot.objects.all():
+        state = snapshot.state
+        if "strikes" not in state:
+            continue
+
+        hits = {}
+        for (x, y, player, result) in state.pop("strikes"):
+            if result.startswith("hit"):
+                hits[player] = hits.get(player, 0) + 1
+        state["hits"] = hits
+        snapshot.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0009_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Builds the event log for games from before 0006_event_log, from their Ship and Action rows
+#
+# Sunk ships were deleted, so the ships placed can only include those still afloat. A sink event is still
+# logged after each strike that sank a ship, with the ship name and owner taken from the strike result, but
+# with no ship id. Replays of these games therefore show their moves, strikes and winner exactly, while
+# ships that were sunk never appear.
+
+import re
+
+from django.db import migrations
+
+
+SUNK_RESULT = re.compile(r"^hit: ship (?P<name>.*) belonging to (?P<player>.*) was sunk\.$")
+
+
+def backfill_events(apps, schema_editor):
+    """Log the ships, strikes, sinks and winner of each game that has no events yet"""
+
+    Game = apps.get_model('server', 'Game')
+    Ship = apps.get_model('server', 'Ship')
+    Action = apps.get_model('server', 'Action')
+    GameEvent = apps.get_model('server', 'GameEvent')
+
+    # Archived games keep their events in the archive file instead
+    games = Game.objects.filter(archived=False, gameevent__isnull=True).select_related('winner')
+    for game in games:
+        game_events = []
+        for ship in Ship.objects.filter(game=game).select_related('player').order_by('id'):
+            game_events.append(('ship_placed', {"ship_id": ship.id, "name": ship.name, "player": ship.player.name,
+                                                "x": ship.x, "y": ship.y, "orientation": ship.orientation,
+                                                "length": ship.length}))
+
+        for action in Action.objects.filter(game=game).select_related('player').order_by('id'):
+            game_events.append(('strike', {"action_id": action.id, "player": action.player.name,
+                                           "location": [action.x, action.y], "result": action.result}))
+            sunk = SUNK_RESULT.match(action.result)
+            if sunk:
+                game_events.append(('sink', {"ship_id": None, "name": sunk["name"], "player": sunk["player"]}))
+
+        if game.winner:
+            game_events.append(('game_over', {"winner": game.winner.name}))
+
+        GameEvent.objects.bulk_create([GameEvent(game=game, sequence=sequence, kind=kind, data=data)
+                                       for (sequence, (kind, data)) in enumerate(game_events, 1)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0010_compact_snapshots'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_events, migrations.RunPython.noop),
+    ]
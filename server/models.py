@@ -1,17 +1,71 @@
 # Battleships models.py
 
 # From standard Python we will need some functions for randomness
-from random import choice, randint, shuffle
+from random import choice, shuffle
+
+# And counting
+from collections import Counter
 
 # And strings
 import string
 
+# Async versions of some methods need to call sync code
+from asgiref.sync import sync_to_async
+
 # From Django we need model code
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, Max
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
 
 # And we will sometimes raise exceptions
 from django.core.exceptions import PermissionDenied
 
+# Notifications for anyone watching a game
+from . import events
+
+# And storage for finished games
+from . import archive
+
+# And rebuilding games from their event logs
+from . import replay
+
+# Computer players, for tournaments
+from .bots import BOTS
+
+# The rules of the game, worked in memory
+from . import engine
+
+# And a cache of the state of each game
+from . import gamecache
+
+# How many times a strike is tried when other changes to the game keep getting in first, see Game.strike()
+STRIKE_ATTEMPTS = 10
+
+
+class _VersionConflict(Exception):
+    """Raised when a game has changed since its state was loaded, see Game._strike_version()"""
+
+
+def filter_by_name(queryset, prefix=None, after=None, limit=None):
+    """Narrow a queryset of games or players by name, in name order, see Player.iter_players_as_dicts()
+
+    A prefix is matched as a range of names, from the prefix up to the next possible prefix, rather than
+    with LIKE, so the database can use the unique index on the name, and the match is case sensitive.
+    """
+
+    queryset = queryset.order_by('name')
+    if prefix:
+        next_prefix = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        queryset = queryset.filter(name__gte=prefix, name__lt=next_prefix)
+    if after is not None:
+        queryset = queryset.filter(name__gt=after)
+    if limit is not None:
+        queryset = queryset[:limit]
+    return queryset
+
 
 class Player(models.Model):
     """A very disposable player class. At some point we will probably link these players to Django users, but
@@ -27,22 +81,31 @@ class Player(models.Model):
 
 
     @staticmethod
-    def list_players_as_dicts():
+    def list_players_as_dicts(prefix=None, after=None, limit=None):
         """A list of players as dicts to be more easily serialisable
 
-        Currently contains only names
+        Currently contains only names, the arguments are as for iter_players_as_dicts()
 
         """
 
-        player_list = []
-        players = Player.objects.all()
-        for player in players:
-            player_dict = {
-                "name" : player.name
-            }
-            player_list.append(player_dict)
+        return list(Player.iter_players_as_dicts(prefix=prefix, after=after, limit=limit))
+
 
-        return player_list
+    @staticmethod
+    def iter_players_as_dicts(prefix=None, after=None, limit=None):
+        """A generator of players as dicts, in name order, one at a time
+
+        prefix  if supplied, only players whose names start with this are included
+        after   if supplied, only players whose names come after this are included, to fetch the next page
+        limit   if supplied, at most this many players are included
+
+        Only the names are read, a chunk at a time, so no Player objects are made and the whole list is
+        never held in memory.
+        """
+
+        names = filter_by_name(Player.objects.all(), prefix, after, limit).values_list('name', flat=True)
+        for name in names.iterator():
+            yield {"name": name}
 
 
     def create_secret(self):
@@ -60,16 +123,16 @@ class Player(models.Model):
         return secret
 
     def get_secret(self):
-        """Fetch any secret and return it, if none exists return None"""
+        """Fetch any secret and return it, if none exists return None
 
-        player_secrets = PlayerSecret.objects.all().filter(player=self)
+        This needs no query at all if the secret was fetched with select_related('playersecret')
+        """
 
-        if not player_secrets.count():
+        try:
+            return self.playersecret.secret
+        except PlayerSecret.DoesNotExist:
             # There's no secret
             return None
-        else:
-            # Return the secret, there shouldn't be more than one, but return the first
-            return player_secrets[0].secret
 
     def get_colour(self):
         """This will allocate a consistent colour to players based on the name.
@@ -120,6 +183,11 @@ class Game(models.Model):
     created             When the game was created
     modified            When the game was last modified / accessed
     players             The Players in the game
+    winner              The Player who has won, if any, maintained as ships are created and sunk
+    archived            True once a finished game's ships and actions have been moved to an archive file
+    tournament          The Tournament the game is part of, if any
+    tournament_round    The round of the tournament the game is in, from 1
+    version             A number raised whenever anything in the game changes, see update_version()
     """
 
     name = models.CharField(max_length=50, unique=True)
@@ -129,33 +197,66 @@ class Game(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
     players = models.ManyToManyField(Player)
+    winner = models.ForeignKey(Player, null=True, blank=True, on_delete=models.SET_NULL, related_name='games_won')
+    archived = models.BooleanField(default=False)
+    tournament = models.ForeignKey('Tournament', null=True, blank=True, on_delete=models.CASCADE)
+    tournament_round = models.IntegerField(null=True, blank=True)
+    version = models.PositiveIntegerField(default=0)
 
 
     @staticmethod
-    def list_games_as_dicts():
-        """A list of players as dicts to be more easily serialisable
+    def list_games_as_dicts(prefix=None, after=None, limit=None):
+        """A list of games as dicts to be more easily serialisable
 
-        Currently contains only names
+        Currently contains only names, the arguments are as for iter_games_as_dicts()
 
         """
 
-        game_list = []
-        games = Game.objects.all()
-        for game in games:
-            game_dict = {
-                "name" : game.name
-            }
-            game_list.append(game_dict)
+        return list(Game.iter_games_as_dicts(prefix=prefix, after=after, limit=limit))
 
-        return game_list
 
+    @staticmethod
+    def iter_games_as_dicts(prefix=None, after=None, limit=None):
+        """A generator of games as dicts, in name order, one at a time
+
+        prefix  if supplied, only games whose names start with this are included
+        after   if supplied, only games whose names come after this are included, to fetch the next page
+        limit   if supplied, at most this many games are included
+
+        As Player.iter_players_as_dicts(), only the names are read.
+        """
+
+        names = filter_by_name(Game.objects.all(), prefix, after, limit).values_list('name', flat=True)
+        for name in names.iterator():
+            yield {"name": name}
+
+
+    def save(self, *args, **kwargs):
+        """Save the game, leaving the version as it is in the database
+
+        The version is only ever raised in the database by update_version(), so saving a Game object that was
+        loaded before some change must not put back the older number.
+        """
+
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'version']
+        super().save(*args, **kwargs)
 
-    def create_secret(self):
-        """Set a secret code for the current game and return that secret"""
+
+    @staticmethod
+    def make_secret():
+        """Return a new random secret code for a game, without storing it"""
 
         # Alpha Numeric six digit string
         alpha_numeric = string.ascii_letters + string.digits
-        secret = ''.join(choice(alpha_numeric) for i in range(6))
+        return ''.join(choice(alpha_numeric) for i in range(6))
+
+
+    def create_secret(self):
+        """Set a secret code for the current game and return that secret"""
+
+        secret = Game.make_secret()
 
         # Nuke any existing secrets
         GameSecret.objects.all().filter(game=self).delete()
@@ -166,93 +267,142 @@ class Game(models.Model):
 
 
     def get_secret(self):
-        """Fetch any secret and return it, if none exists return None"""
+        """Fetch any secret and return it, if none exists return None
 
-        game_secrets = GameSecret.objects.all().filter(game=self)
+        This needs no query at all if the secret was fetched with select_related('gamesecret')
+        """
 
-        if not game_secrets.count():
+        try:
+            return self.gamesecret.secret
+        except GameSecret.DoesNotExist:
             # There's no secret
             return None
-        else:
-            # Return the secret, there shouldn't be more than one, but return the first
-            return game_secrets[0].secret
 
 
     def start_game(self):
-        """Generate ships for all players in the game"""
+        """Generate ships for all players in the game
 
-        for player in self.players.all():
+        The whole fleet is planned in the game state, see get_game_state(), and then written to the
+        database in one transaction with bulk inserts, rather than several queries for every cell.
+        """
+
+        # The ships so far, and the names already taken
+        state = self.get_game_state()
+        used_names = set(ship.name for ship in state.get_ships())
+
+        # The players, through their state in this game, which we will need to update too
+        game_players = list(GamePlayer.objects.all().filter(game=self).select_related('player').order_by('player__name'))
+
+        # Plan the fleet as a list of tuples, (ship, [(x,y), ...])
+        fleet = []
+        for game_player in game_players:
             for x in range(0, self.ships_per_person):
-                self.create_ship(player)
+                placement = self._find_free_placement(state)
+                if not placement:
+                    # We just couldn't fit in the ship, as with create_ship, move on
+                    continue
+                (orientation, start_location) = placement
+                cells = self._get_possible_locations(orientation, start_location, 3)
+
+                name = self.get_random_ship_name(used_names)
+                used_names.add(name)
+                ship = Ship(name=name, game=self, player=game_player.player, x=start_location[0],
+                            y=start_location[1], orientation=orientation, length=3)
+                state.place_ship(ship, game_player.player_id, cells)
+                fleet.append((ship, cells))
+                game_player.ships_remaining += 1
+
+        # Now write it all in one go
+        try:
+            with transaction.atomic():
+                Ship.objects.bulk_create([ship for (ship, cells) in fleet])
+                self.log_events([self._get_ship_placed_event(ship) for (ship, cells) in fleet])
+
+                # Bulk inserts skip the signals that maintain the ship counts, so update those directly
+                GamePlayer.objects.bulk_update(game_players, ['ships_remaining'])
+                self.update_winner({game_player.player_id: game_player.ships_remaining
+                                    for game_player in game_players})
+
+                # Write the fleet through to the game cache, if the database gave us the ids of the new ships
+                if all(ship.pk for (ship, cells) in fleet):
+                    gamecache.put(self, self._get_cache_entry(state))
+
+                game_id = self.id
+                transaction.on_commit(lambda: events.notify(game_id))
+        except:
+            # The planned ships are already in the game state, so start again from the database next time
+            self._game_state = None
+            raise
+
+
+    def _get_possible_locations(self, orientation, start_location, ship_length):
+        """Work out the cells a ship would occupy, without checking for collisions
+
+        orientation     One of "horizontal", "vertical" or "diagonal"
+        start_location  A tuple (x,y) of the start position
+        ship_length     The number of cells the ship occupies
+
+        returns a list of location tuples (x,y), or None if the ship would not fit on the grid
+        """
+
+        # TODO: Consider raising an error for a void orientation perhaps?
+        return engine.get_possible_cells(self.maximum_x, self.maximum_y, orientation, start_location, ship_length)
 
 
     def _create_ship_check(self, orientation, player, start_location, ship_length, name=None):
-        """Try to create a horizontal ship from a certain location to the right
+        """Try to create a ship from a certain location in a given orientation
 
         orientation     One of "horizontal", "vertical" or "diagonal" with which to attempt to build the ship
         player          The player who will own any created ship
         start_location  A tuple (x,y) of the start position
-        ship_length     We will try to occupy this many cells to the right of the start_location
+        ship_length     We will try to occupy this many cells from the start_location
         name            A name for any successfully created ship, None for a random choice
 
         returns a Ship that has been added to the database, or None otherwise
         """
 
-        # If the orientiation is void, return None
-        # TODO: Consider raising an error perhaps?
-        if orientation not in ['horizontal', 'vertical', 'diagonal']:
+        possible_locations = self._get_possible_locations(orientation, start_location, ship_length)
+        if not possible_locations:
             return None
 
-        # Get the start coordinates from the tuple location
-        (startx, starty) = start_location
-
-        # Make a list of the potential locations the ship would occupy
-        possible_locations = []
-        if orientation == 'horizontal':
-            # Head to the right from the start location
-            if startx + ship_length > self.maximum_x:
-                # Not enough room
-                return None
-            for x in range(0, ship_length):
-                possible_locations.append((startx+x,starty))
-        if orientation == 'vertical':
-            # Head above the start location (if above is larger y)
-            if starty + ship_length > self.maximum_y:
-                # Not enough room
-                return None
-            for y in range(0, ship_length):
-                possible_locations.append((startx,starty+y))
-        if orientation == 'diagonal':
-            # Head to top right of start location
-            if startx + ship_length > self.maximum_x or starty + ship_length > self.maximum_y:
-                # Not enough room
-                return None
-
-            for xy in range(0, ship_length):
-                possible_locations.append((startx+xy,starty+xy))
-
-        # Check of any of these collide with existing ships
-        for location in possible_locations:
-            if self.check_for_hit((location)):
-                # Already a ship there, we can't create a new one
-                return None
+        # Check if any of these collide with existing ships
+        state = self.get_game_state()
+        if not state.can_place(possible_locations):
+            # Already a ship there, we can't create a new one
+            return None
 
         # We had no collisions, so the space must be free, create the new ship
         if not name:
             name = self.get_random_ship_name()
+        (x, y) = start_location
         ship = Ship.objects.create(name=name,
                             game=self,
-                            player=player)
+                            player=player,
+                            x=x,
+                            y=y,
+                            orientation=orientation,
+                            length=ship_length)
 
-        # Save its locations, creating those in the Model layer
-        for (x,y) in possible_locations:
-            model_location = Location.objects.create(x=x,y=y,game=self)
-            ship.locations.add(model_location)
-        ship.save()
+        # Keep the game state current, and log the new ship
+        state.place_ship(ship, player.id, possible_locations)
+        self.log_events([self._get_ship_placed_event(ship)])
 
         return ship
 
 
+    def _find_free_placement(self, state, ship_length=3):
+        """Find a random free placement for a ship, without touching the database
+
+        state           the GameState, with the ships placed so far
+        ship_length     the number of locations the ship will occupy (3 by default)
+
+        returns a tuple (orientation, (x,y)) for the placement, or None if there is no space at all,
+        see GameState.find_free_placement()
+        """
+
+        return state.find_free_placement(ship_length)
+
+
     def create_ship(self, player, ship_length=3):
         """A function to automatically generate a random ship for a player
 
@@ -260,31 +410,84 @@ class Game(models.Model):
         ship_length     the number of locations the ship will occupy (3 by default)
         """
 
-        # Pick an orientation
-        orientation = choice(['horizontal', 'vertical', 'diagonal'])
+        placement = self._find_free_placement(self.get_game_state(), ship_length)
+        if not placement:
+            # Oops, we just couldn't fit in the ship
+            return None
 
-        # Maintain a list of tuples of possible starting points
-        start_locations_tried = list()
+        (orientation, start_location) = placement
+        return self._create_ship_check(orientation, player, start_location, ship_length)
 
-        # Keep going till we have created the ship, or exhausted all possibilities
-        while  (len(start_locations_tried) < (self.maximum_x * self.maximum_y)):
-            # Pick a start location. This is naive at best
-            startx = randint(1, self.maximum_x)
-            starty = randint(1, self.maximum_y)
 
-            if (startx, starty) in start_locations_tried:
-                # This one is used, go around the block
-                continue
+    def get_game_state(self):
+        """Return the in-memory engine.GameState for the game, with the Ship objects as the keys of its ships
+
+        This is built the first time it is needed for this Game object, from the game cache if it holds the
+        state at this version, or otherwise from the database, which also fills the cache. It is then kept
+        current as ships are created and sunk through this object, so that hit tests need no further queries.
+        """
+
+        state = getattr(self, '_game_state', None)
+        if state is None:
+            state = engine.GameState(self.maximum_x, self.maximum_y)
+            entry = gamecache.get(self)
+            if entry is None:
+                state.set_moves(self.get_move_counts())
+                for ship in self.ship_set.all().select_related('player'):
+                    state.place_ship(ship, ship.player_id, ship.get_locations_as_tuples())
+                gamecache.put(self, self._get_cache_entry(state))
             else:
-                # Track this choice
-                start_locations_tried.append((startx, starty))
+                state.set_moves(entry["moves"])
+                for ship in self._get_cached_ships(entry):
+                    state.place_ship(ship, ship.player_id, ship.get_locations_as_tuples())
+            self._game_state = state
 
-            ship = self._create_ship_check(orientation, player, (startx, starty), ship_length)
-            if ship:
-                return ship
+        return state
+
+
+    def _get_cache_entry(self, state):
+        """Return a game state as a plain dict to keep in the game cache, see gamecache
+
+        moves   the number of strikes made by each player in the game, keyed by player id
+        ships   the ships afloat, each as a tuple (id, name, player id, player name, x, y, orientation, length)
+        """
+
+        return {
+            "moves": state.get_move_counts(),
+            "ships": [(ship.id, ship.name, ship.player_id, ship.player.name, ship.x, ship.y, ship.orientation,
+                       ship.length) for ship in state.get_ships()],
+        }
 
-        # Oops, we just couldn't fit in the ship
-        return None
+
+    def _get_cached_ships(self, entry):
+        """Return the ships in a game cache entry as Ship objects, along with their players, in name order"""
+
+        players = dict()
+        ships = []
+        for (ship_id, name, player_id, player_name, x, y, orientation, length) in sorted(entry["ships"],
+                                                                                         key=lambda ship: ship[1]):
+            player = players.get(player_id)
+            if player is None:
+                player = players[player_id] = Player(id=player_id, name=player_name)
+            ships.append(Ship(id=ship_id, name=name, game=self, player=player, x=x, y=y, orientation=orientation,
+                              length=length))
+        return ships
+
+
+    def get_current_game_state(self):
+        """Return the game state as get_game_state(), first making sure it is as current as the database
+
+        One query reads the game version, and only if something has changed the game since (see
+        update_version()) is the state loaded again, along with the winner. The state is loaded after the
+        version is read, so it is never older than self.version.
+        """
+
+        (version, winner_id) = Game.objects.all().filter(pk=self.pk).values_list('version', 'winner_id').get()
+        if version != self.version:
+            self.version = version
+            self.winner_id = winner_id
+            self._game_state = None
+        return self.get_game_state()
 
 
     def check_for_hit(self, location):
@@ -293,15 +496,7 @@ class Game(models.Model):
         location    a location tuple (x,y) to check for a hit
         """
 
-        # Get all existing ships in this game
-        ships = Ship.objects.all().filter(game=self)
-
-        for ship in ships:
-            if ship.check_for_hit(location):
-                return ship
-
-        # Nothing?
-        return None
+        return self.get_game_state().check_for_hit(tuple(location))
 
 
     def strike(self, player, location):
@@ -311,48 +506,115 @@ class Game(models.Model):
         location    the location to strike as a tuple (x,y)
 
         returns an Action is the strike was a valid attempt or an error string otherwise
+
+        Strikes in the same game, even from other processes, are made one at a time by claiming the next game
+        version, and a strike that loses the race is checked again against the new state and retried. So
+        no player can take two turns at once, and no ship can be sunk twice.
         """
 
-        # If the player isn't in the game, stop now
-        if player not in self.players.all():
-            raise PermissionDenied("NotInGame")
+        for attempt in range(STRIKE_ATTEMPTS):
+            # Changes may have been made through other Game objects, or in other processes, so make sure the
+            # game state is as current as the version in the database
+            state = self.get_current_game_state()
 
-        # If there are no ships, stop now
-        if not Ship.objects.all().filter(game=self).count():
-            raise PermissionDenied("NoShipsInGame")
+            # Stop now if the player isn't in the game, there are no ships, or the player is already a move
+            # ahead of anyone else
+            state.check_strike(player.id)
 
-        # Get actions to date
-        all_actions = Action.objects.all().filter(game=self)
+            try:
+                action = self._strike_version(state, player, location)
+            except _VersionConflict:
+                # Someone else changed the game first, so look again
+                continue
+            except:
+                # The strike may be part made in the game state, so start again from the database next time
+                self._game_state = None
+                raise
+            break
+        else:
+            raise PermissionDenied("Busy")
 
-        # If the current player is already a move ahead of anyone else then we should disallow this attempt
-        number_of_player_actions = all_actions.filter(player=player).count()
-        for p in self.players.all():
-            if number_of_player_actions > all_actions.filter(player=p).count():
-                raise PermissionDenied("NotYourTurn")
+        # Write the new state through to the game cache, so the next strike in this game needn't load it
+        gamecache.put(self, self._get_cache_entry(state))
 
-        # Check for any hit
-        ship = self.check_for_hit(location)
-        if ship:
-            # A ship was hit!
-            result = f"hit: ship {ship.name} belonging to {ship.player.name} was sunk."
-            # Delete the ship from the database
-            ship.delete()
-        else:
-            # It was a miss!
-            result = f"miss:"
+        # Update the player's modified timestamp, the game's was updated along with its version. Saving the
+        # whole game here could put back an old winner read before another player's strike.
+        player.save(update_fields=['modified'])
+
+        # If that was the winning strike, the game may be archived straight away
+        if self.winner_id and settings.BATTLESHIPS_ARCHIVE_ON_GAME_OVER:
+            transaction.on_commit(self.archive)
+
+        return action
+
+
+    def _strike_version(self, state, player, location):
+        """Make a strike, as strike(), if the game is still at the version the game state was loaded at
+
+        state       the game state, current as of self.version
+        player      the player to take the action
+        location    the location to strike as a tuple (x,y)
+
+        returns the Action, or raises _VersionConflict if the game has changed since, having changed nothing
+        """
+
+        with transaction.atomic():
+            # Claim the next version of the game. This only matches if nobody has changed the game since the
+            # state was loaded, so concurrent strikes in one game take turns, while other games carry on.
+            if not self.claim_version():
+                raise _VersionConflict()
 
-        # Our input location is a tuple, but we need to convert it to a Location object
-        (x, y) = location
-        location_object = Location.objects.create(x=x, y=y, game=self)
-        action = Action.objects.create(game=self, player=player, location=location_object, result=result)
+            GamePlayer.objects.filter(game=self, player=player).update(moves=F('moves') + 1)
 
-        # Save both game and player to force modified timestamp update
-        self.save()
-        player.save()
+            # Make the strike in the game state, which sinks any ship hit there
+            ship = state.strike(player.id, tuple(location))
+            if ship:
+                # A ship was hit!
+                result = f"hit: ship {ship.name} belonging to {ship.player.name} was sunk."
+                sink_event = ('sink', {"ship_id": ship.id, "name": ship.name, "player": ship.player.name})
+                # Delete the ship from the database too
+                ship.delete()
+            else:
+                # It was a miss!
+                result = f"miss:"
+                sink_event = None
+
+            # Our input location is a tuple, which is stored inline with the action
+            (x, y) = location
+            action = Action.objects.create(game=self, player=player, x=x, y=y, result=result)
+
+            # Record what happened in the event log
+            game_events = [('strike', {"action_id": action.id, "player": player.name, "location": (x, y),
+                                       "result": result})]
+            if sink_event:
+                game_events.append(sink_event)
+                if self.winner_id:
+                    game_events.append(('game_over', {"winner": self.winner.name}))
+            self.log_events(game_events, update_version=False)
+
+            # Wake anyone streaming this game, once the strike is safely committed
+            game_id = self.id
+            transaction.on_commit(lambda: events.notify(game_id))
 
         return action
 
 
+    def get_move_counts(self):
+        """Return the number of moves made so far by each player in the game
+
+        returns a dict keyed by player id, with the number of strikes made as the value
+        """
+
+        return dict(GamePlayer.objects.all().filter(game=self).values_list('player_id', 'moves'))
+
+
+    async def aget_move_counts(self):
+        """An async version of get_move_counts(), for the async views"""
+
+        return {player_id: moves async for (player_id, moves)
+                in GamePlayer.objects.all().filter(game=self).values_list('player_id', 'moves')}
+
+
     def number_of_ships(self, player=None):
         """Return the number of active ships
 
@@ -366,38 +628,318 @@ class Game(models.Model):
         return ships.count()
 
 
-    def list_actions_as_dicts(self):
-        """Return all the actions associated with the game as a list of dicts"""
+    def list_actions_as_dicts(self, since=None, limit=None):
+        """Return the actions associated with the game as a list of dicts
+
+        since   if supplied, only actions with an id greater than this are returned
+        limit   if supplied, at most this many actions are returned
+
+        The actions are fetched along with their players in a single query, and are in the
+        order they were made, so the id of the last one can be passed as since to fetch only newer actions.
+        Archived games are read from their archive file.
+        """
+
+        if self.archived:
+            return list(self.iter_archived_actions(since=since, limit=limit))
 
         action_list = []
-        actions = Action.objects.all().filter(game=self).order_by("created")
-        for action in actions:
-            action_dict = {
-                "game" : action.game.name,
-                "player" : action.player.name,
-                "location" : ((action.location.x, action.location.y)),
-                "result" : action.result,
-                "created" : action.created
-            }
-            action_list.append(action_dict)
+        for action in self._get_actions(since, limit):
+            action_list.append(self._action_as_dict(action))
 
         return action_list
 
 
+    async def alist_actions_as_dicts(self, since=None, limit=None):
+        """An async version of list_actions_as_dicts(), for the async views"""
+
+        if self.archived:
+            # Reading the archive file would block, so do it in a thread
+            return await sync_to_async(self.list_actions_as_dicts)(since=since, limit=limit)
+
+        return [self._action_as_dict(action) async for action in self._get_actions(since, limit)]
+
+
+    def _get_actions(self, since, limit):
+        """Return a QuerySet of the game's actions, with their players, for list_actions_as_dicts()"""
+
+        actions = Action.objects.all().filter(game=self).select_related('player').order_by("id")
+        if since is not None:
+            actions = actions.filter(id__gt=since)
+        if limit is not None:
+            actions = actions[:limit]
+        return actions
+
+
+    def _action_as_dict(self, action):
+        """Return an action in this game as a dict, see list_actions_as_dicts()"""
+
+        return {
+            "id" : action.id,
+            "game" : self.name,
+            "player" : action.player.name,
+            "location" : ((action.x, action.y)),
+            "result" : action.result,
+            "created" : action.created
+        }
+
+
     def list_ships_by_player(self, player):
         """Return a list of ship objections as dicts for a given player"""
 
+        if self.archived:
+            return [{"name": ship["name"], "locations": ship["locations"]}
+                    for ship in self.iter_archived_ships() if ship["player"] == player.name]
+
+        # The game cache holds all the ships afloat, if anyone has played or looked at the game lately
+        entry = gamecache.get(self)
+        if entry is not None:
+            return [self._ship_as_dict(ship) for ship in self._get_cached_ships(entry) if ship.player_id == player.id]
+
         ships_list = []
         ships = Ship.objects.all().filter(game=self).filter(player=player)
         for ship in ships:
-            ship_dict = {
-                "name": ship.name,
-                "locations": ship.get_locations_as_tuples()
-            }
-            ships_list.append(ship_dict)
+            ships_list.append(self._ship_as_dict(ship))
         return ships_list
 
 
+    async def alist_ships_by_player(self, player):
+        """An async version of list_ships_by_player(), for the async views"""
+
+        if self.archived:
+            # Reading the archive file would block, so do it in a thread
+            return await sync_to_async(self.list_ships_by_player)(player)
+
+        entry = await gamecache.aget(self)
+        if entry is not None:
+            return [self._ship_as_dict(ship) for ship in self._get_cached_ships(entry) if ship.player_id == player.id]
+
+        ships = Ship.objects.all().filter(game=self).filter(player=player)
+        return [self._ship_as_dict(ship) async for ship in ships]
+
+
+    def _ship_as_dict(self, ship):
+        """Return a ship as a dict, see list_ships_by_player()"""
+
+        return {
+            "name": ship.name,
+            "locations": ship.get_locations_as_tuples()
+        }
+
+
+    def _get_ship_placed_event(self, ship):
+        """Return the event for the log recording a new ship, as a tuple (kind, data)"""
+
+        return ('ship_placed', {
+            "ship_id": ship.id,
+            "name": ship.name,
+            "player": ship.player.name,
+            "x": ship.x,
+            "y": ship.y,
+            "orientation": ship.orientation,
+            "length": ship.length,
+        })
+
+
+    def log_events(self, game_events, update_version=True):
+        """Append events to the game's event log, taking a snapshot of the state every so often
+
+        game_events     a list of tuples (kind, data), see GameEvent
+        update_version  False if the caller has already raised the game version for these, see strike()
+
+        A snapshot is stored whenever the number of events passes a multiple of
+        BATTLESHIPS_SNAPSHOT_INTERVAL, so that get_state() never needs to replay more than that many events.
+        """
+
+        if not game_events:
+            return
+
+        if update_version:
+            self.update_version()
+        last_sequence = self.count_events()
+        GameEvent.objects.bulk_create([GameEvent(game=self, sequence=last_sequence + number, kind=kind, data=data)
+                                       for (number, (kind, data)) in enumerate(game_events, 1)])
+
+        interval = settings.BATTLESHIPS_SNAPSHOT_INTERVAL
+        new_sequence = last_sequence + len(game_events)
+        if last_sequence // interval != new_sequence // interval:
+            snapshot_sequence = new_sequence // interval * interval
+            GameSnapshot.objects.create(game=self, sequence=snapshot_sequence,
+                                        state=self._replay_state(snapshot_sequence))
+
+
+    def get_state(self, sequence=None):
+        """Return the state of the game as it was after a given event, see replay.py for the contents
+
+        sequence    the number of the event, None for the latest
+
+        The state also has "strikes", a list of every strike so far as [x, y, player name, result], which
+        is read from the strike events rather than kept in the snapshots.
+        """
+
+        if self.archived:
+            # There are no snapshots, so replay everything from the archive
+            state = replay.initial_state()
+            strikes = []
+            for event in archive.read(self.get_archive_path(), 'event'):
+                if sequence is not None and event["sequence"] > sequence:
+                    break
+                replay.apply_event(state, event["sequence"], event["kind"], event["data"])
+                if event["kind"] == 'strike':
+                    strikes.append(replay.get_strike(event["data"]))
+            state["strikes"] = strikes
+            return state
+
+        state = self._replay_state(sequence)
+        strike_events = self.gameevent_set.filter(kind='strike', sequence__lte=state["sequence"])
+        state["strikes"] = [replay.get_strike(data)
+                            for data in strike_events.order_by('sequence').values_list('data', flat=True)]
+        return state
+
+
+    def _replay_state(self, sequence):
+        """Return the state of the game after a given event, as stored in a snapshot, without the strikes
+
+        sequence    the number of the event, None for the latest
+
+        The nearest earlier snapshot is loaded and then any later events are applied to it.
+        """
+
+        snapshots = self.gamesnapshot_set.all().order_by('-sequence')
+        game_events = self.gameevent_set.all().order_by('sequence')
+        if sequence is not None:
+            snapshots = snapshots.filter(sequence__lte=sequence)
+            game_events = game_events.filter(sequence__lte=sequence)
+
+        snapshot = snapshots.first()
+        if snapshot:
+            state = snapshot.state
+            game_events = game_events.filter(sequence__gt=snapshot.sequence)
+        else:
+            state = replay.initial_state()
+
+        for game_event in game_events:
+            replay.apply_event(state, game_event.sequence, game_event.kind, game_event.data)
+
+        return state
+
+
+    def count_events(self):
+        """Return the number of events in the game's log"""
+
+        if self.archived:
+            return sum(1 for event in archive.read(self.get_archive_path(), 'event'))
+
+        return self.gameevent_set.aggregate(Max('sequence'))['sequence__max'] or 0
+
+
+    def get_archive_path(self):
+        """Return the path of the archive file for the game, whether or not it exists"""
+
+        return archive.get_path(self.id)
+
+
+    def archive(self):
+        """Move a finished game out of the database and into a compressed archive file
+
+        The file contains a line of JSON describing the game, then one for each surviving ship, one for
+        each event in the log, and then one for each action, with the same content as
+        list_actions_as_dicts(). The ships, events and actions are then deleted from the database, though the game itself, its players and the winner are kept, so
+        that the API can carry on serving the game from the archive.
+        """
+
+        if self.archived:
+            return
+        if not self.winner_id:
+            raise PermissionDenied("GameNotFinished")
+
+        def records():
+            yield {
+                "type": "game",
+                "name": self.name,
+                "maximum_x": self.maximum_x,
+                "maximum_y": self.maximum_y,
+                "ships_per_person": self.ships_per_person,
+                "created": self.created,
+                "winner": self.winner.name,
+                "players": [player.name for player in self.players.all()],
+            }
+            for ship in self.ship_set.all().select_related('player'):
+                yield {
+                    "type": "ship",
+                    "name": ship.name,
+                    "player": ship.player.name,
+                    "x": ship.x,
+                    "y": ship.y,
+                    "orientation": ship.orientation,
+                    "length": ship.length,
+                    "locations": ship.get_locations_as_tuples(),
+                }
+            for game_event in self.gameevent_set.all().order_by('sequence').iterator():
+                yield {
+                    "type": "event",
+                    "sequence": game_event.sequence,
+                    "kind": game_event.kind,
+                    "data": game_event.data,
+                }
+            actions = Action.objects.all().filter(game=self).select_related('player').order_by("id")
+            for action in actions.iterator():
+                yield {
+                    "type": "action",
+                    "id": action.id,
+                    "game": self.name,
+                    "player": action.player.name,
+                    "location": (action.x, action.y),
+                    "result": action.result,
+                    "created": action.created,
+                }
+
+        archive.write(self.get_archive_path(), records())
+
+        with transaction.atomic():
+            # Deleting the ships would otherwise wipe out the counts and the winner, so put them back after
+            game_players = list(GamePlayer.objects.all().filter(game=self))
+            winner_id = self.winner_id
+
+            Action.objects.all().filter(game=self).delete()
+            Ship.objects.all().filter(game=self).delete()
+            GameEvent.objects.all().filter(game=self).delete()
+            GameSnapshot.objects.all().filter(game=self).delete()
+
+            GamePlayer.objects.bulk_update(game_players, ['ships_remaining'])
+            Game.objects.all().filter(pk=self.pk).update(archived=True, winner_id=winner_id)
+
+        self.archived = True
+        self.winner_id = winner_id
+        self._game_state = None
+
+
+    def iter_archived_actions(self, since=None, limit=None):
+        """A generator of the actions of an archived game as dicts, read from the archive a line at a time
+
+        since   if supplied, only actions with an id greater than this are returned
+        limit   if supplied, at most this many actions are returned
+        """
+
+        count = 0
+        for action in archive.read(self.get_archive_path(), 'action'):
+            if limit is not None and count >= limit:
+                return
+            if since is not None and action["id"] <= since:
+                continue
+            del action["type"]
+            action["location"] = tuple(action["location"])
+            count += 1
+            yield action
+
+
+    def iter_archived_ships(self):
+        """A generator of the surviving ships of an archived game as dicts, read from the archive"""
+
+        for ship in archive.read(self.get_archive_path(), 'ship'):
+            ship["locations"] = [tuple(location) for location in ship["locations"]]
+            yield ship
+
+
     def get_ships_by_player(self):
         """Get the list of active ships by player
 
@@ -412,44 +954,74 @@ class Game(models.Model):
 
 
     def get_winner(self):
-        """Check for any winner, returns a Player if so, or None otherwise"""
+        """Check for any winner, returns a Player if so, or None otherwise
 
-        # TODO: This algorithm feels horribly convoluted...
-        ships_by_player = self.get_ships_by_player()
+        The winner is maintained on the game as ships are created and sunk, so this is a single row read
+        """
 
-        # If there are no players, give up now
-        if not len(ships_by_player):
-            return None
+        return Player.objects.all().filter(games_won=self).first()
 
-        # Make a simpler list of tuples, [(player, number of ships)]
-        ship_numbers = []
 
-        for player, ships in ships_by_player.items():
-            ship_numbers.append((player, len(ships)))
+    async def aget_winner(self):
+        """An async version of get_winner(), for the async views"""
 
-        # Sort them by descending numbers of ships (winners first)
-        ship_numbers = sorted(ship_numbers, key=lambda x: x[1], reverse=True)
+        return await Player.objects.all().filter(games_won=self).afirst()
 
-        # Get the top ranked player - it will be the first in the list
-        (top_player, top_player_ships) = ship_numbers[0]
-        # If they have no ships, then nobody has any, and nobody wins (maybe no ships have yet been created)
-        if not top_player_ships:
-            return None
 
-        # Ok, if anyone else has ships there is no winner yet, so return None
-        for x in range(1, len(ship_numbers)):
-            (player, player_ships) = ship_numbers[x]
-            if player_ships:
-                return None
+    def update_winner(self, ships_remaining=None):
+        """Work out any winner from the ships remaining for each player, and store it on the game
+
+        There is a winner when exactly one player still has ships. If nobody has any ships, maybe because
+        none have yet been created, nobody wins.
+
+        ships_remaining     if supplied, a dict of ships remaining keyed by player id, otherwise it is read
+        """
+
+        if ships_remaining is None:
+            ships_remaining = dict(GamePlayer.objects.all().filter(game=self).values_list('player_id', 'ships_remaining'))
+
+        players_with_ships = [player_id for player_id, ships in ships_remaining.items() if ships]
+        if len(players_with_ships) == 1:
+            winner_id = players_with_ships[0]
+        else:
+            winner_id = None
+
+        # Update just this column, without touching the rest of the row
+        Game.objects.all().filter(pk=self.pk).update(winner_id=winner_id)
+        self.winner_id = winner_id
+
+
+    def update_version(self):
+        """Raise the version of the game, and its modified time, after a change to its players, ships or actions
+
+        Anything cached for the game is keyed by the version, so it is simply never used again. This is done
+        in the database, so concurrent changes each count, and the number held here may be behind.
+        """
 
-        # Nobody else had ships and the top_player did so we have a winner
-        return(top_player)
+        Game.objects.all().filter(pk=self.pk).update(version=F('version') + 1, modified=timezone.now())
+        self.version += 1
 
 
-    def get_random_ship_name(self):
+    def claim_version(self):
+        """Raise the version of the game as update_version(), but only if the database still holds self.version
+
+        returns True if the version was raised, so nothing else can have changed the game in between, or
+        False if the game had already moved on, having changed nothing
+        """
+
+        claimed = Game.objects.all().filter(pk=self.pk, version=self.version)\
+            .update(version=F('version') + 1, modified=timezone.now())
+        if claimed:
+            self.version += 1
+        return bool(claimed)
+
+
+    def get_random_ship_name(self, used_names=None):
         """
         Returns a random ship name, with thanks to Ian M. Banks
 
+        used_names      if supplied, a set of names already taken, otherwise the database is checked
+
         Feel free to add more
         https://en.wikipedia.org/wiki/List_of_spacecraft_in_the_Culture_series
 
@@ -517,7 +1089,10 @@ class Game(models.Model):
         # Try them in turn
         for name in names:
             # Already used?
-            if not Ship.objects.all().filter(game=self).filter(name=name):
+            if used_names is not None:
+                if name not in used_names:
+                    return name
+            elif not Ship.objects.all().filter(game=self).filter(name=name):
                 # No... use this one
                 return name
 
@@ -533,62 +1108,69 @@ class Game(models.Model):
         ordering = ['name']
 
 
-class Location(models.Model):
-    """A grid location. Mainly used to record ship cells, and strike attempts.
-
-    x       The x location
-    y       The y location
-    game    The game with this this is associated (for ease of cleanup)
-    """
-
-    x = models.IntegerField()
-    y = models.IntegerField()
-    game = models.ForeignKey(Game, on_delete=models.CASCADE)
-
-    def __str__(self):
-        return f"({self.x}, {self.y})"
-
-
 class Ship(models.Model):
     """An individual ship within the game
 
+    Ships occupy a straight line of cells, so rather than storing each cell, only the start, the
+    direction and the length are stored, and the cells are worked out from those.
+
     name        A name for the ship
     game        The game in which the ship exists
     player      The Player who owns the ship
-    locations   The grid cells occupied by the ship as Location objects"""
+    x           The x location of the start of the ship
+    y           The y location of the start of the ship
+    orientation The direction the ship runs from the start, one of "horizontal", "vertical" or "diagonal"
+    length      The number of cells the ship occupies"""
+
+    ORIENTATION_CHOICES = [
+        ('horizontal', 'Horizontal'),
+        ('vertical', 'Vertical'),
+        ('diagonal', 'Diagonal'),
+    ]
 
     name = models.CharField(max_length=50)
     game = models.ForeignKey(Game, on_delete=models.CASCADE)
     player = models.ForeignKey(Player, on_delete=models.CASCADE)
-    locations = models.ManyToManyField(Location)
+    x = models.IntegerField()
+    y = models.IntegerField()
+    orientation = models.CharField(max_length=10, choices=ORIENTATION_CHOICES)
+    length = models.IntegerField(default=3)
+
+    @staticmethod
+    def get_cells(orientation, start_location, length):
+        """Return the cells a ship would occupy as a list of tuples (x,y)
+
+        orientation     One of "horizontal", "vertical" or "diagonal"
+        start_location  A tuple (x,y) of the start position
+        length          The number of cells the ship occupies
+
+        Horizontal ships head to the right of the start, vertical ones above it (if above is larger y),
+        and diagonal ones to the top right.
+        """
+
+        return engine.get_cells(orientation, start_location, length)
 
     def check_for_hit(self, location):
         """Checks if the ship is on a given location and returns True or False"""
 
-        # The input is a tuple, get the x and y coordinate
-        (x, y) = location
-        # Check if the passed in location is in the list of ship locations
-        for location in self.locations.all():
-            if x == location.x and y == location.y:
-                return True
-
-        return False
+        return tuple(location) in self.get_locations_as_tuples()
 
     def get_locations_as_tuples(self):
         """Return ship locations as a list of tuples (x,y)"""
 
-        locations_as_tuples = []
-
-        for location in self.locations.all():
-            locations_as_tuples.append((location.x, location.y))
-
-        return locations_as_tuples
+        return Ship.get_cells(self.orientation, (self.x, self.y), self.length)
 
     def __str__(self):
         return self.name
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            # A player's ships in a game, already in name order, see list_ships_by_player() and get_ships_by_player()
+            models.Index(fields=['game', 'player', 'name'], name='ship_game_player_name_idx'),
+            # Whether a name is taken in a game, see get_random_ship_name()
+            models.Index(fields=['game', 'name'], name='ship_game_name_idx'),
+        ]
 
 
 class Action(models.Model):
@@ -596,20 +1178,331 @@ class Action(models.Model):
 
     game      The Game within which the action occurred
     player    The Player who took the action
-    location  The location of the attempted hit
+    x         The x location of the attempted hit
+    y         The y location of the attempted hit
     result    A short text description of the outcome"""
 
     game = models.ForeignKey(Game, on_delete=models.CASCADE)
     player = models.ForeignKey(Player, on_delete=models.CASCADE)
-    location = models.ForeignKey(Location, on_delete=models.CASCADE)
+    x = models.IntegerField()
+    y = models.IntegerField()
     result = models.CharField(max_length=100)
     created = models.DateTimeField(auto_now_add=True)
 
+    @property
+    def location(self):
+        """The location of the attempted hit as a tuple (x,y)"""
+
+        return (self.x, self.y)
+
     def __str__(self):
         return f"game: {self.game} result: {self.result}"
 
     class Meta:
         ordering = ['created']
+        indexes = [
+            # A game's history in order from a cursor, see list_actions_as_dicts()
+            models.Index(fields=['game', 'id'], name='action_game_id_idx'),
+        ]
+
+
+class GamePlayer(models.Model):
+    """Records the state of a Player within a Game, so that turn checks do not need to count actions
+
+    Rows are maintained automatically as players are added to and removed from games.
+
+    game            The Game in question
+    player          The Player in the game
+    moves           The number of strikes the player has made in the game so far
+    ships_remaining The number of ships the player has left in the game
+    """
+
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+    moves = models.IntegerField(default=0)
+    ships_remaining = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"game: {self.game.name}, player: {self.player.name}, moves: {self.moves}, ships: {self.ships_remaining}"
+
+    class Meta:
+        unique_together = [['game', 'player']]
+
+
+class GameEvent(models.Model):
+    """An entry in the append-only log of everything that happens in a game
+
+    game        The Game in which the event happened
+    sequence    The number of the event within the game, starting from 1
+    kind        What happened, one of "ship_placed", "strike", "sink" or "game_over"
+    data        A dict describing the event, see Game.strike() and Game._get_ship_placed_event()
+    created     When the event happened
+    """
+
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    sequence = models.IntegerField()
+    kind = models.CharField(max_length=20)
+    data = models.JSONField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"game: {self.game.name}, event: {self.sequence}, {self.kind}"
+
+    class Meta:
+        ordering = ['game', 'sequence']
+        unique_together = [['game', 'sequence']]
+
+
+class GameSnapshot(models.Model):
+    """The state of a game after a given event, so that replays can start here rather than from scratch
+
+    game        The Game
+    sequence    The number of the last event included in the state
+    state       The state of the game, as a dict, see replay.py
+    """
+
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    sequence = models.IntegerField()
+    state = models.JSONField()
+
+    def __str__(self):
+        return f"game: {self.game.name}, snapshot at event: {self.sequence}"
+
+    class Meta:
+        ordering = ['game', 'sequence']
+        unique_together = [['game', 'sequence']]
+
+
+class Tournament(models.Model):
+    """A set of games between a group of players, played out by bots
+
+    name                The name of the tournament, also used to name its games
+    format              How players are paired, see FORMAT_CHOICES
+    strategy            The name of the bot, from bots.BOTS, that plays for every player
+    players             The Players taking part
+    maximum_x           The largest possible x value in each game
+    maximum_y           The largest possible y value in each game
+    ships_per_person    The number of ships to generate for each player in each game
+    created             When the tournament was created
+
+    Every game is between two players. In a round robin everyone plays everyone else once, and all the games
+    are scheduled at the start. In a knockout the winners of each round play each other in the next, so
+    each round is only scheduled once the last has finished.
+    """
+
+    ROUND_ROBIN = 'round_robin'
+    KNOCKOUT = 'knockout'
+    FORMAT_CHOICES = (
+        (ROUND_ROBIN, 'Round Robin'),
+        (KNOCKOUT, 'Knockout'),
+    )
+
+    name = models.CharField(max_length=30, unique=True)
+    format = models.CharField(max_length=20, choices=FORMAT_CHOICES, default=ROUND_ROBIN)
+    strategy = models.CharField(max_length=20, default='random')
+    players = models.ManyToManyField(Player)
+    maximum_x = models.IntegerField(default=15)
+    maximum_y = models.IntegerField(default=15)
+    ships_per_person = models.IntegerField(default=3)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+    def schedule(self):
+        """Create the next games to be played, if any
+
+        returns a list of the new Games, empty if the tournament is over or the current round is unfinished
+        """
+
+        if self.format == Tournament.ROUND_ROBIN:
+            if self.game_set.all().exists():
+                # Everything was scheduled at the start
+                return []
+            players = list(self.players.all().order_by('name'))
+            rounds = self._get_round_robin_pairings(players)
+        else:
+            entrants = self._get_knockout_entrants()
+            if not entrants:
+                # The current round is still in play
+                return []
+            (round_number, players) = entrants
+            if len(players) < 2:
+                # We have a champion
+                return []
+            rounds = [[]] * round_number + [self._get_knockout_pairings(players)]
+
+        return self._create_games(rounds)
+
+
+    def _get_knockout_entrants(self):
+        """Work out who goes through to the next round of a knockout
+
+        returns a tuple (round_number, players) of the last round played and a list of the Players left in,
+        or None if the last round is still in play
+        """
+
+        games = list(self.game_set.all().select_related('winner').order_by('tournament_round', 'name'))
+        in_round = dict()
+        for (round_number, player_id) in GamePlayer.objects.all().filter(game__tournament=self)\
+                .values_list('game__tournament_round', 'player_id'):
+            in_round.setdefault(round_number, set()).add(player_id)
+
+        # Follow everyone through from the start
+        players = list(self.players.all().order_by('name'))
+        round_number = 0
+        while round_number + 1 in in_round:
+            round_number += 1
+            round_games = [game for game in games if game.tournament_round == round_number]
+            if any(not game.winner_id for game in round_games):
+                return None
+            # Anyone given a bye goes through too
+            byes = [player for player in players if player.id not in in_round[round_number]]
+            players = [game.winner for game in round_games] + byes
+
+        return (round_number, players)
+
+
+    @staticmethod
+    def _get_round_robin_pairings(players):
+        """Pair up every player with every other, by the circle method
+
+        players     a list of Players
+
+        returns a list of rounds, each a list of tuples of two players, with no player twice in a round
+        """
+
+        players = list(players)
+        if len(players) % 2:
+            # The player paired with None sits the round out
+            players.append(None)
+
+        rounds = []
+        for round_number in range(len(players) - 1):
+            pairs = [(players[i], players[-1 - i]) for i in range(len(players) // 2)]
+            rounds.append([pair for pair in pairs if None not in pair])
+            # Keep the first player still, and rotate the rest
+            players = [players[0], players[-1]] + players[1:-1]
+
+        return rounds
+
+
+    @staticmethod
+    def _get_knockout_pairings(players):
+        """Pair up players for a knockout round, in order, an odd player out gets a bye
+
+        returns a list of tuples of two players
+        """
+
+        return [(players[i], players[i + 1]) for i in range(0, len(players) - 1, 2)]
+
+
+    def _create_games(self, rounds):
+        """Create the games for a list of rounds of pairings, all in a few queries
+
+        rounds  a list of rounds, each a list of tuples of two Players, earlier rounds may be empty
+
+        returns the list of new Games
+        """
+
+        games = []
+        pairings = []
+        for (round_number, pairs) in enumerate(rounds, 1):
+            for (number, pair) in enumerate(pairs, 1):
+                games.append(Game(name=f"{self.name}_{round_number}_{number}", maximum_x=self.maximum_x,
+                                  maximum_y=self.maximum_y, ships_per_person=self.ships_per_person,
+                                  tournament=self, tournament_round=round_number))
+                pairings.append(pair)
+
+        with transaction.atomic():
+            Game.objects.bulk_create(games)
+            # Bulk inserts skip the signals that add GamePlayer rows, so add those too
+            Game.players.through.objects.bulk_create(
+                [Game.players.through(game_id=game.id, player_id=player.id)
+                 for (game, pair) in zip(games, pairings) for player in pair])
+            GamePlayer.objects.bulk_create(
+                [GamePlayer(game=game, player=player) for (game, pair) in zip(games, pairings) for player in pair])
+            # And each game gets a secret, just as one registered through the API does
+            GameSecret.objects.bulk_create([GameSecret(game=game, secret=Game.make_secret()) for game in games])
+
+        return games
+
+
+    def play_game(self, game):
+        """Play a single game to completion with bots, using the normal game rules
+
+        game    a Game in this tournament, which must not yet have been started
+
+        returns the number of strikes made
+        """
+
+        game.start_game()
+        game_players = list(GamePlayer.objects.all().filter(game=game).select_related('player')
+                            .order_by('player__name'))
+
+        # Give each player a bot, which knows where its own ships are
+        bots = dict()
+        for game_player in game_players:
+            own_cells = [location for ship in game.ship_set.all().filter(player=game_player.player)
+                         for location in ship.get_locations_as_tuples()]
+            bots[game_player.player] = BOTS[self.strategy](game.maximum_x, game.maximum_y, own_cells)
+
+        # Take turns until someone wins, or nobody has anything left to try
+        strikes = 0
+        while not game.winner_id:
+            struck = False
+            for player, bot in bots.items():
+                location = bot.next_strike()
+                if location is None:
+                    continue
+                action = game.strike(player, location)
+                strikes += 1
+                struck = True
+                for other_bot in bots.values():
+                    other_bot.record(location, action.result)
+                if game.winner_id:
+                    break
+
+            if not struck:
+                break
+
+        return strikes
+
+
+    def get_standings(self):
+        """Return a list of dicts for each player, with their "player" name, games "played" and "won"
+
+        Only finished games are counted. The list is sorted with the most wins first.
+        """
+
+        finished = self.game_set.all().filter(winner__isnull=False)
+        played = Counter(GamePlayer.objects.all().filter(game__in=finished).values_list('player__name', flat=True))
+        won = Counter(finished.values_list('winner__name', flat=True))
+
+        standings = [{"player": name, "played": played[name], "won": won[name]}
+                     for name in self.players.all().order_by('name').values_list('name', flat=True)]
+        return sorted(standings, key=lambda standing: (-standing["won"], standing["played"]))
+
+
+    def get_champion(self):
+        """Return the name of the winning player once every game is over, or None otherwise
+
+        In a round robin, players level on wins are split by name.
+        """
+
+        if self.format == Tournament.KNOCKOUT:
+            entrants = self._get_knockout_entrants()
+            if entrants and entrants[0] and len(entrants[1]) == 1:
+                return entrants[1][0].name
+            return None
+
+        games = self.game_set.all()
+        if not games.exists() or games.filter(winner__isnull=True).exists():
+            return None
+
+        standings = self.get_standings()
+        return sorted(standings, key=lambda standing: (-standing["won"], standing["player"]))[0]["player"]
 
 
 class PlayerSecret(models.Model):
@@ -642,3 +1535,117 @@ class GameSecret(models.Model):
 
     def __str__(self):
         return f"game: {self.game.name}, secret: {self.secret}"
+
+
+@receiver(m2m_changed, sender=Game.players.through)
+def update_game_players(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep the GamePlayer rows in step with the players in each game
+
+    This works from either end of the relationship, so game.players.add(player) and
+    player.game_set.add(game) are both covered.
+    """
+
+    if action == 'post_add':
+        if reverse:
+            game_players = [GamePlayer(game_id=pk, player=instance) for pk in pk_set]
+        else:
+            game_players = [GamePlayer(game=instance, player_id=pk) for pk in pk_set]
+        GamePlayer.objects.bulk_create(game_players, ignore_conflicts=True)
+        if reverse:
+            _update_versions(pk_set)
+        else:
+            # Keep any game state already loaded in step
+            state = getattr(instance, '_game_state', None)
+            if state is not None:
+                for pk in pk_set:
+                    state.add_player(pk)
+
+            version = instance.version
+            if instance.claim_version():
+                # Nothing else changed the game in between, so the new players can be written through
+                gamecache.update(instance, version, lambda entry: {
+                    "moves": {**{pk: 0 for pk in pk_set}, **entry["moves"]},
+                    "ships": entry["ships"],
+                })
+            else:
+                # The version held here was behind, so no entry can be trusted to patch
+                instance.update_version()
+                gamecache.delete(instance)
+
+    elif action == 'post_remove':
+        if reverse:
+            GamePlayer.objects.all().filter(player=instance, game_id__in=pk_set).delete()
+            _update_versions(pk_set)
+        else:
+            GamePlayer.objects.all().filter(game=instance, player_id__in=pk_set).delete()
+            instance.update_winner()
+            instance.update_version()
+
+    elif action == 'post_clear':
+        if reverse:
+            game_players = GamePlayer.objects.all().filter(player=instance)
+            game_ids = list(game_players.values_list('game_id', flat=True))
+            game_players.delete()
+            _update_versions(game_ids)
+        else:
+            GamePlayer.objects.all().filter(game=instance).delete()
+            instance.update_winner()
+            instance.update_version()
+
+
+def _update_versions(game_ids):
+    """Raise the version of several games at once, by id, see Game.update_version()"""
+
+    Game.objects.all().filter(pk__in=game_ids).update(version=F('version') + 1, modified=timezone.now())
+
+
+def _update_ships_remaining(ship, change):
+    """Adjust the ships remaining for the owner of a ship, and so any winner of the game
+
+    ship    the Ship that has been created or deleted
+    change  the change in the number of ships, +1 or -1
+    """
+
+    GamePlayer.objects.all().filter(game_id=ship.game_id, player_id=ship.player_id)\
+        .update(ships_remaining=F('ships_remaining') + change)
+
+    # Use the Game we already have if possible, so that its winner stays current
+    if Ship.game.is_cached(ship):
+        game = ship.game
+    else:
+        game = Game(pk=ship.game_id)
+    game.update_winner()
+    game.update_version()
+
+
+@receiver(pre_delete, sender=Player)
+def player_deleting(sender, instance, **kwargs):
+    """Raise the version of each game the player is in, as deleting them also deletes their moves and actions
+
+    This has to happen before the delete, while the GamePlayer rows still say which games those are.
+    """
+
+    _update_versions(list(GamePlayer.objects.all().filter(player=instance).values_list('game_id', flat=True)))
+
+
+@receiver(post_delete, sender=Game)
+def game_deleted(sender, instance, **kwargs):
+    """Remove any archive file, and anything in the game cache, along with the game"""
+
+    archive.remove(instance.get_archive_path())
+    gamecache.delete(instance)
+
+
+@receiver(post_save, sender=Ship)
+def ship_created(sender, instance, created, **kwargs):
+    """Count newly created ships"""
+
+    if created:
+        _update_ships_remaining(instance, 1)
+
+
+@receiver(post_delete, sender=Ship)
+def ship_deleted(sender, instance, **kwargs):
+    """Count ships that are sunk, or otherwise deleted"""
+
+    _update_ships_remaining(instance, -1)
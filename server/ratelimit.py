@@ -0,0 +1,254 @@
+# Battleships ratelimit.py
+#
+# Token bucket rate limiting for the API, see RateLimitMiddleware. Each client has a bucket holding up to
+# "burst" tokens, which refills at "rate" tokens a second, and every request takes a token. A client with an
+# empty bucket is turned away until a token has come back, so short bursts are allowed but a runaway loop
+# is held to the rate.
+#
+# The buckets are kept in a store. LocalStore keeps them in the memory of each process, which costs almost
+# nothing, but with several worker processes each allows the full rate. CacheStore keeps them in a Django
+# cache, so all the workers share them if the cache is shared (for instance memcached, redis, or the
+# database cache backend).
+
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import JsonResponse
+from django.utils.module_loading import import_string
+
+
+def refill(bucket, rate, burst, now, count=1):
+    """Take tokens from a bucket if there are enough, returning the new bucket and the wait for them
+
+    bucket  a tuple (tokens, updated) of the tokens left and the time they were counted, or None if full
+    rate    the tokens added each second
+    burst   the most tokens the bucket can hold
+    now     the current time, in seconds
+    count   the number of tokens to take, all or none, or a negative number to give tokens back
+
+    returns a tuple (bucket, wait), where wait is 0 if the tokens were taken, or the seconds until they can be
+    """
+
+    if bucket is None:
+        tokens = burst
+    else:
+        (tokens, updated) = bucket
+        tokens = min(burst, tokens + (now - updated) * rate)
+
+    if tokens >= count:
+        return ((min(burst, tokens - count), now), 0)
+    return ((tokens, now), (count - tokens) / rate)
+
+
+class LocalStore:
+    """Buckets kept in a dict in this process, in the order they were last used
+
+    Each take looks at the least recently used buckets, and forgets those that would have refilled
+    completely, stopping at the first that would not, so this costs little more than the take itself. If
+    there are still more than max_keys buckets, the least recently used are forgotten anyway, so memory is
+    bounded, though a client not seen for a while may then find its bucket full again a little early.
+    """
+
+    max_keys = 10000
+
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, count=1):
+        """Take tokens for a client, returning 0 if there were enough, or the seconds to wait for them
+
+        key     a text key for the client
+        rate    the tokens added each second
+        burst   the most tokens the bucket can hold
+        count   the number of tokens to take, see refill()
+        """
+
+        now = time.monotonic()
+        with self.lock:
+            (bucket, full_at) = self.buckets.get(key, (None, now))
+            (bucket, wait) = refill(bucket, rate, burst, now, count)
+            (tokens, updated) = bucket
+            self.buckets[key] = (bucket, now + (burst - tokens) / rate)
+            self.buckets.move_to_end(key)
+            self._forget_old(now)
+        return wait
+
+    async def atake(self, key, rate, burst, count=1):
+        """An async version of take(), which never waits on anything, so is just the same"""
+
+        return self.take(key, rate, burst, count)
+
+    def clear(self):
+        """Forget all the buckets"""
+
+        with self.lock:
+            self.buckets.clear()
+
+    def _forget_old(self, now):
+        while self.buckets:
+            (bucket, full_at) = next(iter(self.buckets.values()))
+            if full_at > now and len(self.buckets) <= self.max_keys:
+                break
+            self.buckets.popitem(last=False)
+
+
+class CacheStore:
+    """Buckets kept in the Django cache named by BATTLESHIPS_RATE_LIMIT_CACHE, shared by all workers using it
+
+    Each bucket is read and written back without a lock, so two workers taking from the same bucket at the
+    same moment may both succeed. That lets through a little more than the rate under heavy contention,
+    which is good enough to stop a runaway client. Buckets expire from the cache once they would be full.
+    """
+
+    def __init__(self):
+        self.cache = caches[settings.BATTLESHIPS_RATE_LIMIT_CACHE]
+
+    @staticmethod
+    def get_cache_key(key):
+        """Return the cache key for a client key, which may hold any text"""
+
+        return "battleships:ratelimit:" + hashlib.md5(key.encode()).hexdigest()
+
+    def take(self, key, rate, burst, count=1):
+        """Take tokens for a client, see LocalStore.take()"""
+
+        cache_key = self.get_cache_key(key)
+        now = time.time()
+        (bucket, wait) = refill(self.cache.get(cache_key), rate, burst, now, count)
+        (tokens, updated) = bucket
+        self.cache.set(cache_key, bucket, math.ceil((burst - tokens) / rate) + 1)
+        return wait
+
+    async def atake(self, key, rate, burst, count=1):
+        """An async version of take(), run in a thread as cache backends may block"""
+
+        return await sync_to_async(self.take)(key, rate, burst, count)
+
+    def clear(self):
+        """Forget all the buckets, by clearing the whole cache, so it is best used with a cache of its own"""
+
+        self.cache.clear()
+
+
+# The store in use, made when first needed, see get_store()
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the store named by BATTLESHIPS_RATE_LIMIT_STORE, shared by all requests in this process"""
+
+    global _store
+    store = _store
+    if store is None:
+        with _store_lock:
+            if _store is None:
+                _store = import_string(settings.BATTLESHIPS_RATE_LIMIT_STORE)()
+            store = _store
+    return store
+
+
+@receiver(setting_changed)
+def store_setting_changed(setting, **kwargs):
+    """Make a new store next time one is needed if the settings for it change, as they do in tests"""
+
+    global _store
+    if setting in ('BATTLESHIPS_RATE_LIMIT_STORE', 'BATTLESHIPS_RATE_LIMIT_CACHE', 'CACHES'):
+        with _store_lock:
+            _store = None
+
+
+def get_client_keys(request, view_kwargs):
+    """Return a list of tuples (key, rate, burst, count) for each bucket a request should take tokens from
+
+    request         the request
+    view_kwargs     the arguments taken from the URL for the view, which may name a player
+
+    Every request is counted against the client's IP address, and requests that name a player are also
+    counted against that player by name alone, whatever secret is given, so a client cannot get a fresh
+    bucket by sending a different wrong secret each time. Limits in BATTLESHIPS_RATE_LIMITS set to None are
+    not applied.
+    """
+
+    limits = settings.BATTLESHIPS_RATE_LIMITS
+    keys = []
+    if limits.get('ip'):
+        keys.append((f"ip:{request.META.get('REMOTE_ADDR')}", limits['ip']['rate'], limits['ip']['burst'], 1))
+    player_name = view_kwargs.get('player_name')
+    if player_name and limits.get('player'):
+        keys.append((f"player:{player_name}", limits['player']['rate'], limits['player']['burst'], 1))
+    return keys
+
+
+def get_batch_keys(request, operations_kwargs):
+    """Return a list of tuples (key, rate, burst, count) for a batch of calls, counting a token for each call
+
+    request             the request
+    operations_kwargs   a list of the arguments for each call, as view_kwargs for get_client_keys()
+
+    Calls for the same client share a tuple, with the count summed, so the batch takes all its tokens at once.
+    """
+
+    counts = {}
+    for view_kwargs in operations_kwargs:
+        for (key, rate, burst, count) in get_client_keys(request, view_kwargs):
+            if key in counts:
+                counts[key] = (key, rate, burst, counts[key][3] + count)
+            else:
+                counts[key] = (key, rate, burst, count)
+    return list(counts.values())
+
+
+def take(keys):
+    """Take tokens from each of a list of buckets, as from get_client_keys(), all or none
+
+    returns 0 if there were tokens in all of them, or the seconds to wait for them otherwise
+
+    If any bucket is short, the tokens already taken from the others are given back, so a client that is
+    turned away by one limit does not use up another.
+    """
+
+    store = get_store()
+    taken = []
+    for (key, rate, burst, count) in keys:
+        wait = store.take(key, rate, burst, count)
+        if wait:
+            for (key, rate, burst, count) in taken:
+                store.take(key, rate, burst, -count)
+            return wait
+        taken.append((key, rate, burst, count))
+    return 0
+
+
+async def atake(keys):
+    """An async version of take()"""
+
+    store = get_store()
+    taken = []
+    for (key, rate, burst, count) in keys:
+        wait = await store.atake(key, rate, burst, count)
+        if wait:
+            for (key, rate, burst, count) in taken:
+                await store.atake(key, rate, burst, -count)
+            return wait
+        taken.append((key, rate, burst, count))
+    return 0
+
+
+def get_too_many_requests(wait):
+    """Return a 429 response for a client that must wait a number of seconds, with a Retry-After header"""
+
+    retry_after = math.ceil(wait)
+    response = JsonResponse(f"Too many requests, retry after {retry_after} seconds", safe=False, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
@@ -0,0 +1,62 @@
+# Battleships replay.py
+#
+# The state of a game can be rebuilt from its event log (see GameEvent), starting either from nothing
+# or from a snapshot (see GameSnapshot). States are plain dicts so they can be stored as JSON:
+#
+# sequence  the number of the last event applied
+# ships     the ships afloat, a dict keyed by ship id (as a string) of dicts with the player name, ship
+#           name, x, y, orientation and length
+# moves     the number of strikes made by each player, keyed by player name
+# hits      the number of those strikes that sank a ship, keyed by player name
+# winner    the name of the winner, or None
+#
+# The list of strikes is not part of the state, as it grows with every move and would be copied into every
+# snapshot. Game.get_state() reads it from the strike events instead, see get_strike().
+
+def initial_state():
+    """Return the state of a game before anything has happened"""
+
+    return {
+        "sequence": 0,
+        "ships": {},
+        "moves": {},
+        "hits": {},
+        "winner": None,
+    }
+
+
+def apply_event(state, sequence, kind, data):
+    """Update a state with a single event, in place
+
+    state       the state dict to update
+    sequence    the number of the event in the game
+    kind        the kind of event, one of "ship_placed", "strike", "sink" or "game_over"
+    data        the dict of data stored with the event
+    """
+
+    if kind == 'ship_placed':
+        state["ships"][str(data["ship_id"])] = {
+            "name": data["name"],
+            "player": data["player"],
+            "x": data["x"],
+            "y": data["y"],
+            "orientation": data["orientation"],
+            "length": data["length"],
+        }
+    elif kind == 'strike':
+        state["moves"][data["player"]] = state["moves"].get(data["player"], 0) + 1
+        if data["result"].startswith("hit"):
+            state["hits"][data["player"]] = state["hits"].get(data["player"], 0) + 1
+    elif kind == 'sink':
+        state["ships"].pop(str(data["ship_id"]), None)
+    elif kind == 'game_over':
+        state["winner"] = data["winner"]
+
+    state["sequence"] = sequence
+
+
+def get_strike(data):
+    """Return a strike as a list [x, y, player name, result], from the data of its "strike" event"""
+
+    (x, y) = data["location"]
+    return [x, y, data["player"], data["result"]]
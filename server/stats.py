@@ -0,0 +1,121 @@
+# Battleships stats.py
+#
+# Cheap, in-process collection of the time and database queries used by each view. The figures are kept
+# per process, so with several workers each will report on its own share of the requests.
+
+import math
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+
+def percentile(values, percent):
+    """Return a percentile of a sorted list of values, by the nearest rank method"""
+
+    if not values:
+        return 0
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+class QueryCounter:
+    """A database execute wrapper that counts queries and the time spent in them
+
+    Use it with connection.execute_wrapper(), it does not record the SQL, so it is cheap enough to leave on.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - start
+
+
+class ViewStats:
+    """Running totals for a single view, with a ring buffer of recent request times for percentiles"""
+
+    def __init__(self, samples):
+        self.requests = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.counted = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.recent = deque(maxlen=samples)
+
+    def record(self, elapsed, queries, db_time):
+        self.requests += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        if queries is not None:
+            self.counted += 1
+            self.queries += queries
+            self.db_time += db_time
+        self.recent.append(elapsed)
+
+    def as_dict(self):
+        """A summary of the view, with times in milliseconds"""
+
+        recent = sorted(self.recent)
+
+        return {
+            "requests": self.requests,
+            "total_ms": self.total_time * 1000,
+            "mean_ms": self.total_time * 1000 / self.requests,
+            "p50_ms": percentile(recent, 50) * 1000,
+            "p95_ms": percentile(recent, 95) * 1000,
+            "p99_ms": percentile(recent, 99) * 1000,
+            "max_ms": self.max_time * 1000,
+            "mean_queries": self.queries / self.counted if self.counted else None,
+            "mean_db_ms": self.db_time * 1000 / self.counted if self.counted else None,
+        }
+
+
+# The stats for each view, keyed by view name, and a lock to protect them
+_views = dict()
+_lock = threading.Lock()
+
+
+def record(view_name, elapsed, queries, db_time):
+    """Record a single request
+
+    view_name   the name of the view that handled the request
+    elapsed     the wall time for the request in seconds
+    queries     the number of database queries made, or None if they could not be counted
+    db_time     the time spent in the database in seconds, or None as above
+    """
+
+    with _lock:
+        view_stats = _views.get(view_name)
+        if view_stats is None:
+            view_stats = ViewStats(settings.BATTLESHIPS_STATS_SAMPLES)
+            _views[view_name] = view_stats
+        view_stats.record(elapsed, queries, db_time)
+
+
+def summarise():
+    """Return a list of dicts summarising each view, the most expensive in total first"""
+
+    with _lock:
+        summary = []
+        for view_name, view_stats in _views.items():
+            view_dict = {"view": view_name}
+            view_dict.update(view_stats.as_dict())
+            summary.append(view_dict)
+
+    return sorted(summary, key=lambda view_dict: view_dict["total_ms"], reverse=True)
+
+
+def reset():
+    """Forget everything recorded so far"""
+
+    with _lock:
+        _views.clear()
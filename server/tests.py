@@ -1,14 +1,49 @@
-from django.core.exceptions import PermissionDenied
+import asyncio
+import gzip
+import importlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
 
+from django.core.exceptions import PermissionDenied
 
-from django.test import TestCase
-from django.test.client import Client
 
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.client import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import engine
+from . import events
+from . import gamecache
+from . import ratelimit
+from . import stats
+from . import replay
+from .bots import BOTS
 from .models import Action
 from .models import Game
-from .models import Location
+from .models import GameEvent
+from .models import GamePlayer
+from .models import GameSnapshot
 from .models import Player
 from .models import Ship
+from .models import Tournament
+from .views import load_game_player
 
 
 class GameInformationTestCase(TestCase):
@@ -36,6 +71,47 @@ class GameInformationTestCase(TestCase):
         game._create_ship_check('diagonal', p3, (3, 12), 3, name="MistakeNot")
 
 
+    def test_indexes(self):
+        """The player and game indexes should stream names in order, and can be filtered and paged"""
+
+        client = Client()
+        Game.objects.create(name="other_game")
+
+        def get_names(url):
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            return [item["name"] for item in json.loads(b''.join(response.streaming_content))]
+
+        self.assertEqual(["player1", "player2", "player3"], get_names("/api/1.0/players/index/"))
+        self.assertEqual(["other_game", "test_game"], get_names("/api/1.0/games/index/"))
+        self.assertEqual(["player1", "player2"], get_names("/api/1.0/players/index/?prefix=player&limit=2"))
+        self.assertEqual(["player3"], get_names("/api/1.0/players/index/?prefix=player&after=player2"))
+        self.assertEqual([], get_names("/api/1.0/players/index/?prefix=Player"))
+        self.assertEqual(["test_game"], get_names("/api/1.0/games/index/?prefix=t"))
+        self.assertEqual(client.get("/api/1.0/games/index/?limit=x").status_code, 400)
+        self.assertEqual(client.get("/api/1.0/players/index/?limit=-1").status_code, 400)
+        self.assertEqual([{"name": "player2"}], Player.list_players_as_dicts(after="player1", limit=1))
+
+
+    @override_settings(BATTLESHIPS_INDEX_PAGE_SIZE=1)
+    def test_landing_page(self):
+        """The landing page should list games a page at a time, with their players, in two queries"""
+
+        client = Client()
+        Game.objects.create(name="other_game")
+
+        with self.assertNumQueries(2):
+            response = client.get("/")
+        self.assertIn(b"other_game", response.content)
+        self.assertNotIn(b"test_game", response.content)
+        self.assertIn(b"?after=other_game", response.content)
+
+        response = client.get("/?after=other_game")
+        self.assertIn(b"test_game", response.content)
+        self.assertIn(b"player3", response.content)
+        self.assertNotIn(b"More games", response.content)
+
+
     def test_count_locations(self):
         # Test that the ship locations were added, there should be 3
         game = Game.objects.get(name="test_game")
@@ -116,6 +192,34 @@ class GameInformationTestCase(TestCase):
         # TODO: Check response content
 
 
+    def test_winner_maintained_by_strikes(self):
+        """The stored counts and winner should follow ships being sunk"""
+
+        game = Game.objects.get(name="test_game")
+        p1 = Player.objects.get(name="player1")
+        p2 = Player.objects.get(name="player2")
+        p3 = Player.objects.get(name="player3")
+
+        ships_remaining = dict(GamePlayer.objects.all().filter(game=game).values_list('player_id', 'ships_remaining'))
+        self.assertEqual({p1.id: 2, p2.id: 2, p3.id: 2}, ships_remaining)
+
+        # Player 1 sinks everything belonging to players 2 and 3, with the others missing in between
+        for location in [(2,3), (3,1), (3,8), (3,12)]:
+            game.strike(p1, location)
+            game.strike(p2, (15,15))
+            game.strike(p3, (15,15))
+
+        self.assertEqual(p1, game.winner)
+
+        # Reading the winner is now a single query
+        with self.assertNumQueries(1):
+            self.assertEqual(p1, game.get_winner())
+
+        response = Client().get('/api/1.0/games/getwinner/test_game/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b'"player1"', response.content)
+
+
 
 class GameStrikeTestCase(TestCase):
     """Test the mechanisms for ship strikes"""
@@ -139,15 +243,23 @@ class GameStrikeTestCase(TestCase):
 
     def test_count_locations(self):
         # Test that the ship locations were added, there should be 3
-        game = Game.objects.get(name="test_game")
-        locations = Location.objects.all().filter(game=game)
         ship = Ship.objects.get(name="Enterprise")
 
-        # The game should only have three locations stored so far
-        self.assertEqual(3, Location.objects.all().filter(game=game).count())
+        # The ship is stored by its start, orientation and length
+        self.assertEqual((3, 3, 'horizontal', 3), (ship.x, ship.y, ship.orientation, ship.length))
 
         # Make sure the locations belong to the ship
-        self.assertEqual(3, ship.locations.all().count())
+        self.assertEqual([(3,3), (4,3), (5,3)], ship.get_locations_as_tuples())
+        self.assertTrue(ship.check_for_hit((5,3)))
+        self.assertFalse(ship.check_for_hit((6,3)))
+
+
+    def test_ship_cells(self):
+        """Check the cells worked out for each orientation"""
+
+        self.assertEqual([(2,2), (2,3)], Ship.get_cells('vertical', (2,2), 2))
+        self.assertEqual([(2,2), (3,3), (4,4)], Ship.get_cells('diagonal', (2,2), 3))
+        self.assertEqual([], Ship.get_cells('sideways', (2,2), 3))
 
 
     def test_check_for_hit_failure(self):
@@ -166,6 +278,22 @@ class GameStrikeTestCase(TestCase):
         self.assertIsInstance(ship, Ship)
 
 
+    def test_check_for_hit_uses_occupancy(self):
+        # Once the occupancy index is built, hit tests should not touch the database
+        game = Game.objects.get(name="test_game")
+        game.check_for_hit((1,1))
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(game.check_for_hit((2,3)))
+            self.assertIsInstance(game.check_for_hit((5,3)), Ship)
+
+        # Sinking the ship should remove all of its cells from the index
+        p1 = Player.objects.get(name="player1")
+        game.strike(p1, (4,3))
+        self.assertIsNone(game.check_for_hit((3,3)))
+        self.assertIsNone(game.check_for_hit((5,3)))
+
+
     def test_strike_failure_model(self):
         """Test a valid strike"""
 
@@ -190,6 +318,49 @@ class GameStrikeTestCase(TestCase):
         self.assertIn(b"miss", response.content)
 
 
+    def test_load_game_player(self):
+        """The game, player, secret and membership should all come from one query"""
+
+        p1 = Player.objects.get(name="player1")
+        secret = p1.create_secret()
+        Player.objects.create(name="player4")
+
+        with self.assertNumQueries(1):
+            (game, player, game_player) = load_game_player("test_game", "player1")
+            self.assertEqual("test_game", game.name)
+            self.assertEqual(secret, player.get_secret())
+            self.assertEqual(0, game_player.moves)
+
+        (game, player, game_player) = load_game_player("test_game", "player4")
+        self.assertEqual("player4", player.name)
+        self.assertIsNone(player.get_secret())
+        self.assertIsNone(game_player)
+
+        self.assertRaises(Game.DoesNotExist, load_game_player, "no_game", "player1")
+        self.assertRaises(Player.DoesNotExist, load_game_player, "test_game", "no_player")
+
+
+    def test_strike_not_found_client(self):
+        """Strikes for unknown games or players should be reported as such"""
+
+        p1 = Player.objects.get(name="player1")
+        secret = p1.create_secret()
+        client = Client()
+
+        response = client.get(f"/api/1.0/strike/no_game/player1/(1,1)/{secret}/")
+        self.assertEqual(response.status_code, 404)
+
+        response = client.get(f"/api/1.0/strike/test_game/no_player/(1,1)/{secret}/")
+        self.assertEqual(response.status_code, 404)
+
+        # A real player not in the game
+        p4 = Player.objects.create(name="player4")
+        secret = p4.create_secret()
+        response = client.get(f"/api/1.0/strike/test_game/player4/(1,1)/{secret}/")
+        self.assertEqual(response.status_code, 403)
+        self.assertIn(b"NotInGame", response.content)
+
+
     def test_strike_success_model(self):
         """Test a valid strike at the model layer"""
 
@@ -307,6 +478,118 @@ class GameStrikeTestCase(TestCase):
         self.assertEqual(1, Ship.objects.all().filter(game=game).count())
 
 
+    def test_history_since(self):
+        """Check the history can be fetched incrementally, in a single query"""
+
+        game = Game.objects.get(name="test_game")
+        p1 = Player.objects.get(name="player1")
+        p2 = Player.objects.get(name="player2")
+        p3 = Player.objects.get(name="player3")
+
+        game.strike(p1, (1,1))
+        game.strike(p2, (2,1))
+        game.strike(p3, (3,3))
+
+        game = Game.objects.get(name="test_game")
+        with self.assertNumQueries(1):
+            actions = game.list_actions_as_dicts()
+        self.assertEqual(3, len(actions))
+        self.assertEqual((3,3), actions[2]["location"])
+
+        # Only the actions after the cursor should come back
+        actions = game.list_actions_as_dicts(since=actions[0]["id"], limit=1)
+        self.assertEqual(1, len(actions))
+        self.assertEqual("player2", actions[0]["player"])
+
+        client = Client()
+        response = client.get(f"/api/1.0/games/history/test_game/?since={actions[0]['id']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(1, len(response.json()))
+        self.assertIn("hit", response.json()[0]["result"])
+
+        response = client.get("/api/1.0/games/history/test_game/?since=last")
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_move_counts(self):
+        """Check the per player move counters follow the players and their strikes"""
+
+        game = Game.objects.get(name="test_game")
+        p1 = Player.objects.get(name="player1")
+        p2 = Player.objects.get(name="player2")
+        p3 = Player.objects.get(name="player3")
+
+        self.assertEqual({p1.id: 0, p2.id: 0, p3.id: 0}, game.get_move_counts())
+
+        game.strike(p1, (1,1))
+        game.strike(p2, (2,1))
+        self.assertEqual({p1.id: 1, p2.id: 1, p3.id: 0}, game.get_move_counts())
+
+        # Removing a player from the game should remove their counter
+        game.players.remove(p3)
+        self.assertEqual({p1.id: 1, p2.id: 1}, game.get_move_counts())
+        self.assertEqual(2, GamePlayer.objects.all().filter(game=game).count())
+
+
+    def test_player_deleted_mid_game(self):
+        """Deleting a player should let the others carry on, and change the history"""
+
+        game = Game.objects.get(name="test_game")
+        p1 = Player.objects.get(name="player1")
+        p2 = Player.objects.get(name="player2")
+        p3 = Player.objects.get(name="player3")
+        for (player, location) in [(p1, (1,1)), (p2, (2,1)), (p3, (1,2)), (p1, (2,2)), (p2, (1,4))]:
+            game.strike(player, location)
+
+        client = Client()
+        response = client.get("/api/1.0/games/history/test_game/")
+        self.assertEqual(5, len(response.json()))
+        etag = response["ETag"]
+
+        # player3 has no ships, so deleting them removes only their move counter and action
+        p3.delete()
+
+        response = client.get("/api/1.0/games/history/test_game/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(4, len(response.json()))
+
+        # The other players take their turns as if player3 had never played
+        game = Game.objects.get(name="test_game")
+        self.assertEqual({p1.id: 2, p2.id: 2}, game.get_move_counts())
+        self.assertIsInstance(game.strike(p1, (1,5)), Action)
+        self.assertIsInstance(game.strike(p2, (2,5)), Action)
+
+
+    def test_turn_claim_is_atomic(self):
+        """A strike made on a stale game and state must not be able to take a second turn"""
+
+        game = Game.objects.get(name="test_game")
+        p1 = Player.objects.get(name="player1")
+
+        # A concurrent request that loaded the game, and its state, before this strike was made
+        stale_game = Game.objects.get(name="test_game")
+        stale_game.get_game_state()
+        game.strike(p1, (1,1))
+
+        # Have its first look at the game miss the strike, as if it landed just after the version was read,
+        # so only claiming the version can catch it
+        get_current_game_state = Game.get_current_game_state
+        looks = []
+
+        def look(self):
+            state = get_current_game_state(self) if looks else self.get_game_state()
+            looks.append(self.version)
+            return state
+
+        with patch.object(Game, 'get_current_game_state', autospec=True, side_effect=look):
+            self.assertRaises(PermissionDenied, stale_game.strike, player=p1, location=(2,1))
+
+        # The claim failed, so the strike looked again at the new version, and found it was not p1's turn
+        self.assertEqual([game.version - 1, game.version], looks)
+        self.assertEqual(game.version, stale_game.version)
+        self.assertEqual(1, Action.objects.all().filter(game=game, player=p1).count())
+
+
     def test_turn_by_turn_failure_client(self):
         """Check players taking it in turn works correctly"""
 
@@ -421,3 +704,1538 @@ class ShipCreationTestCase(TestCase):
             self.assertEqual(game.ships_per_person, game.number_of_ships(player))
 
 
+
+    def test_start_game(self):
+        """Starting a game should plan the fleet in memory and write it in a handful of queries"""
+
+        game = Game.objects.get(name="test_game")
+
+        with CaptureQueriesContext(connection) as queries:
+            game.start_game()
+        # This should not depend on the number of ships or cells
+        self.assertLessEqual(len(queries), 11)
+
+        for player in game.players.all():
+            self.assertEqual(game.ships_per_person, game.number_of_ships(player))
+
+        # Every ship should have three distinct cells, and no cell should be shared
+        cells = []
+        for ship in Ship.objects.all().filter(game=game):
+            ship_cells = ship.get_locations_as_tuples()
+            self.assertEqual(3, len(ship_cells))
+            cells.extend(ship_cells)
+        self.assertEqual(len(cells), len(set(cells)))
+
+        # And ship names should be unique within the game
+        names = Ship.objects.all().filter(game=game).values_list('name', flat=True)
+        self.assertEqual(len(names), len(set(names)))
+
+
+class GameStreamTestCase(TestCase):
+    """Test the streaming of game events"""
+    def setUp(self):
+
+        game = Game.objects.create(name="test_game")
+
+        p1 = Player.objects.create(name="player1")
+        p2 = Player.objects.create(name="player2")
+
+        game.players.add(p1)
+        game.players.add(p2)
+
+        game._create_ship_check('horizontal', p1, (3, 3), 3, name="Enterprise")
+        game._create_ship_check('vertical', p2, (10, 3), 3, name="Defiant")
+
+
+    def read_events(self, response):
+        """Decode a stream into a list of (event, data) tuples"""
+
+        stream = b''.join(response.streaming_content).decode()
+        decoded = []
+        for block in stream.split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+            if "event" in fields:
+                decoded.append((fields["event"], json.loads(fields["data"])))
+        return decoded
+
+
+    def test_stream_to_game_over(self):
+        """A finished game should stream its strikes and then the winner"""
+
+        game = Game.objects.get(name="test_game")
+        p1 = Player.objects.get(name="player1")
+        p2 = Player.objects.get(name="player2")
+
+        game.strike(p1, (1,1))
+        game.strike(p2, (2,1))
+        game.strike(p1, (10,4))
+
+        response = Client().get("/api/1.0/games/stream/test_game/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual("text/event-stream", response["Content-Type"])
+
+        decoded = self.read_events(response)
+        self.assertEqual(["strike", "strike", "strike", "turn", "gameover"], [event for (event, data) in decoded])
+        self.assertEqual({"round": 2}, decoded[3][1])
+        self.assertEqual({"winner": "player1"}, decoded[4][1])
+
+        # Reconnecting should only give the strikes not yet seen
+        response = Client().get("/api/1.0/games/stream/test_game/", HTTP_LAST_EVENT_ID=str(decoded[1][1]["id"]))
+        decoded = self.read_events(response)
+        self.assertEqual(["strike", "turn", "gameover"], [event for (event, data) in decoded])
+
+
+    @override_settings(BATTLESHIPS_STREAM_TIMEOUT=0)
+    def test_stream_timeout(self):
+        """A game in progress should be streamed until the timeout"""
+
+        response = Client().get("/api/1.0/games/stream/test_game/")
+        self.assertEqual([("turn", {"round": 1})], self.read_events(response))
+
+        response = Client().get("/api/1.0/games/stream/no_game/")
+        self.assertEqual(response.status_code, 404)
+
+
+    def test_notify_wakes_waiters(self):
+        """A notification should wake anyone waiting on the same game"""
+
+        watch = events.Watch(1234)
+        timer = threading.Timer(0.05, events.notify, args=[1234])
+        timer.start()
+        self.assertTrue(watch.wait(timeout=5))
+        timer.join()
+
+        # Nothing else has happened, so this should time out
+        watch.reset()
+        self.assertFalse(watch.wait(timeout=0.01))
+
+        # Nothing is kept for a game once nobody is watching it
+        del watch
+        self.assertNotIn(1234, events._channels)
+        events.notify(1234)
+        self.assertNotIn(1234, events._channels)
+
+
+class BatchTestCase(TestCase):
+    """Test running several API calls in one request"""
+
+    def post_batch(self, operations):
+        return Client().post("/api/1.0/batch/", data=json.dumps(operations), content_type="application/json")
+
+
+    def test_batch_game(self):
+        """Set up and start a game, and strike, in a single batch"""
+
+        response = self.post_batch([
+            {"call": "players/register", "args": {"player_name": "player1"}},
+            {"call": "players/register", "args": {"player_name": "player2"}},
+            {"call": "games/register", "args": {"game_name": "test_game"}},
+            {"call": "games/addplayer", "args": {"game_name": "test_game", "player_name": "player1"}},
+            {"call": "games/addplayer", "args": {"game_name": "test_game", "player_name": "player2"}},
+            {"call": "games/start", "args": {"game_name": "test_game"}},
+            {"call": "games/start", "args": {"game_name": "test_game"}},
+            {"call": "games/getwinner", "args": {"game_name": "test_game"}},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual([200, 200, 200, 200, 200, 200, 403, 200], [result["status"] for result in results])
+        self.assertEqual("GameAlreadyStarted", results[6]["response"])
+        self.assertIsNone(results[7]["response"])
+
+        secret = results[0]["response"]
+        response = self.post_batch([
+            {"call": "strike", "args": {"game_name": "test_game", "player_name": "player1", "secret": secret,
+                                        "x": 1, "y": 1}},
+            {"call": "strike", "args": {"game_name": "test_game", "player_name": "player1", "secret": secret,
+                                        "x": 2, "y": 1}},
+            {"call": "games/history", "args": {"game_name": "test_game"}, "query": {"limit": 5}},
+        ])
+        results = response.json()
+        self.assertEqual([200, 403, 200], [result["status"] for result in results])
+        self.assertEqual("NotYourTurn", results[1]["response"])
+        self.assertEqual(1, len(results[2]["response"]))
+        self.assertEqual(1, Action.objects.all().count())
+
+
+    def test_batch_failed_query(self):
+        """A call whose query fails in the database should not spoil the calls after it"""
+
+        response = self.post_batch([
+            {"call": "players/register", "args": {"player_name": "player1"}},
+            {"call": "players/register", "args": {"player_name": "player1"}},
+            {"call": "players/register", "args": {"player_name": "player2"}},
+            {"call": "games/index"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([200, 403, 200, 200], [result["status"] for result in response.json()])
+        self.assertEqual(["player1", "player2"], list(Player.objects.order_by('name').values_list('name', flat=True)))
+
+
+    def test_batch_errors(self):
+        """Malformed batches and operations should be rejected"""
+
+        response = self.post_batch({"call": "games/index"})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.post_batch([
+            {"call": "games/nothing"},
+            {"call": "games/history", "args": {"game": "test_game"}},
+            {"call": "games/index"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([400, 400, 200], [result["status"] for result in response.json()])
+
+        response = Client().get("/api/1.0/batch/")
+        self.assertEqual(response.status_code, 405)
+
+
+class BenchmarkTestCase(TestCase):
+    """Test the benchmark command and the bots it uses"""
+
+    def test_bots(self):
+        """Bots should strike every square except their own, once"""
+
+        for bot_class in BOTS.values():
+            bot = bot_class(3, 3, own_cells=[(1,1), (2,2)])
+            bot.record((3,3), "miss:")
+            targets = []
+            while True:
+                location = bot.next_strike()
+                if location is None:
+                    break
+                targets.append(location)
+            self.assertEqual([(1,2), (1,3), (2,1), (2,3), (3,1), (3,2)], sorted(targets))
+
+            # On a huge board the bots should start striking without listing every square first
+            bot = bot_class(10000, 10000)
+            self.assertEqual(100, len({bot.next_strike() for attempt in range(100)}))
+
+
+    def test_benchmark(self):
+        """Play a small game, and check it is reported and tidied up"""
+
+        output = StringIO()
+        call_command('benchmark', games=1, players=2, size=6, stdout=output)
+
+        self.assertIn("api_strike", output.getvalue())
+        self.assertIn("api_games_getwinner", output.getvalue())
+        self.assertEqual(0, Game.objects.all().count())
+        self.assertEqual(0, Player.objects.all().count())
+
+
+    def test_benchmark_asgi(self):
+        """The benchmark should also run several games at once through the async views"""
+
+        output = StringIO()
+        call_command('benchmark', games=2, players=2, size=6, stack='asgi', stdout=output)
+
+        self.assertIn("over ASGI", output.getvalue())
+        self.assertIn("api_strike", output.getvalue())
+        self.assertEqual(0, Game.objects.all().count())
+
+
+@override_settings(ROOT_URLCONF='Battleships.asgi_urls')
+class AsyncViewsTestCase(TestCase):
+    """Test the async versions of the busiest API views give the same responses as the sync ones"""
+    def setUp(self):
+
+        game = Game.objects.create(name="test_game")
+
+        p1 = Player.objects.create(name="player1")
+        p2 = Player.objects.create(name="player2")
+        self.secrets = {"player1": p1.create_secret(), "player2": p2.create_secret()}
+
+        game.players.add(p1)
+        game.players.add(p2)
+
+        game._create_ship_check('horizontal', p1, (3, 3), 3, name="Enterprise")
+        game._create_ship_check('vertical', p2, (10, 3), 3, name="Defiant")
+
+
+    async def test_async_views(self):
+        """Play a short game through the async views"""
+
+        client = AsyncClient()
+        secret1 = self.secrets["player1"]
+        secret2 = self.secrets["player2"]
+
+        response = await client.get(f"/api/1.0/games/getships/test_game/player1/{secret1}/")
+        self.assertEqual([{"name": "Enterprise", "locations": [[3,3], [4,3], [5,3]]}], response.json())
+        response = await client.get(f"/api/1.0/games/getships/test_game/player1/{secret2}/")
+        self.assertEqual(response.status_code, 403)
+
+        response = await client.get(f"/api/1.0/strike/test_game/player1/(1,1)/{secret1}/")
+        self.assertEqual("miss:", response.json())
+        response = await client.get(f"/api/1.0/strike/test_game/player1/(1,2)/{secret1}/")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual("NotYourTurn", response.json())
+        response = await client.get(f"/api/1.0/strike/test_game/player2/(2,1)/{secret2}/")
+        self.assertEqual(response.status_code, 200)
+
+        response = await client.get("/api/1.0/games/getwinner/test_game/")
+        self.assertIsNone(response.json())
+        response = await client.get(f"/api/1.0/strike/test_game/player1/(10,4)/{secret1}/")
+        self.assertEqual("hit: ship Defiant belonging to player2 was sunk.", response.json())
+        response = await client.get("/api/1.0/games/getwinner/test_game/")
+        self.assertEqual("player1", response.json())
+
+        response = await client.get("/api/1.0/games/history/test_game/?since=0&limit=2")
+        self.assertEqual([[1,1], [2,1]], [action["location"] for action in response.json()])
+        response = await client.get("/api/1.0/games/history/test_game/?limit=x")
+        self.assertEqual(response.status_code, 400)
+
+
+    async def test_async_views_not_found(self):
+        """Missing games and players should give the same 404s as the sync views"""
+
+        client = AsyncClient()
+        for url in ["/api/1.0/games/history/no_game/",
+                    "/api/1.0/games/getwinner/no_game/",
+                    "/api/1.0/games/getships/no_game/player1/secret/",
+                    "/api/1.0/games/getships/test_game/no_player/secret/",
+                    "/api/1.0/strike/no_game/player1/(1,1)/secret/"]:
+            response = await client.get(url)
+            self.assertEqual(response.status_code, 404, url)
+
+
+    @override_settings(BATTLESHIPS_STREAM_TIMEOUT=5, BATTLESHIPS_STREAM_POLL_INTERVAL=5)
+    async def test_stream(self):
+        """Through the ASGI handler, each event should reach the client as it happens, not at the timeout"""
+
+        game = await Game.objects.aget(name="test_game")
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+                 "scheme": "http", "path": "/api/1.0/games/stream/test_game/", "raw_path": b"",
+                 "query_string": b"", "root_path": "", "headers": [(b"host", b"testserver")],
+                 "client": ("127.0.0.1", 1234), "server": ("testserver", 80)}
+        requests = asyncio.Queue()
+        await requests.put({"type": "http.request", "body": b"", "more_body": False})
+        bodies = asyncio.Queue()
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                await bodies.put(message.get("body", b"").decode())
+
+        async def read_until(text):
+            received = ""
+            while text not in received:
+                received += await asyncio.wait_for(bodies.get(), timeout=2)
+            return received
+
+        # As the test client does, stop the handler closing the connection that holds the test's transaction
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+        start = time.monotonic()
+        task = asyncio.create_task(ASGIHandler()(scope, requests.get, send))
+        try:
+            self.assertIn("retry: 1000", await read_until("event: turn"))
+            self.assertLess(time.monotonic() - start, 2)
+
+            # A strike wakes the stream straight away, well before the poll interval
+            await sync_to_async(game.strike)(await Player.objects.aget(name="player1"), (1, 1))
+            events.notify(game.id)
+            self.assertIn('"location": [1, 1]', await read_until("event: strike"))
+            self.assertLess(time.monotonic() - start, 4)
+        finally:
+            await requests.put({"type": "http.disconnect"})
+            await asyncio.wait_for(task, timeout=10)
+
+
+    def test_same_as_sync(self):
+        """The sync and async views should give identical history and ships"""
+
+        sync_client = Client()
+        game = Game.objects.get(name="test_game")
+        game.strike(Player.objects.get(name="player1"), (1,1))
+
+        for url in ["/api/1.0/games/history/test_game/",
+                    f"/api/1.0/games/getships/test_game/player2/{self.secrets['player2']}/",
+                    "/api/1.0/games/getwinner/test_game/"]:
+            async_response = async_to_sync(AsyncClient().get)(url)
+            with override_settings(ROOT_URLCONF='Battleships.urls'):
+                sync_response = sync_client.get(url)
+            self.assertEqual(sync_response.json(), async_response.json())
+            self.assertEqual(sync_response["ETag"], async_response["ETag"])
+
+
+class StatsTestCase(TestCase):
+    """Test the per view instrumentation"""
+
+    def setUp(self):
+        stats.reset()
+
+
+    def test_stats(self):
+        """Requests should be recorded by view, and only shown to superusers"""
+
+        client = Client()
+        client.get("/api/1.0/games/register/test_game/")
+        client.get("/api/1.0/games/getwinner/test_game/")
+        client.get("/api/1.0/games/getwinner/test_game/")
+
+        response = client.get("/api/1.0/stats/")
+        self.assertEqual(response.status_code, 403)
+
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        client.login(username="admin", password="password")
+        response = client.get("/api/1.0/stats/?reset=1")
+        self.assertEqual(response.status_code, 200)
+
+        summary = {view_dict["view"]: view_dict for view_dict in response.json()}
+        self.assertEqual(2, summary["api_games_getwinner"]["requests"])
+        self.assertEqual(1, summary["api_games_getwinner"]["mean_queries"])
+        self.assertEqual(1, summary["api_games_register"]["requests"])
+
+        # And the figures should have been reset
+        self.assertEqual(["api_stats"], [view_dict["view"] for view_dict in stats.summarise()])
+
+
+class ArchiveTestCase(TestCase):
+    """Test moving finished games into archive files"""
+    def setUp(self):
+
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+        archive_settings = override_settings(BATTLESHIPS_ARCHIVE_DIR=self.archive_dir.name)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        game = Game.objects.create(name="test_game")
+
+        p1 = Player.objects.create(name="player1")
+        p2 = Player.objects.create(name="player2")
+
+        game.players.add(p1)
+        game.players.add(p2)
+
+        game._create_ship_check('horizontal', p1, (3, 3), 3, name="Enterprise")
+        game._create_ship_check('vertical', p2, (10, 3), 3, name="Defiant")
+
+        game.strike(p1, (1,1))
+        game.strike(p2, (2,1))
+        game.strike(p1, (10,4))
+
+
+    def test_archive_game(self):
+        """Archiving should empty the tables but leave the API working"""
+
+        client = Client()
+        p1 = Player.objects.get(name="player1")
+        secret = p1.create_secret()
+        history = client.get("/api/1.0/games/history/test_game/").json()
+
+        call_command('archive_games', stdout=StringIO())
+
+        game = Game.objects.get(name="test_game")
+        self.assertTrue(game.archived)
+        self.assertTrue(os.path.exists(game.get_archive_path()))
+        self.assertEqual(0, Action.objects.all().count())
+        self.assertEqual(0, Ship.objects.all().count())
+        self.assertEqual(p1, game.get_winner())
+
+        # The history should be the same, streamed from the archive
+        response = client.get("/api/1.0/games/history/test_game/")
+        self.assertEqual(history, json.loads(b''.join(response.streaming_content)))
+        actions = game.list_actions_as_dicts(since=history[0]["id"], limit=1)
+        self.assertEqual([(history[1]["id"], "player2", (2,1))],
+                         [(action["id"], action["player"], action["location"]) for action in actions])
+
+        response = client.get(f"/api/1.0/games/getships/test_game/player1/{secret}/")
+        self.assertEqual([{"name": "Enterprise", "locations": [[3,3], [4,3], [5,3]]}], response.json())
+
+        response = client.get("/api/1.0/games/getwinner/test_game/")
+        self.assertEqual("player1", response.json())
+
+        response = client.get("/api/1.0/games/start/test_game/")
+        self.assertEqual(response.status_code, 403)
+
+        response = client.get(f"/view_game/test_game/player1/{secret}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Enterprise", response.content)
+
+        # The archive itself can be downloaded
+        response = client.get("/api/1.0/games/archive/test_game/")
+        self.assertEqual(response.status_code, 200)
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(["game", "ship"] + ["event"] * 7 + ["action"] * 3, [json.loads(line)["type"] for line in lines])
+
+        # Deleting the game should remove the archive
+        path = game.get_archive_path()
+        game.delete()
+        self.assertFalse(os.path.exists(path))
+
+
+    def test_archive_unfinished_game(self):
+        """Games still in play should not be archived"""
+
+        game = Game.objects.get(name="test_game")
+        game.ship_set.create(name="Voyager", player=game.players.get(name="player2"), x=1, y=5,
+                             orientation="horizontal", length=3)
+        game.refresh_from_db()
+
+        self.assertRaises(PermissionDenied, game.archive)
+        self.assertRaises(CommandError, call_command, 'archive_games', 'test_game', stdout=StringIO())
+
+        response = Client().get("/api/1.0/games/archive/test_game/")
+        self.assertEqual(response.status_code, 404)
+
+
+    @override_settings(BATTLESHIPS_ARCHIVE_ON_GAME_OVER=True)
+    def test_archive_on_game_over(self):
+        """The game can be archived as soon as it is won"""
+
+        game = Game.objects.get(name="test_game")
+        game.ship_set.create(name="Voyager", player=game.players.get(name="player2"), x=1, y=5,
+                             orientation="horizontal", length=3)
+        p1 = Player.objects.get(name="player1")
+        p2 = Player.objects.get(name="player2")
+
+        game = Game.objects.get(name="test_game")
+        game.strike(p2, (1,3))
+        with self.captureOnCommitCallbacks(execute=True):
+            game.strike(p1, (2,5))
+
+        game.refresh_from_db()
+        self.assertTrue(game.archived)
+        self.assertEqual(5, len(game.list_actions_as_dicts()))
+
+
+class ReplayTestCase(TestCase):
+    """Test the event log, snapshots and replaying games"""
+    def setUp(self):
+
+        game = Game.objects.create(name="test_game")
+
+        p1 = Player.objects.create(name="player1")
+        p2 = Player.objects.create(name="player2")
+
+        game.players.add(p1)
+        game.players.add(p2)
+
+        game._create_ship_check('horizontal', p1, (3, 3), 3, name="Enterprise")
+        game._create_ship_check('vertical', p2, (10, 3), 3, name="Defiant")
+
+        game.strike(p1, (1,1))
+        game.strike(p2, (2,1))
+        game.strike(p1, (10,4))
+
+
+    def test_event_log(self):
+        """Placing ships and striking should be logged, in order"""
+
+        game = Game.objects.get(name="test_game")
+        self.assertEqual(['ship_placed', 'ship_placed', 'strike', 'strike', 'strike', 'sink', 'game_over'],
+                         list(game.gameevent_set.order_by('sequence').values_list('kind', flat=True)))
+        self.assertEqual(7, game.count_events())
+
+        state = game.get_state()
+        self.assertEqual(7, state["sequence"])
+        self.assertEqual(["Enterprise"], [ship["name"] for ship in state["ships"].values()])
+        self.assertEqual({"player1": 2, "player2": 1}, state["moves"])
+        self.assertEqual({"player1": 1}, state["hits"])
+        self.assertEqual("player1", state["winner"])
+
+        # Part way through, Defiant is still afloat and nobody has won
+        state = game.get_state(4)
+        self.assertEqual(["Enterprise", "Defiant"], [ship["name"] for ship in state["ships"].values()])
+        self.assertEqual([[1, 1, "player1", "miss:"], [2, 1, "player2", "miss:"]], state["strikes"])
+        self.assertIsNone(state["winner"])
+
+        self.assertEqual(dict(replay.initial_state(), strikes=[]), game.get_state(0))
+
+
+    @override_settings(BATTLESHIPS_SNAPSHOT_INTERVAL=3)
+    def test_snapshots(self):
+        """Snapshots should be taken as the log grows, and replays from them should match full replays"""
+
+        game = Game.objects.create(name="long_game")
+        p1 = Player.objects.get(name="player1")
+        p2 = Player.objects.get(name="player2")
+        game.players.add(p1)
+        game.players.add(p2)
+        game.start_game()
+        for x in range(1, 5):
+            game.strike(p1, (x, 1))
+            game.strike(p2, (x, 2))
+
+        # Starting the game logs six ships at once, so only the last boundary it crosses gets a snapshot
+        snapshots = list(game.gamesnapshot_set.order_by('sequence').values_list('sequence', flat=True))
+        self.assertEqual(list(range(6, game.count_events() + 1, 3)), snapshots)
+
+        for sequence in range(0, game.count_events() + 1):
+            full_replay = dict(replay.initial_state(), strikes=[])
+            for game_event in game.gameevent_set.filter(sequence__lte=sequence):
+                replay.apply_event(full_replay, game_event.sequence, game_event.kind, game_event.data)
+                if game_event.kind == 'strike':
+                    full_replay["strikes"].append(replay.get_strike(game_event.data))
+            self.assertEqual(full_replay, game.get_state(sequence))
+
+        # The snapshots keep only the counts, never the list of strikes
+        for state in game.gamesnapshot_set.values_list('state', flat=True):
+            self.assertNotIn("strikes", state)
+            self.assertEqual(set(["sequence", "ships", "moves", "hits", "winner"]), set(state))
+
+        # Ships placed must match those in the database, less any sunk
+        self.assertEqual(set(game.ship_set.values_list('name', flat=True)),
+                         set(ship["name"] for ship in game.get_state()["ships"].values()))
+
+
+    def test_replay_api(self):
+        """The replay call should only show unfinished games to superusers"""
+
+        client = Client()
+        response = client.get("/api/1.0/games/replay/test_game/2/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(7, response.json()["events"])
+        self.assertEqual(2, len(response.json()["state"]["ships"]))
+
+        response = client.get("/api/1.0/games/replay/no_game/2/")
+        self.assertEqual(response.status_code, 404)
+
+        Game.objects.create(name="unfinished_game")
+        response = client.get("/api/1.0/games/replay/unfinished_game/0/")
+        self.assertEqual(response.status_code, 403)
+
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        client.login(username="admin", password="password")
+        response = client.get("/api/1.0/games/replay/unfinished_game/0/")
+        self.assertEqual(response.status_code, 200)
+
+        # The web view can be scrubbed to an earlier event too
+        response = client.get("/view_game/test_game/?event=4")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Defiant (player2)", response.content)
+        self.assertEqual(2, response.content.count(b"<td>miss:</td>"))
+        response = client.get("/view_game/test_game/")
+        self.assertNotIn(b"Defiant (player2)", response.content)
+        response = client.get("/view_game/test_game/?event=x")
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_backfill_events(self):
+        """Games from before the event log should have their events built from their ships and actions"""
+
+        migration = importlib.import_module('server.migrations.0011_backfill_game_events')
+        game = Game.objects.get(name="test_game")
+        state = game.get_state()
+        game.gameevent_set.all().delete()
+
+        migration.backfill_events(apps, None)
+        self.assertEqual(['ship_placed', 'strike', 'strike', 'strike', 'sink', 'game_over'],
+                         list(game.gameevent_set.order_by('sequence').values_list('kind', flat=True)))
+
+        # Only the ship sunk is missing from the replay, as it was deleted
+        backfilled = game.get_state()
+        for key in ("ships", "moves", "hits", "strikes", "winner"):
+            self.assertEqual(state[key], backfilled[key])
+        self.assertEqual(["Enterprise"], [ship["name"] for ship in game.get_state(1)["ships"].values()])
+
+        # Games that already have events are left alone
+        migration.backfill_events(apps, None)
+        self.assertEqual(6, game.count_events())
+
+
+    def test_replay_archived_game(self):
+        """Archived games should replay from the events in their file"""
+
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        with override_settings(BATTLESHIPS_ARCHIVE_DIR=archive_dir.name):
+            game = Game.objects.get(name="test_game")
+            states = [game.get_state(sequence) for sequence in range(0, 8)]
+            game.archive()
+
+            self.assertEqual(0, GameEvent.objects.all().count())
+            self.assertEqual(0, GameSnapshot.objects.all().count())
+            game = Game.objects.get(name="test_game")
+            self.assertEqual(7, game.count_events())
+            self.assertEqual(states, [game.get_state(sequence) for sequence in range(0, 8)])
+
+
+class ViewGameTestCase(TestCase):
+    """Test the game view is cached by version, and answers repeat requests with 304"""
+    def setUp(self):
+
+        game = Game.objects.create(name="test_game", ships_per_person=5)
+
+        p1 = Player.objects.create(name="player1")
+        p2 = Player.objects.create(name="player2")
+
+        game.players.add(p1)
+        game.players.add(p2)
+        game.start_game()
+
+        game.strike(p1, (1,1))
+        game.strike(p2, (2,1))
+
+
+    def test_version(self):
+        """Changes to a game's players, ships or actions should raise its version, and saving should not undo that"""
+
+        game = Game.objects.get(name="test_game")
+        p3 = Player.objects.create(name="player3")
+
+        version = game.version
+        game.players.add(p3)
+        self.assertEqual(version + 1, Game.objects.get(name="test_game").version)
+
+        # A stale copy saved afterwards should keep the new version
+        stale_game = Game.objects.get(name="test_game")
+        game.strike(p3, (3,1))
+        stale_game.save()
+        self.assertLess(version + 1, Game.objects.get(name="test_game").version)
+
+
+    def test_view_game(self):
+        """The page should be built in a few queries, then come from the cache until the game changes"""
+
+        p1 = Player.objects.get(name="player1")
+        secret = p1.create_secret()
+        url = f"/view_game/test_game/player1/{secret}/"
+        client = Client()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), 5)
+        etag = response["ETag"]
+        self.assertIn(b"(2, 1)", response.content)
+
+        # Just the game and the player are needed to find the cached page, or to say it hasn't changed
+        with self.assertNumQueries(2):
+            response = client.get(url)
+        self.assertEqual(etag, response["ETag"])
+        self.assertIn(b"(2, 1)", response.content)
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Other players see a different page
+        p2 = Player.objects.get(name="player2")
+        response = client.get(f"/view_game/test_game/player2/{p2.create_secret()}/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(etag, response["ETag"])
+
+        # A strike changes the page
+        Game.objects.get(name="test_game").strike(p1, (3,1))
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(etag, response["ETag"])
+        self.assertIn(b"(3, 1)", response.content)
+
+
+class ConditionalGetTestCase(TestCase):
+    """Test the read only API calls answer unchanged polls with 304 Not Modified"""
+    def setUp(self):
+
+        game = Game.objects.create(name="test_game")
+
+        p1 = Player.objects.create(name="player1")
+        p2 = Player.objects.create(name="player2")
+        self.secret = p1.create_secret()
+
+        game.players.add(p1)
+        game.players.add(p2)
+
+        game._create_ship_check('horizontal', p1, (3, 3), 3, name="Enterprise")
+        game._create_ship_check('vertical', p2, (10, 3), 3, name="Defiant")
+
+
+    def test_game_calls(self):
+        """History, ships and winner should be sent again only once the game changes"""
+
+        client = Client()
+        urls = ["/api/1.0/games/history/test_game/",
+                "/api/1.0/games/history/test_game/?since=0&limit=1",
+                f"/api/1.0/games/getships/test_game/player1/{self.secret}/",
+                "/api/1.0/games/getwinner/test_game/"]
+        etags = [client.get(url)["ETag"] for url in urls]
+        self.assertEqual(len(urls), len(set(etags)))
+
+        for (url, etag) in zip(urls, etags):
+            # Answered from the game row alone, without touching the ships or actions
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertFalse([query for query in queries
+                              if 'server_ship' in query['sql'] or 'server_action' in query['sql']], url)
+
+        Game.objects.get(name="test_game").strike(Player.objects.get(name="player1"), (1,1))
+        for (url, etag) in zip(urls, etags):
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotEqual(etag, response["ETag"])
+
+        # A wrong secret is never a 304
+        response = client.get("/api/1.0/games/getships/test_game/player1/wrong/", HTTP_IF_NONE_MATCH=etags[2])
+        self.assertEqual(response.status_code, 403)
+
+
+    def test_last_modified(self):
+        """Clients may use If-Modified-Since instead, once the content is more than a second old"""
+
+        client = Client()
+        response = client.get("/api/1.0/games/getwinner/test_game/")
+        self.assertNotIn("Last-Modified", response)
+
+        Game.objects.filter(name="test_game").update(modified=timezone.now() - timedelta(minutes=1))
+        response = client.get("/api/1.0/games/getwinner/test_game/")
+        last_modified = response["Last-Modified"]
+        response = client.get("/api/1.0/games/getwinner/test_game/", HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        Game.objects.get(name="test_game").strike(Player.objects.get(name="player1"), (1,1))
+        response = client.get("/api/1.0/games/getwinner/test_game/", HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+
+    def test_indexes(self):
+        """The indexes should be sent again only once a game or player is added or removed"""
+
+        client = Client()
+        for (url, register, delete) in [("/api/1.0/games/index/", "/api/1.0/games/register/new_game/",
+                                         lambda: Game.objects.get(name="test_game").delete()),
+                                        ("/api/1.0/players/index/", "/api/1.0/players/register/player3/",
+                                         lambda: Player.objects.get(name="player2").delete())]:
+            etag = client.get(url)["ETag"]
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            client.get(register)
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+
+            delete()
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+    def test_batch(self):
+        """Calls made in a batch always run, whatever the headers of the batch request"""
+
+        etag = Client().get("/api/1.0/games/getwinner/test_game/")["ETag"]
+        response = Client().post("/api/1.0/batch/", data=json.dumps([{"call": "games/getwinner",
+                                                                      "args": {"game_name": "test_game"}}]),
+                                 content_type="application/json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual([{"status": 200, "response": None}], response.json())
+
+
+class RateLimitTestCase(TestCase):
+    """Test clients making too many API requests are turned away"""
+    def setUp(self):
+
+        game = Game.objects.create(name="test_game")
+
+        p1 = Player.objects.create(name="player1")
+        p2 = Player.objects.create(name="player2")
+        self.secrets = {"player1": p1.create_secret(), "player2": p2.create_secret()}
+
+        game.players.add(p1)
+        game.players.add(p2)
+
+        ratelimit.get_store().clear()
+        self.addCleanup(ratelimit.get_store().clear)
+
+
+    def test_refill(self):
+        """Buckets should start full, and refill at the rate up to the burst"""
+
+        (bucket, wait) = ratelimit.refill(None, 2, 2, 100.0)
+        self.assertEqual(((1, 100.0), 0), (bucket, wait))
+        (bucket, wait) = ratelimit.refill(bucket, 2, 2, 100.0)
+        self.assertEqual(((0, 100.0), 0), (bucket, wait))
+        (bucket, wait) = ratelimit.refill(bucket, 2, 2, 100.25)
+        self.assertEqual(((0.5, 100.25), 0.25), (bucket, wait))
+        (bucket, wait) = ratelimit.refill(bucket, 2, 2, 110.0)
+        self.assertEqual(((1, 110.0), 0), (bucket, wait))
+
+        # Several tokens are taken all at once or not at all, and can be given back up to the burst
+        self.assertEqual(((1, 110.0), 0.5), ratelimit.refill(bucket, 2, 2, 110.0, 2))
+        self.assertEqual(((2, 110.0), 0), ratelimit.refill(bucket, 2, 2, 110.0, -3))
+
+
+    def test_local_store_pruning(self):
+        """Buckets should be forgotten once they would be full, or once there are too many, without a full scan"""
+
+        store = ratelimit.LocalStore()
+        store.max_keys = 3
+        with patch('server.ratelimit.time.monotonic', return_value=100.0):
+            for key in "abcde":
+                store.take(key, 1, 2)
+            # Nothing is full yet, so the least recently used go
+            self.assertEqual(["c", "d", "e"], list(store.buckets))
+            store.take("c", 1, 2)
+            self.assertEqual(["d", "e", "c"], list(store.buckets))
+
+        with patch('server.ratelimit.time.monotonic', return_value=101.5):
+            # d and e are full again by now, but c has taken two tokens so is not
+            store.take("f", 1, 2)
+            self.assertEqual(["c", "f"], list(store.buckets))
+
+
+    def test_store_setting(self):
+        """The store should be made once, and again only when its setting changes"""
+
+        store = ratelimit.get_store()
+        self.assertIs(store, ratelimit.get_store())
+        with self.settings(BATTLESHIPS_RATE_LIMIT_STORE='server.ratelimit.CacheStore'):
+            self.assertIsInstance(ratelimit.get_store(), ratelimit.CacheStore)
+        self.assertIsInstance(ratelimit.get_store(), ratelimit.LocalStore)
+
+
+    @override_settings(BATTLESHIPS_RATE_LIMITS={'ip': {'rate': 0.1, 'burst': 3}, 'player': None})
+    def test_ip_limit(self):
+        """A client over the limit should get 429 with Retry-After, without touching the database"""
+
+        for store in ['server.ratelimit.LocalStore', 'server.ratelimit.CacheStore']:
+            with self.settings(BATTLESHIPS_RATE_LIMIT_STORE=store):
+                ratelimit.get_store().clear()
+                client = Client()
+                for attempt in range(3):
+                    self.assertEqual(client.get("/api/1.0/games/getwinner/test_game/").status_code, 200, store)
+
+                with self.assertNumQueries(0):
+                    response = client.get("/api/1.0/games/getwinner/test_game/")
+                self.assertEqual(response.status_code, 429, store)
+                self.assertEqual("10", response["Retry-After"])
+
+                # Other addresses, and pages outside the API, are not affected
+                self.assertEqual(client.get("/api/1.0/games/getwinner/test_game/",
+                                            REMOTE_ADDR="10.0.0.1").status_code, 200)
+                self.assertEqual(client.get("/").status_code, 200)
+
+
+    @override_settings(BATTLESHIPS_RATE_LIMITS={'ip': None, 'player': {'rate': 0.1, 'burst': 2}})
+    def test_player_limit(self):
+        """Each player should have their own limit, which wrong secrets count against too"""
+
+        client = Client()
+        url = f"/api/1.0/games/getships/test_game/player1/{self.secrets['player1']}/"
+        self.assertEqual(client.get(url).status_code, 200)
+        self.assertEqual(client.get("/api/1.0/games/getships/test_game/player1/wrong/").status_code, 403)
+        self.assertEqual(client.get("/api/1.0/games/getships/test_game/player1/other/").status_code, 429)
+
+        self.assertEqual(client.get(url).status_code, 429)
+        self.assertEqual(client.get(f"/api/1.0/strike/test_game/player1/(1,1)/{self.secrets['player1']}/")
+                         .status_code, 429)
+
+        url = f"/api/1.0/games/getships/test_game/player2/{self.secrets['player2']}/"
+        self.assertEqual(client.get(url).status_code, 200)
+        self.assertEqual(client.get("/api/1.0/games/index/").status_code, 200)
+
+        response = async_to_sync(AsyncClient().get)(
+            f"/api/1.0/games/getships/test_game/player1/{self.secrets['player1']}/")
+        self.assertEqual(response.status_code, 429)
+
+
+    @override_settings(BATTLESHIPS_RATE_LIMITS={'ip': None, 'player': {'rate': 0.1, 'burst': 2}})
+    def test_batch_limit(self):
+        """Each operation in a batch should count, and a batch over the limit should run none of them"""
+
+        client = Client()
+        strike = {"call": "strike", "args": {"game_name": "test_game", "player_name": "player1",
+                                             "secret": self.secrets["player1"], "x": 1, "y": 1}}
+        getwinner = {"call": "games/getwinner", "args": {"game_name": "test_game"}}
+
+        # More operations for the player than their bucket can ever hold is refused outright
+        response = client.post("/api/1.0/batch/", data=json.dumps([strike, strike, strike, getwinner]),
+                               content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(0, Action.objects.all().count())
+
+        # That took no tokens, so a batch that fits still runs
+        response = client.post("/api/1.0/batch/", data=json.dumps([strike, getwinner, strike]),
+                               content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+        # The tokens taken by that batch are gone, so even one more strike for the player is too many
+        response = client.post("/api/1.0/batch/", data=json.dumps([getwinner, strike]),
+                               content_type="application/json")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual("10", response["Retry-After"])
+
+        # But calls naming nobody are fine
+        response = client.post("/api/1.0/batch/", data=json.dumps([getwinner] * 5), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+
+    @override_settings(BATTLESHIPS_RATE_LIMITS={'ip': {'rate': 0.1, 'burst': 10}, 'player': {'rate': 0.1, 'burst': 2}})
+    def test_batch_all_or_nothing(self):
+        """A batch turned away by one limit should take nothing from the others"""
+
+        client = Client()
+        strike = {"call": "strike", "args": {"game_name": "test_game", "player_name": "player1",
+                                             "secret": self.secrets["player1"], "x": 1, "y": 1}}
+        getwinner = {"call": "games/getwinner", "args": {"game_name": "test_game"}}
+
+        response = client.post("/api/1.0/batch/", data=json.dumps([strike, strike]), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+        # The player has no tokens left, so each of these takes only the token for the batch request itself
+        # from the address, leaving four of the seven it had
+        for attempt in range(3):
+            response = client.post("/api/1.0/batch/", data=json.dumps([getwinner, strike]),
+                                   content_type="application/json")
+            self.assertEqual(response.status_code, 429)
+        response = client.post("/api/1.0/batch/", data=json.dumps([getwinner] * 3), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+
+class ConcurrentStrikeTestCase(TransactionTestCase):
+    """Test strikes made at once from many threads, each with its own database connection"""
+
+    def test_concurrent_strikes(self):
+        """Racing players should never take two turns at once, or sink the same ship twice"""
+
+        game = Game.objects.create(name="test_game", maximum_x=6, maximum_y=6, ships_per_person=2)
+        players = [Player.objects.create(name=f"player{number}") for number in range(1, 5)]
+        game.players.add(*players)
+        game.start_game()
+        ships = Ship.objects.filter(game=game).count()
+
+        # Everyone aims at the same squares in the same order, so they keep racing for the same ships
+        targets = [(x, y) for x in range(1, 7) for y in range(1, 7)]
+        errors = []
+
+        def play(player):
+            try:
+                for target in targets:
+                    while True:
+                        try:
+                            # A fresh Game each time, as separate requests would have
+                            Game.objects.get(pk=game.pk).strike(player, target)
+                            break
+                        except PermissionDenied as e:
+                            if str(e) == "NoShipsInGame":
+                                return
+                            if str(e) not in ("NotYourTurn", "Busy"):
+                                raise
+                            if Game.objects.get(pk=game.pk).winner_id:
+                                return
+                            time.sleep(0.001)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=play, args=(player,)) for player in players]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+
+        # Every turn was counted once, and nobody got more than a turn ahead
+        game = Game.objects.get(pk=game.pk)
+        moves = game.get_move_counts()
+        for player in players:
+            self.assertEqual(moves[player.id], Action.objects.filter(game=game, player=player).count())
+        self.assertLessEqual(max(moves.values()) - min(moves.values()), 1)
+
+        # Every ship was sunk at most once, and the counts agree with the ships left
+        hits = Action.objects.filter(game=game, result__startswith="hit").count()
+        self.assertEqual(ships - Ship.objects.filter(game=game).count(), hits)
+        self.assertEqual(hits, GameEvent.objects.filter(game=game, kind='sink').count())
+        for game_player in GamePlayer.objects.filter(game=game):
+            self.assertEqual(Ship.objects.filter(game=game, player_id=game_player.player_id).count(),
+                             game_player.ships_remaining)
+        self.assertIsNotNone(game.winner)
+
+        # And the event log has no gaps
+        sequences = list(GameEvent.objects.filter(game=game).order_by('sequence').values_list('sequence', flat=True))
+        self.assertEqual(list(range(1, len(sequences) + 1)), sequences)
+
+
+class TournamentTestCase(TestCase):
+    """Test scheduling and playing tournaments"""
+    def setUp(self):
+
+        self.players = [Player.objects.create(name=f"player{number}") for number in range(1, 6)]
+
+
+    def create_tournament(self, format):
+        tournament = Tournament.objects.create(name="cup", format=format, maximum_x=6, maximum_y=6,
+                                               ships_per_person=1)
+        tournament.players.add(*self.players)
+        return tournament
+
+
+    def test_round_robin_pairings(self):
+        """Everyone should play everyone else once, and nobody twice in a round"""
+
+        rounds = Tournament._get_round_robin_pairings(["a", "b", "c", "d", "e"])
+        self.assertEqual(5, len(rounds))
+        pairs = [frozenset(pair) for pairs in rounds for pair in pairs]
+        self.assertEqual(10, len(set(pairs)))
+        for pairs in rounds:
+            players = [player for pair in pairs for player in pair]
+            self.assertEqual(len(players), len(set(players)))
+
+
+    def test_round_robin(self):
+        """All the games should be scheduled at once, and played to a winner"""
+
+        tournament = self.create_tournament(Tournament.ROUND_ROBIN)
+        games = tournament.schedule()
+        self.assertEqual(10, len(games))
+        self.assertEqual([], tournament.schedule())
+        self.assertEqual(2, GamePlayer.objects.all().filter(game=games[0]).count())
+        self.assertEqual(2, games[0].players.count())
+        self.assertEqual(10, len(set(Game.objects.get(id=game.id).get_secret() for game in games)))
+        self.assertIsNone(tournament.get_champion())
+
+        for game in games:
+            self.assertGreater(tournament.play_game(game), 0)
+            game.refresh_from_db()
+            self.assertIsNotNone(game.get_winner())
+
+        standings = tournament.get_standings()
+        self.assertEqual([4] * 5, [standing["played"] for standing in standings])
+        self.assertEqual(10, sum(standing["won"] for standing in standings))
+        self.assertEqual(standings[0]["won"], max(standing["won"] for standing in standings))
+        self.assertIsNotNone(tournament.get_champion())
+
+
+    def test_knockout(self):
+        """Winners and byes should go through each round until one player is left"""
+
+        tournament = self.create_tournament(Tournament.KNOCKOUT)
+        rounds = []
+        while True:
+            games = tournament.schedule()
+            if not games:
+                break
+            # Nothing more can be scheduled until this round is over
+            self.assertEqual([], tournament.schedule())
+            rounds.append(len(games))
+            for game in games:
+                tournament.play_game(game)
+
+        # Five players, so a bye in the first two rounds
+        self.assertEqual([2, 1, 1], rounds)
+        champion = tournament.get_champion()
+        final = tournament.game_set.get(tournament_round=3)
+        self.assertEqual(final.get_winner().name, champion)
+
+
+    def test_tournament_command(self):
+        """The command should create the players and report the standings"""
+
+        output = StringIO()
+        call_command('tournament', 'cup', 'player1', 'newplayer', '--size', '6', stdout=output)
+
+        self.assertTrue(Player.objects.all().filter(name="newplayer").exists())
+        self.assertIn("games/second", output.getvalue())
+        tournament = Tournament.objects.get(name="cup")
+        self.assertIn(f"Champion: {tournament.get_champion()}", output.getvalue())
+
+        self.assertRaises(CommandError, call_command, 'tournament', 'cup', 'player1', 'player2', stdout=StringIO())
+        self.assertRaises(CommandError, call_command, 'tournament', 'solo', 'player1', stdout=StringIO())
+
+
+class EngineTestCase(TestCase):
+    """Test the in-memory game engine on its own"""
+    def setUp(self):
+
+        self.state = engine.GameState(10, 10)
+        self.state.add_player(1)
+        self.state.add_player(2)
+        self.assertTrue(self.state.place_ship("Enterprise", 1, engine.get_cells('horizontal', (3,3), 3)))
+        self.assertTrue(self.state.place_ship("Defiant", 2, engine.get_cells('vertical', (8,3), 3)))
+
+
+    def test_place_ship(self):
+        """Ships may not overlap, or go off the grid"""
+
+        self.assertFalse(self.state.place_ship("Voyager", 2, engine.get_cells('vertical', (4,1), 3)))
+        self.assertFalse(self.state.place_ship("Voyager", 2, engine.get_cells('horizontal', (9,9), 3)))
+        self.assertIsNone(engine.get_possible_cells(10, 10, 'horizontal', (8,1), 3))
+        self.assertIsNone(engine.get_possible_cells(10, 10, 'sideways', (1,1), 3))
+        self.assertEqual(["Enterprise", "Defiant"], self.state.get_ships())
+        self.assertEqual("Defiant", self.state.check_for_hit((8,5)))
+        self.assertIsNone(self.state.check_for_hit((20,20)))
+
+
+    def test_strike(self):
+        """Strikes should take turns, sink whole ships and find the winner"""
+
+        self.assertRaises(PermissionDenied, self.state.strike, 3, (1,1))
+        self.assertIsNone(self.state.strike(1, (1,1)))
+        with self.assertRaisesMessage(PermissionDenied, "NotYourTurn"):
+            self.state.strike(1, (1,2))
+        self.assertIsNone(self.state.strike(2, (20,20)))
+        self.assertEqual({1: 1, 2: 1}, self.state.get_move_counts())
+        self.assertIsNone(self.state.get_winner())
+
+        self.assertEqual("Defiant", self.state.strike(1, (8,4)))
+        self.assertIsNone(self.state.check_for_hit((8,3)))
+        self.assertEqual(1, self.state.get_winner())
+        self.assertEqual(["Enterprise"], self.state.get_ships())
+
+        self.assertEqual("Enterprise", self.state.strike(2, (3,3)))
+        with self.assertRaisesMessage(PermissionDenied, "NoShipsInGame"):
+            self.state.strike(1, (1,1))
+        self.assertIsNone(self.state.get_winner())
+
+
+    def test_set_moves(self):
+        """Moves loaded from elsewhere should decide whose turn it is"""
+
+        self.state.set_moves({1: 3, 2: 2, 3: 2})
+        self.assertRaises(PermissionDenied, self.state.strike, 1, (1,1))
+        self.state.strike(2, (1,1))
+        self.state.strike(3, (1,2))
+        self.state.strike(1, (1,3))
+
+
+    def test_find_free_placement(self):
+        """Placement should find the only space left, in whichever orientation it is"""
+
+        # Fill a small board, leaving room for a single diagonal ship, from (1,1)
+        state = engine.GameState(4, 4)
+        for y in range(0, 5):
+            for x in range(0, 5):
+                if (x, y) not in [(1,1), (2,2), (3,3)]:
+                    state.place_ship((x, y), 1, [(x, y)])
+
+        for attempt in range(10):
+            self.assertEqual(('diagonal', (1,1)), state.find_free_placement(3))
+        self.assertIsNone(state.find_free_placement(4))
+
+
+    @patch.object(engine, 'PLACEMENT_ATTEMPTS', 0)
+    def test_find_free_start_exact(self):
+        """Picking from the free starts should be able to choose every one of them, and nothing else"""
+
+        state = engine.GameState(12, 9)
+        for start in [(1,1), (5,2), (3,6), (9,4)]:
+            state.place_ship(start, 1, engine.get_cells('diagonal', start, 3))
+
+        for orientation in engine.ORIENTATIONS:
+            (x_range, y_range) = engine.get_start_ranges(12, 9, orientation, 3)
+            free_starts = {(x, y) for y in y_range for x in x_range
+                           if state.can_place(engine.get_cells(orientation, (x, y), 3))}
+            chosen = {state.find_free_start(orientation, 3) for attempt in range(2000)}
+            self.assertEqual(free_starts, chosen)
+
+
+    def test_large_board(self):
+        """A huge board should cost no more than the ships on it"""
+
+        state = engine.GameState(10000, 10000)
+        starts = {}
+        for player_id in [1, 2]:
+            for number in range(50):
+                (orientation, start_location) = state.find_free_placement(3)
+                self.assertTrue(state.place_ship((player_id, number), player_id,
+                                                 engine.get_cells(orientation, start_location, 3)))
+                starts[(player_id, number)] = start_location
+
+        self.assertEqual(300, len(state.grid))
+        self.assertEqual((1, 0), state.check_for_hit(starts[(1, 0)]))
+
+        # Player 2 sinks each of player 1's ships in turn, while player 1 aims at a cell off the grid
+        for number in range(50):
+            self.assertIsNone(state.strike(1, (0, 0)))
+            self.assertEqual((1, number), state.strike(2, starts[(1, number)]))
+        self.assertEqual(150, len(state.grid))
+        self.assertEqual(2, state.get_winner())
+
+
+    def test_large_game(self):
+        """A game on a huge board should be played and viewed without touching every square"""
+
+        game = Game.objects.create(name="test_game", maximum_x=10000, maximum_y=10000, ships_per_person=1)
+        p1 = Player.objects.create(name="player1")
+        p2 = Player.objects.create(name="player2")
+        game.players.add(p1, p2)
+        game.start_game()
+
+        ship = p2.ship_set.get()
+        self.assertEqual(f"hit: ship {ship.name} belonging to player2 was sunk.",
+                         game.strike(p1, ship.get_locations_as_tuples()[0]).result)
+        self.assertEqual(p1, game.get_winner())
+
+        secret = p1.create_secret()
+        response = Client().get(f"/view_game/test_game/player1/{secret}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"too large to show", response.content)
+        self.assertNotIn(b"lightgray", response.content)
+
+
+    def test_game_uses_engine(self):
+        """The model should keep its game state in step with the database"""
+
+        game = Game.objects.create(name="test_game", maximum_x=8, maximum_y=8)
+        p1 = Player.objects.create(name="player1")
+        p2 = Player.objects.create(name="player2")
+        game.players.add(p1, p2)
+        game.start_game()
+
+        state = game.get_game_state()
+        self.assertEqual(set(game.ship_set.all()), set(state.get_ships()))
+
+        # A fresh Game object should build the same state from the database
+        fresh_state = Game.objects.get(name="test_game").get_game_state()
+        cells = [(x, y) for x in range(0, 9) for y in range(0, 9)]
+        self.assertEqual([state.check_for_hit(cell) for cell in cells],
+                         [fresh_state.check_for_hit(cell) for cell in cells])
+
+        ship = game.ship_set.filter(player=p2).first()
+        game.strike(p1, ship.get_locations_as_tuples()[0])
+        self.assertNotIn(ship, state.get_ships())
+        self.assertEqual({p1.id: 1, p2.id: 0}, state.get_move_counts())
+
+
+    def test_benchmark_engine(self):
+        """The engine microbenchmarks should run and report each operation"""
+
+        output = StringIO()
+        call_command('benchmark_engine', games=2, size=10, stdout=output)
+        for operation in ["place_ship", "strike", "check_for_hit"]:
+            self.assertIn(operation, output.getvalue())
+
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is specific to SQLite")
+class QueryPlanTestCase(TestCase):
+    """Test the queries made on the busiest paths are answered from indexes, not by scanning whole tables"""
+    def setUp(self):
+
+        self.game = Game.objects.create(name="test_game", maximum_x=10, maximum_y=10, ships_per_person=3)
+        self.p1 = Player.objects.create(name="player1")
+        self.p2 = Player.objects.create(name="player2")
+        self.game.players.add(self.p1, self.p2)
+        self.game.start_game()
+
+
+    def get_plans(self, function):
+        """Call a function and return a list of tuples (sql, plan) for each query it made, the plan as a list of lines"""
+
+        with CaptureQueriesContext(connection) as context:
+            function()
+
+        plans = []
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                sql = query['sql']
+                # Inserts and transaction control have no plan worth checking
+                if sql.startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                    plans.append((sql, [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+
+    def assertNoTableScans(self, function):
+        """Assert that none of the queries made by a function reads every row of a table"""
+
+        plans = self.get_plans(function)
+        self.assertTrue(plans)
+        for (sql, plan) in plans:
+            for line in plan:
+                # A "SCAN" that is not "USING" an index walks the whole table
+                if line.startswith('SCAN') and 'USING' not in line:
+                    self.fail(f"Full table scan: {line}\nin: {sql}")
+        return plans
+
+
+    def test_strike(self):
+        """Strikes, both hits and misses, and reloading the game state, should only look up what they need"""
+
+        ship = Ship.objects.filter(game=self.game, player=self.p2).first()
+        self.assertNoTableScans(lambda: self.game.strike(self.p1, (ship.x, ship.y)))
+        self.assertNoTableScans(lambda: self.game.strike(self.p2, (0, 0)))
+        self.assertNoTableScans(lambda: Game.objects.get(id=self.game.id).get_game_state())
+
+
+    def test_ships(self):
+        """Listing a player's ships should use both the game and the player, and need no sort"""
+
+        def list_ships():
+            self.game.list_ships_by_player(self.p1)
+            for ships in self.game.get_ships_by_player().values():
+                list(ships)
+
+        for (sql, plan) in self.assertNoTableScans(list_ships):
+            if 'FROM "server_ship"' in sql:
+                self.assertIn("ship_game_player_name_idx", plan[0])
+                self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plan)
+
+
+    def test_ship_names(self):
+        """Checking whether a ship name is taken should use both the game and the name"""
+
+        for (sql, plan) in self.assertNoTableScans(self.game.get_random_ship_name):
+            self.assertIn("ship_game_name_idx", plan[0])
+
+
+    def test_history(self):
+        """Fetching the history from a cursor should start from the cursor, and need no sort"""
+
+        self.game.strike(self.p1, (0, 0))
+        self.game.strike(self.p2, (0, 0))
+        first_id = Action.objects.filter(game=self.game).order_by('id').first().id
+
+        plans = self.assertNoTableScans(lambda: self.game.list_actions_as_dicts(since=first_id, limit=5))
+        (sql, plan) = plans[0]
+        self.assertIn("game_id=? AND", plan[0])
+        self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plan)
+
+
+class GameCacheTestCase(TestCase):
+    """Test the cache of game states, which is written once changes commit, so callbacks are run here"""
+    def setUp(self):
+
+        gamecache.get_cache().clear()
+        gamecache.reset_counts()
+
+        self.p1 = Player.objects.create(name="player1")
+        self.p2 = Player.objects.create(name="player2")
+        self.secret = self.p1.create_secret()
+
+        game = Game.objects.create(name="test_game", maximum_x=10, maximum_y=10)
+        game.players.add(self.p1, self.p2)
+        with self.captureOnCommitCallbacks(execute=True):
+            game.start_game()
+
+
+    def get_state_from_database(self):
+        """Return a tuple (ships, moves) for the game as the database has it, leaving the cache alone"""
+
+        game = Game.objects.get(name="test_game")
+        ships = sorted((ship.id, ship.name, ship.player_id, ship.get_locations_as_tuples())
+                       for ship in game.ship_set.all())
+        return (ships, game.get_move_counts())
+
+
+    def get_state_from_cache(self):
+        """Return a tuple (ships, moves) for the game as the game cache has it, failing if it is not there"""
+
+        game = Game.objects.get(name="test_game")
+        entry = gamecache.get(game)
+        self.assertIsNotNone(entry)
+        ships = sorted((ship.id, ship.name, ship.player_id, ship.get_locations_as_tuples())
+                       for ship in game._get_cached_ships(entry))
+        return (ships, entry["moves"])
+
+
+    def test_write_through(self):
+        """Starting the game and strikes should leave the cache holding just what the database has"""
+
+        self.assertEqual(self.get_state_from_database(), self.get_state_from_cache())
+
+        ship = Ship.objects.filter(player=self.p2).first()
+        for (player, location) in [(self.p1, (ship.x, ship.y)), (self.p2, (0, 0))]:
+            with self.captureOnCommitCallbacks(execute=True):
+                Game.objects.get(name="test_game").strike(player, location)
+            self.assertEqual(self.get_state_from_database(), self.get_state_from_cache())
+
+        self.assertFalse(Ship.objects.filter(id=ship.id).exists())
+        self.assertEqual({self.p1.id: 1, self.p2.id: 1}, self.get_state_from_cache()[1])
+
+
+    def test_strike_queries(self):
+        """A strike should not load the ships and moves when the game cache has them"""
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as warm:
+            Game.objects.get(name="test_game").strike(self.p1, (0, 0))
+        self.assertEqual(1, gamecache.get_counts()["hits"])
+
+        gamecache.get_cache().clear()
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as cold:
+            Game.objects.get(name="test_game").strike(self.p2, (0, 0))
+
+        self.assertEqual(len(cold) - 2, len(warm))
+
+        # The turn checks are made against the cache too, after just reading the version
+        with self.captureOnCommitCallbacks(execute=True):
+            Game.objects.get(name="test_game").strike(self.p1, (0, 0))
+        game = Game.objects.get(name="test_game")
+        with self.assertNumQueries(1), self.assertRaisesMessage(PermissionDenied, "NotYourTurn"):
+            game.strike(self.p1, (0, 0))
+
+
+    def test_getships(self):
+        """The ships for a player should be served from the cache, and match the database"""
+
+        expected = Game.objects.get(name="test_game").list_ships_by_player(self.p1)
+        gamecache.reset_counts()
+
+        response = Client().get(f"/api/1.0/games/getships/test_game/player1/{self.secret}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(json.dumps(expected)), response.json())
+        self.assertEqual(1, gamecache.get_counts()["hits"])
+
+        response = async_to_sync(AsyncClient().get)(f"/api/1.0/games/getships/test_game/player1/{self.secret}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(json.dumps(expected)), response.json())
+
+
+    def test_add_player(self):
+        """Adding a player should be written through, and other changes should simply not be used"""
+
+        Game.objects.create(name="test_game2")
+        with self.captureOnCommitCallbacks(execute=True):
+            Game.objects.get(name="test_game2").get_game_state()
+            response = Client().get("/api/1.0/games/addplayer/test_game2/player1/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({self.p1.id: 0}, gamecache.get(Game.objects.get(name="test_game2"))["moves"])
+
+        response = Client().get("/api/1.0/games/addplayer/test_game2/player1/")
+        self.assertEqual(response.status_code, 403)
+
+        # A ship made directly raises the version without writing it through, so the old entry goes unused
+        game = Game.objects.get(name="test_game2")
+        with self.captureOnCommitCallbacks(execute=True):
+            game._create_ship_check('horizontal', self.p1, (1, 1), 3)
+        game = Game.objects.get(name="test_game2")
+        self.assertIsNone(gamecache.get(game))
+        self.assertEqual(1, len(game.get_game_state().get_ships()))
+
+
+    def test_add_player_stale(self):
+        """Adding a player through a Game behind the database should drop the entry rather than patch it"""
+
+        game = Game.objects.create(name="test_game2")
+        stale = Game.objects.get(name="test_game2")
+        with self.captureOnCommitCallbacks(execute=True):
+            game.players.add(self.p1)
+            Game.objects.get(name="test_game2").get_game_state()
+            stale.players.add(self.p2)
+
+        game = Game.objects.get(name="test_game2")
+        self.assertIsNone(gamecache.get_cache().get(gamecache.get_cache_key(game)))
+        self.assertEqual({self.p1.id: 0, self.p2.id: 0}, game.get_game_state().get_move_counts())
+
+
+    def test_rollback_and_delete(self):
+        """Nothing should be cached from a change that is rolled back, and deleting a game should forget it"""
+
+        game = Game.objects.get(name="test_game")
+        try:
+            with transaction.atomic():
+                game.strike(self.p1, (0, 0))
+                raise RuntimeError("Roll back")
+        except RuntimeError:
+            pass
+        game = Game.objects.get(name="test_game")
+        self.assertEqual(self.get_state_from_database(), self.get_state_from_cache())
+
+        Game.objects.get(name="test_game").delete()
+        self.assertIsNone(gamecache.get_cache().get(gamecache.get_cache_key(game)))
+
+
+    def test_stats(self):
+        """The hits and misses should be shown to superusers only"""
+
+        client = Client()
+        response = client.get("/api/1.0/stats/cache/")
+        self.assertEqual(response.status_code, 403)
+
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        client.login(username="admin", password="password")
+        response = client.get("/api/1.0/stats/cache/?reset=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(0, response.json()["hits"])
+        self.assertEqual(1, response.json()["misses"])
+        self.assertEqual({"hits": 0, "misses": 0, "hit_rate": None}, gamecache.get_counts())
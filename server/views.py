@@ -1,5 +1,17 @@
 
-from django.http import JsonResponse
+import copy
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import FileResponse, JsonResponse, QueryDict, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 # We will sometimes raise exceptions
 from django.core.exceptions import PermissionDenied
 
@@ -9,28 +21,182 @@ from django.shortcuts import get_object_or_404, render
 from django.contrib.auth.decorators import login_required, permission_required, user_passes_test
 from django.http import HttpResponse, HttpResponseRedirect
 from django.template import RequestContext, loader
-
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+
+from . import events
+from . import gamecache
+from . import ratelimit
+from . import stats
 from .models import Action
 from .models import Player
 from .models import Game
+from .models import GamePlayer
 from .models import Ship
+from .models import filter_by_name
 
 # There are v1.0 APIs, all JSON encoded.
 # In many of these views all exceptions are caught, this is to avoid exposing them to hostile end users
 
 
+def _get_int_parameter(request, name):
+    """Fetch an optional integer query parameter, returning None if it is absent
+
+    Raises ValueError if the parameter is present but is not an integer.
+    """
+
+    value = request.GET.get(name)
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+def _get_game_etag(game, *parts):
+    """Return an ETag for a response about a game, which changes whenever anything in the game does
+
+    game        the Game the response is about
+    parts       anything else the response depends on, such as the player viewing it
+
+    The creation time is included too, so a game that is deleted and made again is never confused with the
+    old one.
+    """
+
+    game_parts = (game.id, int(game.created.timestamp() * 1000000), game.version)
+    return '"' + '-'.join(str(part) for part in game_parts + parts) + '"'
+
+
+def _get_not_modified(request, etag, last_modified=None):
+    """Return a 304 Not Modified response if the client already has this version of a response, or None
+
+    etag            the ETag of the current response
+    last_modified   if supplied, the datetime the content last changed
+
+    Only GET and HEAD requests are answered this way, calls made through api/1.0/batch/ always run.
+    """
+
+    if request.method not in ('GET', 'HEAD'):
+        return None
+
+    if last_modified is not None:
+        last_modified = int(last_modified.timestamp())
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def _set_validators(response, etag, last_modified=None):
+    """Add the ETag and any Last-Modified header to a response, and return it
+
+    Clients are asked to check back every time, as a game can change at any moment, and these responses
+    may depend on a player's secret, so they are not to be kept by shared caches.
+
+    Last-Modified is only given to the second, so it is left out while the content is less than a second
+    old, otherwise a second change within the same second could be missed by a client relying on it.
+    """
+
+    response['ETag'] = etag
+    if last_modified is not None and int(time.time()) > int(last_modified.timestamp()):
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _get_index_etag(model, parameters):
+    """Return an ETag for an index of the games or players, which changes whenever one is added or removed
+
+    model       Game or Player
+    parameters  the dict of index parameters, see _get_index_parameters()
+
+    Ids are never reused, so the number of rows and the largest id change with any addition or deletion.
+    The parameters may hold any text, so they are added as a digest.
+    """
+
+    counts = model.objects.aggregate(Count('id'), Max('id'))
+    digest = hashlib.md5(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:16]
+    return f'"{model.__name__.lower()}s-{counts["id__count"]}-{counts["id__max"] or 0}-{digest}"'
+
+
+def _get_index_parameters(request):
+    """Fetch the optional query parameters of the index calls, as a dict of prefix, after and limit
+
+    See Player.iter_players_as_dicts() for their meaning. Raises ValueError if the limit is not a number,
+    or is negative.
+    """
+
+    limit = _get_int_parameter(request, 'limit')
+    if limit is not None and limit < 0:
+        raise ValueError("Negative limit")
+
+    return {
+        "prefix": request.GET.get('prefix') or None,
+        "after": request.GET.get('after') or None,
+        "limit": limit,
+    }
+
+
+def load_game_player(game_name, player_name):
+    """Fetch a game, a player, the player's secret and their membership of the game, in one query
+
+    game_name       the text key for the game (game.name)
+    player_name     the text key for the player (player.name)
+
+    returns a tuple (game, player, game_player), where game_player is the GamePlayer for the player in
+    the game, or None if they are not in it. The player's secret is loaded, so get_secret() is free.
+
+    raises Game.DoesNotExist or Player.DoesNotExist if either cannot be found
+    """
+
+    game_player = GamePlayer.objects.all().select_related('game', 'player', 'player__playersecret')\
+        .filter(game__name=game_name, player__name=player_name).first()
+    if game_player:
+        return (game_player.game, game_player.player, game_player)
+
+    # The player is not in the game, or one of them does not exist, so find out which
+    game = Game.objects.get(name=game_name)
+    player = Player.objects.select_related('playersecret').get(name=player_name)
+    return (game, player, None)
+
+
+def _stream_json_list(items):
+    """A generator of the JSON encoding of a list, an item at a time, for use in a StreamingHttpResponse
+
+    items   an iterable of JSON serialisable items
+    """
+
+    yield "["
+    separator = ""
+    for item in items:
+        yield separator + json.dumps(item, cls=DjangoJSONEncoder)
+        separator = ", "
+    yield "]"
+
+
 def api_players_index(request):
-    """Show a list of games, encoded in JSON"""
+    """Show a list of players, encoded in JSON and streamed a player at a time
+
+    The optional query parameters prefix (the start of a name), after (a name) and limit (a number of
+    players) allow clients to look for players, or to fetch a page at a time.
+    """
 
     try:
-        players = Player.list_players_as_dicts()
-        response = players
-        status_code = 200
+        parameters = _get_index_parameters(request)
+
+        # Nothing to send if no players have come or gone since the client last asked
+        etag = _get_index_etag(Player, parameters)
+        not_modified = _get_not_modified(request, etag)
+        if not_modified:
+            return not_modified
+
+        players = Player.iter_players_as_dicts(**parameters)
+        response = StreamingHttpResponse(_stream_json_list(players), content_type='application/json')
+    except ValueError:
+        status_code = 400
+        return JsonResponse("Invalid limit", safe=False, status=status_code)
     except:
         response = "Unknown Error"
         status_code = 500
+        return JsonResponse(response, safe=False, status=status_code)
 
-    return JsonResponse(response, safe=False, status=status_code)
+    return _set_validators(response, etag)
 
 
 def api_players_register(request, player_name):
@@ -54,39 +220,54 @@ def api_players_delete(request, player_name, secret):
     """Attempt to delete a player with its secret"""
 
     try:
-        # Fetch the player
-        player = Player.objects.get(name=player_name)
-        if not player:
-            status_code = 404
-            response = f"Could not find player {player_name}"
+        # Fetch the player, along with its secret
+        player = Player.objects.select_related('playersecret').get(name=player_name)
+        if secret != player.get_secret():
+            status_code = 403
+            response = f"Invalid secret"
         else:
-            if secret != player.get_secret():
-                status_code = 403
-                response = f"Invalid secret"
-            else:
-                # We have a player and valid secret
-                player.delete()
-                status_code = 200
-                response = f"Player {player_name} deleted"
+            # We have a player and valid secret
+            player.delete()
+            status_code = 200
+            response = f"Player {player_name} deleted"
 
         return JsonResponse(response, safe=False, status=status_code)
+
+    except Player.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find player {player_name}", safe=False, status=status_code)
+
     except:
         status_code = 500
         return JsonResponse("Unknown error", safe=False, status=status_code)
 
 
 def api_games_index(request):
-    """Show a list of games"""
+    """Show a list of games, streamed a game at a time
+
+    The optional query parameters are as for api_players_index().
+    """
 
     try:
-        games = Game.list_games_as_dicts()
-        response = games
-        status_code = 200
+        parameters = _get_index_parameters(request)
+
+        # Nothing to send if no games have come or gone since the client last asked
+        etag = _get_index_etag(Game, parameters)
+        not_modified = _get_not_modified(request, etag)
+        if not_modified:
+            return not_modified
+
+        games = Game.iter_games_as_dicts(**parameters)
+        response = StreamingHttpResponse(_stream_json_list(games), content_type='application/json')
+    except ValueError:
+        status_code = 400
+        return JsonResponse("Invalid limit", safe=False, status=status_code)
     except:
         response = "Unknown Error"
         status_code = 500
+        return JsonResponse(response, safe=False, status=status_code)
 
-    return JsonResponse(response, safe=False, status=status_code)
+    return _set_validators(response, etag)
 
 
 def api_games_register(request, game_name):
@@ -110,23 +291,23 @@ def api_games_delete(request, game_name, secret):
     """Attempt to delete a game with a valid secret"""
 
     try:
-        # Fetch the game
-        game = Game.objects.get(name=game_name)
-        if not game:
-            status_code = 404
-            response = f"Could not find game {game_name}"
+        # Fetch the game, along with its secret
+        game = Game.objects.select_related('gamesecret').get(name=game_name)
+        if secret != game.get_secret():
+            status_code = 403
+            response = f"Invalid secret"
         else:
-            if secret != game.get_secret():
-                status_code = 403
-                response = f"Invalid secret"
-            else:
-                # We have a player and valid secret
-                game.delete()
-                status_code = 200
-                response = f"Game {game_name} deleted"
+            # We have a game and valid secret
+            game.delete()
+            status_code = 200
+            response = f"Game {game_name} deleted"
 
         return JsonResponse(response, safe=False, status=status_code)
 
+    except Game.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find game {game_name}", safe=False, status=status_code)
+
     except:
         status_code = 500
         return JsonResponse("Unknown error", safe=False, status=status_code)
@@ -150,13 +331,16 @@ def api_games_add_player(request, game_name, player_name):
 
         # Have we both?
         if game and player:
+            # The players and ships come from the game state, which is often in the game cache
+            state = game.get_game_state()
+
             # Is it already there
-            if player in game.players.all():
+            if player.id in state.get_move_counts():
                 status_code = 403
                 response = f"Player {player_name} is already in game {game_name}"
 
-            # Or are there already ships?
-            elif game.number_of_ships():
+            # Or are there already ships, or has the game been and gone?
+            elif state.get_ships() or game.archived:
                 status_code = 403
                 response = "Game already started"
 
@@ -184,8 +368,8 @@ def api_games_start_game(request, game_name):
             status_code = 404
             response = f"Could not find game {game_name}"
         else:
-            # Are there ships already?
-            if game.number_of_ships():
+            # Are there ships already, or has the game been and gone?
+            if game.number_of_ships() or game.archived:
                 # Disallow further ship generation
                 status_code = 403
                 response = "GameAlreadyStarted"
@@ -204,7 +388,11 @@ def api_games_start_game(request, game_name):
 
 
 def api_games_history(request, game_name):
-    """Fetch the action history for a game"""
+    """Fetch the action history for a game
+
+    The optional query parameters since (an action id) and limit (a number of actions) allow clients
+    to fetch only the actions they have not yet seen.
+    """
 
     try:
         # Fetch the game
@@ -213,104 +401,294 @@ def api_games_history(request, game_name):
             status_code = 404
             response = f"Could not find game {game_name}"
         else:
-            response = game.list_actions_as_dicts()
+            since = _get_int_parameter(request, 'since')
+            limit = _get_int_parameter(request, 'limit')
+            if (since is not None and since < 0) or (limit is not None and limit < 0):
+                raise ValueError("Negative cursor")
+
+            # Nothing to send if the game hasn't changed since the client last asked
+            etag = _get_game_etag(game, 'history', since, limit)
+            not_modified = _get_not_modified(request, etag, game.modified)
+            if not_modified:
+                return not_modified
+
+            if game.archived:
+                # Stream these from the archive file rather than loading them all
+                actions = game.iter_archived_actions(since=since, limit=limit)
+                return _set_validators(StreamingHttpResponse(_stream_json_list(actions),
+                                                             content_type='application/json'),
+                                       etag, game.modified)
+
+            response = game.list_actions_as_dicts(since=since, limit=limit)
             status_code = 200
+            return _set_validators(JsonResponse(response, safe=False, status=status_code), etag, game.modified)
 
         return JsonResponse(response, safe=False, status=status_code)
 
+    except ValueError:
+        status_code = 400
+        return JsonResponse("Invalid since or limit", safe=False, status=status_code)
+
     except:
         status_code = 500
         return JsonResponse("Unknown error", safe=False, status=status_code)
 
 
-def api_games_getships(request, game_name, player_name, secret):
-    """Fetch the ships for a specific player in a specific game"""
-    #TODO: Doesn't include the ship locations, so that needs to be fixed
+def api_games_archive(request, game_name):
+    """Download the archive file of an archived game, as compressed JSON lines"""
+
+    try:
+        game = Game.objects.get(name=game_name, archived=True)
+        archive_file = open(game.get_archive_path(), 'rb')
+
+    except (Game.DoesNotExist, FileNotFoundError):
+        status_code = 404
+        return JsonResponse(f"Could not find an archive for game {game_name}", safe=False, status=status_code)
+
+    except:
+        status_code = 500
+        return JsonResponse("Unknown error", safe=False, status=status_code)
+
+    return FileResponse(archive_file, as_attachment=True, filename=f"{game_name}.jsonl.gz",
+                        content_type='application/gzip')
+
+
+def api_games_replay(request, game_name, sequence):
+    """Return the state of a game as it was after a given event in its log
+
+    game_name   the text key for the game (game.name)
+    sequence    the number of the event, from 1, or 0 for the state before anything happened
+
+    Because the state shows every ship, this is only available for finished games, or to superusers.
+    """
+
+    try:
+        game = Game.objects.get(name=game_name)
+        if not game.winner_id and not request.user.is_superuser:
+            raise PermissionDenied("Replays are only available once the game is over.")
+
+        state = game.get_state(int(sequence))
+
+    except Game.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find game {game_name}", safe=False, status=status_code)
+
+    except PermissionDenied:
+        status_code = 403
+        return JsonResponse("Replays are only available once the game is over", safe=False, status=status_code)
+
+    except:
+        status_code = 500
+        return JsonResponse("Unknown error", safe=False, status=status_code)
+
+    return JsonResponse({"events": game.count_events(), "state": state})
+
+
+def _format_event(event, data, event_id=None):
+    """Format a single Server-Sent Event
+
+    event       the name of the event
+    data        the data for the event, which will be JSON encoded
+    event_id    if supplied, the id the client should send back as Last-Event-ID if it reconnects
+    """
+
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, cls=DjangoJSONEncoder)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _stream_game_events(game, since):
+    """A generator of Server-Sent Events for a game
+
+    game    the Game to watch
+    since   only actions with an id greater than this are sent, None for all
+
+    Strikes are sent as "strike" events, with the same content as the history API, and with the action
+    id as the event id. A "turn" event is sent with the round number whenever a new round starts, and a
+    "gameover" event with the winner ends the stream.
+    """
+
+    deadline = time.monotonic() + settings.BATTLESHIPS_STREAM_TIMEOUT
+    current_round = None
+    watch = events.Watch(game.id)
+
+    # Ask the client to wait a second before reconnecting
+    yield "retry: 1000\n\n"
+
+    while True:
+        # Reset the watch before reading the database, so we cannot miss a strike made in between
+        watch.reset()
+
+        for action in game.list_actions_as_dicts(since=since):
+            since = action["id"]
+            yield _format_event("strike", action, since)
+
+        # A new round starts when everyone has caught up
+        move_counts = game.get_move_counts()
+        if move_counts:
+            new_round = min(move_counts.values()) + 1
+            if new_round != current_round:
+                current_round = new_round
+                yield _format_event("turn", {"round": current_round})
+
+        winner = game.get_winner()
+        if winner:
+            yield _format_event("gameover", {"winner": winner.name})
+            return
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            # The client can reconnect with Last-Event-ID to carry on
+            return
+
+        if not watch.wait(min(settings.BATTLESHIPS_STREAM_POLL_INTERVAL, remaining)):
+            # Nothing happened here, but strikes in other processes will be found on the next loop.
+            # Send a comment so that proxies do not close the connection.
+            yield ": keepalive\n\n"
+
+
+def api_games_stream(request, game_name):
+    """Stream the events of a game as they happen, as Server-Sent Events
+
+    This saves clients from polling the history and getwinner APIs. A client reconnecting can send the
+    Last-Event-ID header, or the since query parameter, to only receive strikes it has not yet seen.
+    """
 
     try:
         # Fetch the game
         game = Game.objects.get(name=game_name)
-        if not game:
-            status_code = 404
-            response = f"Could not find game {game_name}"
 
-        # Fetch the player
-        player = Player.objects.get(name=player_name)
-        if not player:
-            status_code = 404
-            response = f"Could not find player {player_name}"
+        since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+        if since:
+            since = int(since)
+        else:
+            since = None
 
-        # Have we both?
-        if game and player:
-            # Check the secret
-            if secret == player.get_secret():
-                status_code = 200
-                response = game.list_ships_by_player(player)
-            else:
-                status_code = 403
-                response = f"Invalid secret for player {player_name}"
+    except Game.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find game {game_name}", safe=False, status=status_code)
 
-        return JsonResponse(response, safe=False, status=status_code)
+    except ValueError:
+        status_code = 400
+        return JsonResponse("Invalid since or Last-Event-ID", safe=False, status=status_code)
 
     except:
         status_code = 500
+        return JsonResponse("Unknown error", safe=False, status=status_code)
+
+    response = StreamingHttpResponse(_stream_game_events(game, since), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Ask nginx and similar not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def api_games_getships(request, game_name, player_name, secret):
+    """Fetch the ships for a specific player in a specific game"""
+
+    try:
+        # Fetch the game, player and secret together
+        (game, player, game_player) = load_game_player(game_name, player_name)
+
+        # Check the secret
+        if secret == player.get_secret():
+            # Nothing to send if the game hasn't changed since the client last asked
+            etag = _get_game_etag(game, 'ships', player.id)
+            not_modified = _get_not_modified(request, etag, game.modified)
+            if not_modified:
+                return not_modified
+
+            status_code = 200
+            response = game.list_ships_by_player(player)
+            return _set_validators(JsonResponse(response, safe=False, status=status_code), etag, game.modified)
+        else:
+            status_code = 403
+            response = f"Invalid secret for player {player_name}"
+
         return JsonResponse(response, safe=False, status=status_code)
 
+    except Game.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find game {game_name}", safe=False, status=status_code)
+
+    except Player.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find player {player_name}", safe=False, status=status_code)
+
+    except:
+        status_code = 500
+        return JsonResponse("Unknown error", safe=False, status=status_code)
+
 
 def api_games_getwinner(request, game_name):
     """Fetch a winner if there is one, or None otherwise"""
 
     try:
-        # Fetch the game
-        game = Game.objects.get(name=game_name)
+        # Fetch the game, along with its stored winner in the same query
+        game = Game.objects.select_related('winner').get(name=game_name)
         if not game:
             status_code = 404
             response = f"Could not find game {game_name}"
         else:
+            # Nothing to send if the game hasn't changed since the client last asked
+            etag = _get_game_etag(game, 'winner')
+            not_modified = _get_not_modified(request, etag, game.modified)
+            if not_modified:
+                return not_modified
+
             status_code = 200
-            response = game.get_winner()
+            response = game.winner
             if response:
                 # If it's not NULL, just get the name of the winner
                 response = response.name
+            return _set_validators(JsonResponse(response, safe=False, status=status_code), etag, game.modified)
 
         return JsonResponse(response, safe=False, status=status_code)
 
+    except Game.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find game {game_name}", safe=False, status=status_code)
+
     except:
         status_code = 500
-        return JsonResponse(response, safe=False, status=status_code)
+        return JsonResponse("Unknown error", safe=False, status=status_code)
 
 
 def api_strike(request, game_name, player_name, secret, x, y):
-    """Fetch the ships for a specific player in a specific game"""
+    """Attempt a strike for a specific player in a specific game"""
 
     try:
-        # Fetch the game
-        game = Game.objects.get(name=game_name)
-        if not game:
-            status_code = 404
-            response = f"Could not find game {game_name}"
+        # Fetch the game, player, secret and membership of the game together
+        (game, player, game_player) = load_game_player(game_name, player_name)
 
-        # Fetch the player
-        player = Player.objects.get(name=player_name)
-        if not player:
-            status_code = 404
-            response = f"Could not find player {player_name}"
+        # Check the secret
+        if secret == player.get_secret():
+            if not game_player:
+                # No need to trouble the model, we already know
+                raise PermissionDenied("NotInGame")
 
-        # Have we both?
-        if game and player:
-            # Check the secret
-            if secret == player.get_secret():
-                status_code = 200
-                # Get the potential action and return
-                location = (int(x),int(y))
-                # Get the text from the output
-                response = game.strike(player, location).result
-            else:
-                status_code = 403
-                response = f"Invalid secret for player {player_name}"
+            status_code = 200
+            # Get the potential action and return
+            location = (int(x),int(y))
+            # Get the text from the output
+            response = game.strike(player, location).result
+        else:
+            status_code = 403
+            response = f"Invalid secret for player {player_name}"
 
         return JsonResponse(response, safe=False, status=status_code)
 
+    except Game.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find game {game_name}", safe=False, status=status_code)
+
+    except Player.DoesNotExist:
+        status_code = 404
+        return JsonResponse(f"Could not find player {player_name}", safe=False, status=status_code)
+
     except PermissionDenied as e:
         # The model strike code can raise exceptions, for instance, if it isn't the players turn.
         # Return the exception as a string so the client can deduce the reason
@@ -324,19 +702,237 @@ def api_strike(request, game_name, player_name, secret, x, y):
                             , safe=False, status=status_code)
 
 
+# The API calls that can be made within a batch, keyed by the same names used in the URLs
+BATCH_CALLS = {
+    'players/index': api_players_index,
+    'players/register': api_players_register,
+    'players/delete': api_players_delete,
+    'games/index': api_games_index,
+    'games/register': api_games_register,
+    'games/delete': api_games_delete,
+    'games/addplayer': api_games_add_player,
+    'games/start': api_games_start_game,
+    'games/history': api_games_history,
+    'games/getships': api_games_getships,
+    'games/getwinner': api_games_getwinner,
+    'strike': api_strike,
+}
+
+
+@csrf_exempt
+@require_POST
+def api_batch(request):
+    """Run a list of API calls in one request
+
+    The body should be a JSON list of operations, each a dict with:
+
+    call    the name of the API call, as in the URL, for instance "games/addplayer" or "strike"
+    args    a dict of the values that would be in the URL, named as in the URL patterns
+    query   an optional dict of query parameters, for instance {"since": 42} for "games/history"
+
+    The calls are made in order within one transaction, and each call that fails is rolled back on its
+    own, so later calls still see the effects of earlier successful ones. The response is a list with a
+    dict for each operation, containing the "status" code and the "response" the call would have given.
+    """
+
+    try:
+        operations = json.loads(request.body)
+        if not isinstance(operations, list):
+            raise ValueError("Not a list")
+    except ValueError:
+        status_code = 400
+        return JsonResponse("Invalid batch, expected a JSON list of operations", safe=False, status=status_code)
+
+    if len(operations) > settings.BATTLESHIPS_BATCH_LIMIT:
+        status_code = 400
+        return JsonResponse(f"Too many operations, the limit is {settings.BATTLESHIPS_BATCH_LIMIT}",
+                            safe=False, status=status_code)
+
+    # Each operation counts against the rate limits just as a request of its own would, for the address and
+    # any player it names, so a batch is no way around them. The tokens for the whole batch are taken at once,
+    # or none are, before any call is made.
+    operations_kwargs = []
+    for operation in operations:
+        args = operation.get('args') if isinstance(operation, dict) else None
+        operations_kwargs.append(args if isinstance(args, dict) else {})
+    keys = ratelimit.get_batch_keys(request, operations_kwargs)
+
+    # A batch needing more tokens than a bucket can hold would never be let through, however long it waited
+    for (key, rate, burst, count) in keys:
+        if count > burst:
+            status_code = 400
+            return JsonResponse(f"Too many operations for the rate limits, at most {burst} may count against "
+                                f"one {key.split(':')[0]}", safe=False, status=status_code)
+
+    wait = ratelimit.take(keys)
+    if wait:
+        return ratelimit.get_too_many_requests(wait)
+
+    results = []
+    with transaction.atomic():
+        for operation in operations:
+            try:
+                view = BATCH_CALLS[operation['call']]
+                args = dict(operation.get('args', {}))
+
+                # Each call sees its own query parameters, but otherwise the original request
+                call_request = copy.copy(request)
+                call_request.GET = QueryDict(mutable=True)
+                for (name, value) in operation.get('query', {}).items():
+                    call_request.GET[name] = str(value)
+
+            except (KeyError, TypeError, AttributeError):
+                results.append({"status": 400, "response": "Invalid operation"})
+                continue
+
+            # Each call has its own savepoint, so a failed call, even one that broke a query, is rolled back
+            # alone and leaves the transaction fit for the calls after it
+            try:
+                with transaction.atomic():
+                    response = view(call_request, **args)
+                    if response.status_code >= 400:
+                        transaction.set_rollback(True)
+            except TypeError:
+                # The args did not match those of the call
+                results.append({"status": 400, "response": "Invalid arguments for call"})
+                continue
+
+            # Some calls stream their responses, which are collected here
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+            else:
+                content = response.content
+            results.append({"status": response.status_code, "response": json.loads(content)})
+
+    return JsonResponse(results, safe=False)
+
+
+def api_stats(request):
+    """Show the time and queries used by each view in this process, superusers only
+
+    Add ?reset=1 to clear the figures after showing them.
+    """
+
+    if not request.user.is_superuser:
+        raise PermissionDenied("Requires superuser access.")
+
+    response = stats.summarise()
+    if request.GET.get('reset'):
+        stats.reset()
+
+    return JsonResponse(response, safe=False)
+
+
+def api_stats_cache(request):
+    """Show the hits and misses of the game cache in this process, superusers only, see gamecache
+
+    Add ?reset=1 to clear the figures after showing them.
+    """
+
+    if not request.user.is_superuser:
+        raise PermissionDenied("Requires superuser access.")
+
+    response = gamecache.get_counts()
+    if request.GET.get('reset'):
+        gamecache.reset_counts()
+
+    return JsonResponse(response)
+
+
 def index(request):
-    """A main landing page."""
+    """A main landing page.
+
+    Games are listed a page at a time, in name order, with their players fetched in one more query. The
+    optional ?prefix= and ?after= query parameters are as for api_games_index().
+    """
+
+    prefix = request.GET.get('prefix') or None
+    after = request.GET.get('after') or None
+    page_size = settings.BATTLESHIPS_INDEX_PAGE_SIZE
 
-    games = Game.objects.all()
+    # Fetch one more than is shown, to find out if there is another page
+    games = list(filter_by_name(Game.objects.all().prefetch_related('players'), prefix, after, page_size + 1))
+    next_after = games[page_size - 1].name if len(games) > page_size else None
 
     template = loader.get_template('index.html')
     context = {
-        'games': games,
+        'games': games[:page_size],
+        'prefix': prefix,
+        'next_after': next_after,
     }
     return HttpResponse(template.render(context, request))
 
 
 
+def _get_player_loader(game):
+    """Return a function that finds a player of a game by name, without a query each time
+
+    Players are kept when a game is archived, but may since have been deleted, in which case an unsaved
+    Player is made up so the templates can still show the name.
+    """
+
+    players = {game_player.name: game_player for game_player in game.players.all()}
+
+    def get_player(name):
+        return players.get(name) or Player(name=name)
+
+    return get_player
+
+
+def _load_game_state(game, player, sequence):
+    """Rebuild the ships and actions of a game after a given event as (unsaved) model objects for the templates
+
+    game        the Game
+    player      if supplied, only ships for this Player are included
+    sequence    the number of the event in the game log
+
+    returns a tuple (ships, actions) of lists
+    """
+
+    get_player = _get_player_loader(game)
+    state = game.get_state(sequence)
+
+    ships = []
+    for ship in state["ships"].values():
+        if player and ship["player"] != player.name:
+            continue
+        ships.append(Ship(name=ship["name"], game=game, player=get_player(ship["player"]), x=ship["x"],
+                          y=ship["y"], orientation=ship["orientation"], length=ship["length"]))
+
+    actions = []
+    for (x, y, player_name, result) in state["strikes"]:
+        actions.append(Action(game=game, player=get_player(player_name), x=x, y=y, result=result))
+
+    return (ships, actions)
+
+
+def _load_archived_game(game, player):
+    """Rebuild the ships and actions of an archived game as (unsaved) model objects for the templates
+
+    game    the archived Game
+    player  if supplied, only ships for this Player are included
+
+    returns a tuple (ships, actions) of lists
+    """
+
+    get_player = _get_player_loader(game)
+
+    ships = []
+    for ship in game.iter_archived_ships():
+        if player and ship["player"] != player.name:
+            continue
+        ships.append(Ship(name=ship["name"], game=game, player=get_player(ship["player"]), x=ship["x"],
+                          y=ship["y"], orientation=ship["orientation"], length=ship["length"]))
+
+    actions = []
+    for action in game.iter_archived_actions():
+        (x, y) = action["location"]
+        actions.append(Action(id=action["id"], game=game, player=get_player(action["player"]), x=x, y=y,
+                              result=action["result"], created=parse_datetime(action["created"])))
+
+    return (ships, actions)
+
+
 def view_game(request, game_name, player_name=None, secret=None):
     """A simple view to watch a game, if player is specified, other player ships are not shown
 
@@ -353,6 +949,11 @@ def view_game(request, game_name, player_name=None, secret=None):
     This view is intended to help students check their API, and even be able to play without
     a complete API. It also allows admin users to see what's actual going on.
 
+    An optional ?event=N query parameter shows the game as it was after that event in its log.
+
+    Spectators refresh this a lot, so each page is cached by the game version and the player viewing it,
+    and a browser that already has the current page gets 304 Not Modified.
+
     """
 
     # Get the game
@@ -360,7 +961,7 @@ def view_game(request, game_name, player_name=None, secret=None):
 
     # Get the player if defined
     if player_name:
-        player = get_object_or_404(Player, name=player_name)
+        player = get_object_or_404(Player.objects.select_related('playersecret'), name=player_name)
         if player.get_secret() != secret:
             # Superusers should be able to skip this (to show a student their own view, for instance).
             if not request.user.is_superuser:
@@ -371,25 +972,62 @@ def view_game(request, game_name, player_name=None, secret=None):
             raise PermissionDenied("Requires superuser access.")
         player = None
 
-    # Get the ships, and filter by player if need be
-    ships = Ship.objects.all().filter(game=game).order_by("player")
-    if player:
-        ships = ships.filter(player=player)
+    try:
+        sequence = _get_int_parameter(request, 'event')
+    except ValueError:
+        return HttpResponse("Invalid event", status=400)
+
+    # The page only changes with the game, so there may be no need to send it again, or even to build it
+    etag = _get_game_etag(game, 'view', player.id if player else 'all', 'latest' if sequence is None else sequence)
+    not_modified = _get_not_modified(request, etag, game.modified)
+    if not_modified:
+        return not_modified
+
+    cache_key = f"battleships:view_game:{etag}"
+    content = cache.get(cache_key)
+    if content is None:
+        content = _render_game(request, game, player, sequence)
+        cache.set(cache_key, content, settings.BATTLESHIPS_VIEW_CACHE_TIMEOUT)
+
+    return _set_validators(HttpResponse(content), etag, game.modified)
+
 
-    # Get the history
-    actions = Action.objects.all().filter(game=game)
+def _render_game(request, game, player, sequence):
+    """Render the page for view_game(), with the same arguments, and return the HTML
 
-    # Create a two dimensional list (this will be 0-29 / 0-29 probably)
-    grid = [[None] * game.maximum_x for i in range(game.maximum_y)]
-    # Populate it with the ships in any squares
+    The ships and actions are fetched along with their players, so there are only a few queries however
+    much is on the board.
+    """
+
+    if sequence is not None:
+        (ships, actions) = _load_game_state(game, player, sequence)
+    elif game.archived:
+        (ships, actions) = _load_archived_game(game, player)
+    else:
+        # Get the ships, and filter by player if need be
+        ships = Ship.objects.all().filter(game=game).select_related('player').order_by("player")
+        if player:
+            ships = ships.filter(player=player)
+
+        # Get the history
+        actions = Action.objects.all().filter(game=game).select_related('player')
+
+    # Find the ship in each occupied square, which is all that needs storing however big the board is
+    cells = dict()
     for ship in ships:
-        for location in ship.locations.all():
-            # Subtract 1 because index starts from 0, locations from 1
-            grid[location.x-1][location.y-1] = ship
+        for (x, y) in ship.get_locations_as_tuples():
+            cells[(x, y)] = ship
+
+    # Create a two dimensional list, a row for each x, if the board is small enough to draw
+    if game.maximum_x * game.maximum_y <= settings.BATTLESHIPS_VIEW_GRID_CELLS:
+        grid = [[cells.get((x, y)) for y in range(1, game.maximum_y + 1)] for x in range(1, game.maximum_x + 1)]
+    else:
+        grid = None
 
     template = loader.get_template('view_game.html')
     context = {
         'game': game,
+        'players': list(game.players.all()),
         'player': player,
         'ships': ships,
         'actions': actions,
@@ -397,6 +1035,6 @@ def view_game(request, game_name, player_name=None, secret=None):
         'xrange': range(0, game.maximum_x),
         'yrange': range(0, game.maximum_y),
     }
-    return HttpResponse(template.render(context, request))
+    return template.render(context, request)
 
 
@@ -0,0 +1,24 @@
+# Battleships workers.py
+#
+# Functions run in worker processes, to play tournament games in parallel. Nothing here imports the models
+# at the top, so that a newly started worker can set up Django before they are loaded.
+
+import django
+
+
+def init_worker():
+    """Set up Django in a new worker process"""
+
+    django.setup()
+
+
+def play_tournament_game(game_id):
+    """Play a tournament game to completion, by id, see Tournament.play_game()
+
+    returns a tuple (game_id, strikes)
+    """
+
+    from .models import Game
+
+    game = Game.objects.select_related('tournament').get(id=game_id)
+    return (game_id, game.tournament.play_game(game))